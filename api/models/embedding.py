@@ -7,11 +7,14 @@ class EmbeddingMetadata(BaseModel):
     subject: Optional[str] = None
     from_name: Optional[str] = None
     vector: Optional[List[float]] = None
+    vector_b64: Optional[str] = None # compact alternative to vector: base64 of little endian float32/float16 bytes
+    vector_dtype: Optional[str] = None # dtype of vector_b64: float32 (default) or float16
     created: Optional[int] = None
 
 class EmbeddingMatch(BaseModel):
     message_id: str
-    score: Optional[float] = None
+    score: Optional[float] = None # dense (cosine) score
+    rerank_score: Optional[float] = None # cross-encoder score (only for reranked matches, which are ordered by it)
     created: Optional[int] = None
     metadata: Optional[EmbeddingMetadata] = None
     text: Optional[str] = None
@@ -21,6 +24,7 @@ class EmbeddingResponse(BaseModel):
     matches: Optional[List[EmbeddingMatch]] = None
     model: Optional[str] = None
     knee: Optional[int] = None # knee-point detection (suggested number of matches)
+    rerank: Optional[str] = None # rerank path taken: none, skipped, band or full
 
 class EmbeddingRequest(BaseModel):
     message_id: str
@@ -32,6 +36,13 @@ class EmbeddingUpsertRequest(BaseModel):
     address: str
     metadata: EmbeddingMetadata
 
+class EmailSummary(BaseModel):
+    message_id: str
+    subject: Optional[str] = None
+    snippet: Optional[str] = None
+    created: Optional[int] = None
+    folder: Optional[str] = None
+
 class DeleteRequest(BaseModel):
     message_ids: List[str]
     address: str
\ No newline at end of file
@@ -3,6 +3,7 @@ from .health_check import router as healthcheck_router
 from .embeddings_api import router as embeddings_router
 from .token_api import router as token_router
 from .llm_api import router as llm_router
+from .metrics_api import router as metrics_router
 
 main_router = APIRouter()
 
@@ -10,6 +11,7 @@ main_router.include_router(healthcheck_router)
 main_router.include_router(embeddings_router)
 main_router.include_router(token_router)
 main_router.include_router(llm_router)
+main_router.include_router(metrics_router)
 
 @main_router.get("/")
 async def index():
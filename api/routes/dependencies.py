@@ -4,6 +4,10 @@ from api.services.embedding_service import EmbeddingService
 from api.services.pinecone_service import PineconeService
 from api.services.embedding_task_queue import EmbeddingTaskQueue
 from api.services.llm_service import LLMService
+from api.services.overfetch_service import OverfetchService
+from api.services.rerank_service import RerankService
+from api.services.deletion_service import DeletionService
+from api.services.missing_ids_cache import MissingIdsCache
 from fastapi.security import OAuth2PasswordBearer
 from typing_extensions import Annotated
 
@@ -23,6 +27,18 @@ def get_embedding_task_queue(request: Request) -> EmbeddingTaskQueue:
 def get_llm_service(request: Request) -> LLMService:
     return request.app.state.llm_service
 
+def get_overfetch_service(request: Request) -> OverfetchService:
+    return request.app.state.overfetch_service
+
+def get_rerank_service(request: Request) -> RerankService:
+    return request.app.state.rerank_service
+
+def get_deletion_service(request: Request) -> DeletionService:
+    return request.app.state.deletion_service
+
+def get_missing_ids_cache(request: Request) -> MissingIdsCache:
+    return request.app.state.missing_ids_cache
+
 reuseable_oauth = OAuth2PasswordBearer(
     tokenUrl="/api/token",
     scheme_name="JWT"
@@ -1,13 +1,17 @@
 
 from tools.optimal_embeddings_model.data_types.email import Email
-from ..models.embedding import EmbeddingMatch, EmbeddingMetadata, EmbeddingResponse, EmbeddingRequest, EmbeddingUpsertRequest, DeleteRequest
-from fastapi import APIRouter, Depends, HTTPException
-from ..services.couchdb_service import CouchDBService
+from ..models.embedding import EmbeddingMatch, EmbeddingMetadata, EmbeddingResponse, EmbeddingRequest, EmbeddingUpsertRequest, DeleteRequest, EmailSummary
+from fastapi import APIRouter, Depends, HTTPException, Response
+from ..services.couchdb_service import CouchDBService, SEARCH_SUMMARY_FIELD, SNIPPET_LENGTH
 from ..services.embedding_service import EmbeddingService
 from ..services.pinecone_service import PineconeService
 from ..services.embedding_task_queue import EmbeddingTaskQueue
 from ..services.llm_service import LLMService
-from .dependencies import get_couchdb_service, get_embedding_service, get_pinecone_service, get_embedding_task_queue, get_llm_service
+from ..services.overfetch_service import OverfetchService
+from ..services.rerank_service import RerankService
+from ..services.deletion_service import DeletionService
+from ..services.missing_ids_cache import MissingIdsCache
+from .dependencies import get_couchdb_service, get_embedding_service, get_pinecone_service, get_embedding_task_queue, get_llm_service, get_overfetch_service, get_rerank_service, get_deletion_service, get_missing_ids_cache
 from fastapi import Query, Security
 from api.routes.extend_token_middleware import verify_and_extend_token
 from api.models.system_user import SystemUser
@@ -17,15 +21,58 @@ import threading
 import asyncio
 from loguru import logger
 import json
-from typing import List
+from typing import Dict, List
 import traceback
-from api.utils.query_composer import QueryComposer, QueryParams
-from kneed import KneeLocator
+from api.utils.query_composer import QueryParams, get_query_composer
+from api.utils.vectors import decode_vector, validate_vector
+from api.utils.tracing import RequestTrace
+from config import get_config
 import datetime
 from api.models.llm import EmailDocument
+from tools.optimal_embeddings_model.mailio_ai_libs.rerank_cascade import RERANK_NONE
+from tools.optimal_embeddings_model.mailio_ai_libs.knee import find_knee
 
 router = APIRouter()
 
+def hydrate_matches(couchdb_service: CouchDBService, address: str, matches: list, sort: str = "NO_SORT") -> tuple[List[EmailSummary], List[str]]:
+    """
+    Collect subject and snippet for Pinecone matches.
+    Vectors indexed with subject/snippet metadata only need an existence check in the couch database,
+    older vectors are hydrated from the message summaries.
+    Returns:
+        Tuple[List[EmailSummary], List[str]]: The summaries and the IDs missing in the database
+    """
+    with_snippet = {}
+    without_snippet = []
+    for match in matches:
+        metadata = match.metadata or {}
+        if "snippet" in metadata:
+            with_snippet[match.id] = metadata
+        else:
+            without_snippet.append(match.id)
+
+    summaries: List[EmailSummary] = []
+    missing_ids: List[str] = []
+    if with_snippet:
+        missing = couchdb_service.get_missing_ids(address, list(with_snippet.keys()))
+        missing_ids.extend(missing)
+        missing = set(missing)
+        for _id, metadata in with_snippet.items():
+            if _id in missing:
+                continue
+            summaries.append(EmailSummary(
+                message_id=_id.replace("+", " "),
+                subject=metadata.get("subject", None),
+                snippet=metadata.get("snippet", None),
+                created=metadata.get("created", None),
+                folder=metadata.get("folder", None),
+            ))
+    if without_snippet:
+        hydrated, missing = couchdb_service.get_bulk_summaries_by_id(address, without_snippet, sort)
+        summaries.extend(hydrated)
+        missing_ids.extend(missing)
+    return summaries, missing_ids
+
 @router.post("/api/v1/embedding/{address}/message/{message_id}", response_model=EmbeddingResponse, response_model_exclude_none=True) 
 async def upsert_embedding_by_message_id(
     message_id: str,
@@ -60,21 +107,20 @@ async def upsert_embedding(
     """
     if body.metadata is None:
         raise HTTPException(status_code=400, detail="Metadata is missing")
-    if body.metadata.vector is None:
+    if body.metadata.vector is None and body.metadata.vector_b64 is None:
         raise HTTPException(status_code=400, detail="Vector is missing")
     if body.metadata.created is None:
         raise HTTPException(status_code=400, detail="Created date is missing")
         
     try:
-        request_vector = body.metadata.vector
-        # validate request vector for dimensions and type
-        if len(request_vector) != embedding_service.model.config.hidden_size:
-            raise ValueError("Invalid vector size")
-        if not all(isinstance(x, float) for x in request_vector):
-            raise ValueError("Invalid vector type")
+        # validate request vector for dimensions and values
+        dimension = embedding_service.model.config.hidden_size
+        if body.metadata.vector_b64 is not None:
+            request_vector = decode_vector(body.metadata.vector_b64, body.metadata.vector_dtype, dimension)
+        else:
+            request_vector = validate_vector(body.metadata.vector, dimension)
         
-        metadata = body.metadata.model_dump()
-        del metadata["vector"]
+        metadata = body.metadata.model_dump(exclude={"vector", "vector_b64", "vector_dtype"})
 
         # remove None values from metadata
         metadata = {k: v for k, v in metadata.items() if v is not None}
@@ -95,6 +141,8 @@ async def upsert_embedding(
         
         # if upsert successfull 
         message["search"] = True
+        # message body is encrypted, the search result falls back to the vector metadata
+        message[SEARCH_SUMMARY_FIELD] = {}
         couchdb_service.put_message(message, body.address)
     except ValueError as e:
         logger.debug(f"ValueError: {e}")
@@ -114,6 +162,7 @@ async def upsert_embedding(
 
 @router.get("/api/v1/embedding", response_model=EmbeddingResponse,  response_model_exclude_none=True)
 async def query_embedding(
+    response: Response,
     address: str = Query(..., description="The address of the user"),
     query: str = Query(..., description="The query string"),
     top_k: int = Query(10, description="The number of top results to return"),
@@ -125,11 +174,17 @@ async def query_embedding(
     embedding_service: EmbeddingService = Depends(get_embedding_service),
     couchdb_service: CouchDBService = Depends(get_couchdb_service),
     llm_service: LLMService = Depends(get_llm_service),
+    overfetch_service: OverfetchService = Depends(get_overfetch_service),
+    rerank_service: RerankService = Depends(get_rerank_service),
+    deletion_service: DeletionService = Depends(get_deletion_service),
+    missing_ids_cache: MissingIdsCache = Depends(get_missing_ids_cache),
     user: SystemUser = Security(verify_and_extend_token),
+    config: Dict = Depends(get_config),
 ):
     """
     Query embeddings
     """
+    trace = RequestTrace()
     try:
         short_query = query
         # pinecone_filter:QueryParams = {"sort": "NO_SORT", "timestampBefore": None, "timestampAfter": None, "fromEmail": None}
@@ -139,7 +194,8 @@ async def query_embedding(
         pinecone_filter.timestampAfter = None
         pinecone_filter.fromEmail = None
         try:
-            result = await llm_service.selfquery(query)
+            with trace.span("selfquery"):
+                result = await llm_service.selfquery(query)
             result_json = json.loads(result)
             logger.debug(f"LLM result JSON: {result_json}")
             short_query = result_json.get("query", query)
@@ -147,12 +203,9 @@ async def query_embedding(
                 short_query = query
             short_query = "query: " + short_query
 
-            query_composer = QueryComposer()
-            pinecone_filter = query_composer.compose(result_json)
-            if pinecone_filter.sort == "NO_SORT":
-                print("no sort")
-            else:
-                print(f"sorting by created {pinecone_filter.sort}")
+            with trace.span("compose"):
+                pinecone_filter = get_query_composer().compose_cached(result_json)
+            logger.debug(f"sort: {pinecone_filter.sort}")
             beforeTimestamp = pinecone_filter.timestampBefore
             afterTimestamp = pinecone_filter.timestampAfter
             from_email = pinecone_filter.fromEmail
@@ -162,12 +215,16 @@ async def query_embedding(
             logger.error(f"Traceback: {traceback.format_exc()}")
             # logger.debug(f"LLM result JSON: {result_json}")
 
-        vector = embedding_service.embedder.embed(short_query)
+        with trace.span("embedding"):
+            vector = embedding_service.embedder.embed(short_query)
         
         # query embedding
         search_top_number = top_k
+        overfetch_shape = None
         if pinecone_filter is None or pinecone_filter.sort is None or pinecone_filter.sort == "" or pinecone_filter.sort == "NO_SORT":
-            search_top_number = top_k * 5
+            # over-fetch to account for filtering (factor adapts to the observed survival rate)
+            overfetch_shape = overfetch_service.filter_shape(folder, beforeTimestamp, afterTimestamp, from_email)
+            search_top_number = overfetch_service.top_k_for(address, overfetch_shape, top_k)
         elif pinecone_filter.sort == "desc":
             # since we are sorting by desc, we need to search for the most recent messages
             # we will search for the most recent 90 days
@@ -178,54 +235,67 @@ async def query_embedding(
             # we will skip today's messages
             beforeTimestamp = int(datetime.datetime.now().timestamp() * 1000 - (1 * 24 * 60 * 60 * 1000))
             search_top_number = 1000
-        
-        response = pinecone_service.query(
-            address=address, 
-            query_embedding=vector.tolist(), 
-            top_k=search_top_number, # 5 times more results than requested (to account for filtering and sorting)
-            folder=folder, 
-            beforeTimestamp=beforeTimestamp, 
-            afterTimestamp=afterTimestamp, 
-            from_email=from_email
-        )
-        matches = response.matches or []
-        output_matches:List[EmbeddingMatch] = []
 
-        # knee-point detection
-        knee = len(matches)
-        if len(matches) > 3:
-            # print scores to console
-            kl = KneeLocator(
-                range(len(matches)),
-                [match.score for match in matches],
-                curve="convex",
-                direction="decreasing"
-            )
-            knee = kl.knee
-            
-        logger.debug(f"suggested knee point: {knee}")
+        sort = pinecone_filter.sort if pinecone_filter is not None else "NO_SORT"
 
-        all_ids = [match.id for match in matches]
-        
-        # retrieve all document by id from the couch database (for display purposes)
-        if len(all_ids) > 0:
-            emails, missing_ids = couchdb_service.get_bulk_by_id(address, all_ids, pinecone_filter.sort)
-            if missing_ids:
-                logger.debug(f"missing ids in database: {missing_ids}") 
-                asyncio.create_task(pinecone_service.delete_by_ids_async(missing_ids, address))
-                logger.debug(f"deleted {len(missing_ids)} messages from Pinecone")
+        def fetch_candidates(candidates_top_k: int):
+            """
+            Query Pinecone, detect the knee and hydrate the matches from the couch database
+            Returns the number of candidates Pinecone returned too (before the known missing ids are filtered)
+            """
+            with trace.span("pinecone_query"):
+                query_response = pinecone_service.query(
+                    address=address, 
+                    query_embedding=vector,
+                    top_k=candidates_top_k,
+                    folder=folder, 
+                    beforeTimestamp=beforeTimestamp, 
+                    afterTimestamp=afterTimestamp, 
+                    from_email=from_email
+                )
+            # skip vectors already known to be missing in the database (their delete is pending)
+            fetched = len(query_response.matches or [])
+            matches = missing_ids_cache.filter_matches(address, query_response.matches or [])
 
-            email_dict = {email.message_id: email for email in emails if email is not None}
+            # knee-point detection over the candidates (drives the over-fetch factor)
+            candidates_knee = len(matches)
+            if len(matches) > 3:
+                with trace.span("knee"):
+                    candidates_knee = find_knee([match.score for match in matches])
+
+            # subject and snippet for display and reranking (and drop messages no longer in the database)
+            with trace.span("hydration"):
+                summaries, missing_ids = hydrate_matches(couchdb_service, address, matches, sort)
+            return matches, fetched, candidates_knee, summaries, missing_ids
+
+        matches, fetched, candidates_knee, summaries, missing_ids = fetch_candidates(search_top_number)
+        if overfetch_shape is not None:
+            requery_top_k = overfetch_service.requery_top_k(top_k, search_top_number, fetched, len(summaries))
+            if requery_top_k is not None:
+                logger.debug(f"only {len(summaries)} of {fetched} candidates survived, re-querying with top_k={requery_top_k}")
+                search_top_number = requery_top_k
+                matches, fetched, candidates_knee, summaries, missing_ids = fetch_candidates(search_top_number)
+            overfetch_service.record(address, overfetch_shape, top_k, fetched, len(summaries), candidates_knee)
+
+        output_matches:List[EmbeddingMatch] = []
+
+        if missing_ids:
+            logger.debug(f"missing ids in database: {missing_ids}") 
+            if deletion_service.submit(address, missing_ids):
+                logger.debug(f"queued {len(missing_ids)} messages for deletion from Pinecone")
+
+        summary_dict = {summary.message_id: summary for summary in summaries if summary is not None}
+        missing_set = set(missing_ids)
 
         for match in matches:
             match_id = match.id.replace("+", " ") # i don't know what exactly couchdb does but i know it doesn't like + in there
+            # drop messages no longer in the database (before clipping, so survivors fill top_k)
+            if match.id in missing_set or match_id not in summary_dict:
+                continue
             metadata = match.metadata or {}
-            # check if match_id is in the email_dict
-            subject = None
-            if match_id not in email_dict:
+            subject = summary_dict[match_id].subject
+            if subject is None:
                 subject = metadata.get("subject", None)
-            else:
-                subject = email_dict[match_id].subject
 
             output_matches.append(EmbeddingMatch(
                 message_id=match.id,
@@ -242,40 +312,59 @@ async def query_embedding(
         # clip results to top_k
         output_matches = output_matches[:top_k]
 
+        # knee-point detection over the returned results (the list the cascade reranks)
+        knee = len(output_matches)
+        if len(output_matches) > 3:
+            with trace.span("knee"):
+                knee = find_knee([m.score for m in output_matches])
+        logger.debug(f"suggested knee point: {knee}")
+
         # rerank here
+        rerank_path = RERANK_NONE
         if len(output_matches) > 3:
+            # cascade: skip the cross-encoder when the dense scores are decisive, otherwise rerank the ambiguous band
+            rerank_path, rerank_start, rerank_end = rerank_service.cascade([m.score for m in output_matches], knee)
+            band_matches = output_matches[rerank_start:rerank_end]
+
             email_docs = {}
-            # collect top_k output matches as email documents
-            for match in output_matches:
-                if match.message_id in email_dict:
-                    email = email_dict[match.message_id]
-                    if email.subject is None and (email.sentences is None or len(email.sentences) == 0):
+            # collect the band of output matches as email documents
+            for match in band_matches:
+                summary = summary_dict.get(match.message_id.replace("+", " "))
+                if summary is not None:
+                    if summary.subject is None and not summary.snippet:
                         continue
                     email_docs[match.message_id] = EmailDocument(
                         id=match.message_id,
-                        text=".".join(email.sentences),
+                        text=summary.snippet or summary.subject,
                         score=match.score
                     )
-                
-            reranked_results = pinecone_service.rerank(query, list[EmailDocument](email_docs.values()))    # convert to list to avoid type error
-            score_lookup_map = {result["id"]: result["score"] for result in reranked_results["results"]}
-            # overwrite scores in output_matches
-            for match in output_matches:
-                if match.message_id in score_lookup_map:
-                    match.score = score_lookup_map[match.message_id]
-                    # clip sentences to 200 characters
-                    if email_docs[match.message_id] is not None:
-                        if len(email_docs[match.message_id].text) > 200:
-                            match.text = email_docs[match.message_id].text[:200]
-                        else:
-                            match.text = email_docs[match.message_id].text
-            output_matches = sorted(output_matches, key=lambda m: m.score, reverse=True)
+
+            if len(email_docs) > 0:
+                with trace.span("rerank"):
+                    reranked_results = rerank_service.rerank(query, list[EmailDocument](email_docs.values()))    # convert to list to avoid type error
+                score_lookup_map = {result["id"]: result["score"] for result in reranked_results["results"]}
+                # score keeps the dense score (comparable across the response), the cross-encoder score is returned separately
+                for match in band_matches:
+                    if match.message_id in score_lookup_map:
+                        match.rerank_score = score_lookup_map[match.message_id]
+                # reranked matches first (by rerank score), the rest of the band keeps the dense order
+                reranked_matches = sorted([m for m in band_matches if m.message_id in score_lookup_map], key=lambda m: m.rerank_score, reverse=True)
+                band_matches = reranked_matches + [m for m in band_matches if m.message_id not in score_lookup_map]
+                output_matches = output_matches[:rerank_start] + band_matches + output_matches[rerank_end:]
+            logger.debug(f"rerank path: {rerank_path} ({rerank_start}:{rerank_end})")
+
+        # clip text to the snippet length
+        for match in output_matches:
+            summary = summary_dict.get(match.message_id.replace("+", " "))
+            if summary is not None and (summary.snippet or summary.subject):
+                match.text = (summary.snippet or summary.subject)[:SNIPPET_LENGTH]
 
         resp:EmbeddingResponse = EmbeddingResponse(
             address=address,
             matches=output_matches,
             model=embedding_service.embedding_model,
-            knee=knee
+            knee=knee,
+            rerank=rerank_path
         )
         return resp
     except NotFoundError as e:
@@ -293,12 +382,18 @@ async def query_embedding(
         logger.error(f"Exception: {e}")
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        trace.finish()
+        if (config.get("search") or {}).get("server_timing", False):
+            server_timing = trace.server_timing()
+            if server_timing:
+                response.headers["Server-Timing"] = server_timing
 
 
 @router.delete("/api/v1/embedding")
 async def delete_message_by_ids(
     body: DeleteRequest,
-    pinecone_service: PineconeService = Depends(get_pinecone_service),
+    deletion_service: DeletionService = Depends(get_deletion_service),
     user: dict = Depends(verify_and_extend_token),
     status_code: int = 204, # no content on success
 ):
@@ -306,9 +401,9 @@ async def delete_message_by_ids(
     Delete a message embedding by ID.
     """
     try:
-        # Delete from Pinecone asynchronously in background
+        # Delete from Pinecone in background (waits only when the deletion queue is full)
         if body.message_ids:
-            asyncio.create_task(pinecone_service.delete_by_ids_async(body.message_ids, body.address))
+            await deletion_service.delete(body.address, body.message_ids)
     except Exception as e:
         logger.debug(f"Exception: {e}")
         logger.debug(f"Traceback: {traceback.format_exc()}")
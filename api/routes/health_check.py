@@ -2,6 +2,7 @@ from fastapi import APIRouter, Request, Depends
 from ..models.health_check import HealthCheckResponse
 from typing import Dict
 from config import get_config
+from ..services.client_factory import get_client_factory
 
 router = APIRouter()
 
@@ -10,4 +11,11 @@ async def health_check(config: Dict = Depends(get_config)):
     return {
         "status": "ok",
         "version": config.get("version", "0.0.4")
-    }
\ No newline at end of file
+    }
+
+@router.get("/api/healthcheck/pools")
+async def pool_stats(config: Dict = Depends(get_config)):
+    """
+    Connection pool usage of the shared CouchDB, Pinecone and OpenAI clients (this process)
+    """
+    return get_client_factory(config).pool_stats()
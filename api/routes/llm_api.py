@@ -1,11 +1,12 @@
 from fastapi import APIRouter
 from ..models.llm import LLMQueryWithDocuments
 from ..services.llm_service import LLMService
-from fastapi import Depends
+from fastapi import Depends, Query
+from fastapi.responses import StreamingResponse
 from .dependencies import get_llm_service
 import json
-from ..services.pinecone_service import PineconeService
-from .dependencies import get_pinecone_service
+from ..services.rerank_service import RerankService
+from .dependencies import get_rerank_service
 
 router = APIRouter()
 
@@ -13,26 +14,38 @@ router = APIRouter()
 async def rerank(
     queryWithDocuments: LLMQueryWithDocuments,
     llm_service: LLMService = Depends(get_llm_service),
-    pinecone_service: PineconeService = Depends(get_pinecone_service),
+    rerank_service: RerankService = Depends(get_rerank_service),
 ):
     """
-    Rerank a message using a LLM.
+    Rerank messages using the configured cross-encoder (hosted or local).
     """
     if len(queryWithDocuments.documents) == 0:
         return { "results": [] }
-    reranked_results = pinecone_service.rerank(queryWithDocuments.query, queryWithDocuments.documents)
+    reranked_results = rerank_service.rerank(queryWithDocuments.query, queryWithDocuments.documents)
     return reranked_results
 
 @router.post("/api/v1/llm/insights")
 async def insights(
     queryWithDocuments: LLMQueryWithDocuments,
+    stream: bool = Query(False, description="Stream the insights as newline delimited JSON events"),
     llm_service: LLMService = Depends(get_llm_service),
 ):
     """
     Extract insights from a message using a LLM.
+    With stream=true the response is NDJSON: `answer` and `result` events are sent as soon as the model
+    completes them, the last `insights` event holds the complete object (same as the non-streaming response),
+    or an `error` event when the model request or its output failed mid-stream.
     """
     if len(queryWithDocuments.documents) == 0:
-        return { "query": queryWithDocuments.query, "results": [], "answer": "No results found" }
+        empty = { "query": queryWithDocuments.query, "results": [], "answer": "No results found" }
+        if stream:
+            return StreamingResponse(iter([json.dumps({"event": "insights", "data": empty}) + "\n"]), media_type="application/x-ndjson")
+        return empty
+    if stream:
+        async def ndjson_events():
+            async for event in llm_service.stream_insights(queryWithDocuments):
+                yield json.dumps(event) + "\n"
+        return StreamingResponse(ndjson_events(), media_type="application/x-ndjson")
     insights = await llm_service.extract_insights(queryWithDocuments)
     insights_json = json.loads(insights)
     return insights_json
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from ..utils.metrics import REGISTRY
+from ..services.embedding_task_queue import EmbeddingTaskQueue, REDIS_QUEUE
+from ..services.embedding_cache import EMBEDDING_CACHE_STATS_KEY
+from ..services.pipeline_metrics import render_pipeline_metrics
+from .dependencies import get_embedding_task_queue
+from loguru import logger
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(embedding_task_queue: EmbeddingTaskQueue = Depends(get_embedding_task_queue)):
+    """
+    Prometheus text exposition of the in-process metrics (search stage latencies, external requests)
+    and of the embedding pipeline metrics shared in Redis (worker/sweeper counters and stage timings, queue depth)
+    """
+    lines = [REGISTRY.render().rstrip("\n")]
+    try:
+        lines.extend(render_pipeline_metrics(embedding_task_queue.redis_conn, [REDIS_QUEUE], cache_stats_key=EMBEDDING_CACHE_STATS_KEY))
+    except Exception as e:
+        logger.warning(f"Pipeline metrics unavailable: {e}")
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4; charset=utf-8")
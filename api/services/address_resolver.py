@@ -0,0 +1,65 @@
+from typing import Dict, List, Optional
+from .couchdb_service import CouchDBService
+from .sync_state import SyncStateStore
+from logging_handler import use_logginghandler
+
+logger = use_logginghandler()
+
+class AddressResolver:
+    """
+    Resolves subscribers to the (legacy) address their user database and Pinecone namespace are keyed by,
+    and verifies the search indexes of user databases. Both rarely change, so mappings and
+    "index verified" markers are cached in Redis with a TTL across sync runs.
+    """
+
+    def __init__(self, cfg: Dict, couchdb_service: CouchDBService, sync_state: SyncStateStore):
+        """
+        Initialize the address resolver
+        Args:
+            cfg: dict: The configuration (optional `sync` section)
+            couchdb_service: CouchDBService: The CouchDB service
+            sync_state: SyncStateStore: The Redis backed sync state
+        """
+        sync_cfg: Dict = cfg.get("sync") or {}
+        self.mapping_ttl = int(sync_cfg.get("mapping_ttl", 24 * 60 * 60))
+        self.index_verified_ttl = int(sync_cfg.get("index_verified_ttl", 7 * 24 * 60 * 60))
+        self.couchdb_service = couchdb_service
+        self.sync_state = sync_state
+
+    def resolve_all(self, subscribers: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Resolve the addresses of all subscribers (cached mappings first, the rest in bulk `$in` queries)
+        Returns:
+            Dict[str, Optional[str]]: subscriber => address to sync (None if the subscriber has no valid legacy address)
+        """
+        mapped = self.sync_state.get_cached_mappings(subscribers)
+        uncached = [subscriber for subscriber in subscribers if subscriber not in mapped]
+        if uncached:
+            try:
+                docs = self.couchdb_service.get_mailio_mappings(uncached)
+                # the subscriber keeps its address unless the mapping has a legacyAddress (a null one is skipped)
+                fetched = {subscriber: docs.get(subscriber, {}).get("legacyAddress", subscriber) for subscriber in uncached}
+                self.sync_state.cache_mappings(fetched, self.mapping_ttl)
+                mapped.update(fetched)
+            except Exception as e:
+                # continue with the subscriber addresses, they are looked up again next run
+                logger.exception("Failed to get mailio mappings for %d addresses: %s", len(uncached), e)
+        logger.info("Resolved %d subscribers, %d mappings from cache", len(subscribers), len(subscribers) - len(uncached))
+
+        resolved = {}
+        for subscriber in subscribers:
+            address = mapped[subscriber] if subscriber in mapped else subscriber
+            resolved[subscriber] = address if address and address.startswith("0x") else None
+        return resolved
+
+    def ensure_indexes(self, address: str) -> bool:
+        """
+        Ensure the search indexes of the user database exist (skipped while verified recently)
+        """
+        db_name = self.couchdb_service.address_to_db_name(address)
+        if self.sync_state.is_index_verified(db_name):
+            return True
+        ok = self.couchdb_service.ensure_indexes(address)
+        if ok:
+            self.sync_state.mark_index_verified(db_name, self.index_verified_ttl)
+        return ok
@@ -0,0 +1,259 @@
+from typing import Dict
+from contextlib import contextmanager
+from requests import Session
+from requests.adapters import HTTPAdapter
+from ibmcloudant.cloudant_v1 import CloudantV1
+from ibm_cloud_sdk_core.authenticators import BasicAuthenticator
+from pinecone.grpc import PineconeGRPC, GRPCClientConfig
+from openai import AsyncOpenAI
+import httpx
+import threading
+import os
+try:
+    import h2  # noqa: F401 (required by httpx for HTTP/2)
+    _HTTP2_AVAILABLE = True
+except Exception:
+    _HTTP2_AVAILABLE = False
+
+class PoolStats:
+    """
+    In-flight request counters of a client pool (used to size the pools for our concurrency)
+    """
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def release(self, error: bool = False):
+        with self._lock:
+            self.in_flight -= 1
+            if error:
+                self.errors += 1
+
+    @contextmanager
+    def track(self):
+        self.acquire()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.release(error)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "pool_size": self.size,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "requests": self.requests,
+                "errors": self.errors,
+            }
+
+class TrackedHTTPAdapter(HTTPAdapter):
+    """
+    requests adapter counting in-flight requests of the connection pool
+    """
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        with self.stats.track():
+            return super().send(request, **kwargs)
+
+class TrackedAsyncByteStream(httpx.AsyncByteStream):
+    """
+    Response body that releases the in-flight request once it is closed (streamed responses hold the connection)
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, stats: PoolStats):
+        self.stream = stream
+        self.stats = stats
+        self.error = False
+        self.released = False
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.stream:
+                yield chunk
+        except Exception:
+            self.error = True
+            raise
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self.released:
+                self.released = True
+                self.stats.release(self.error)
+
+class TrackedAsyncHTTPTransport(httpx.AsyncHTTPTransport):
+    """
+    httpx transport counting in-flight requests of the connection pool (until the response body is closed)
+    """
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    async def handle_async_request(self, request):
+        self.stats.acquire()
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException as e:
+            # cancelled requests are released too, but are not errors
+            self.stats.release(error=isinstance(e, Exception))
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=TrackedAsyncByteStream(response.stream, self.stats),
+            extensions=response.extensions,
+        )
+
+class ClientFactory:
+    """
+    Builds the CouchDB (Cloudant), Pinecone (gRPC) and OpenAI clients once per process,
+    with configured connection pool sizes, keep-alive and per-call timeouts (optional `clients` config section)
+    """
+
+    def __init__(self, cfg: Dict):
+        """
+        Initialize the client factory
+        Args:
+            cfg: dict: The configuration
+        """
+        self.cfg = cfg
+        self.pid = os.getpid()
+        clients_cfg: Dict = cfg.get("clients") or {}
+        self.couchdb_cfg: Dict = clients_cfg.get("couchdb") or {}
+        self.pinecone_cfg: Dict = clients_cfg.get("pinecone") or {}
+        self.openai_cfg: Dict = clients_cfg.get("openai") or {}
+
+        self.stats = {
+            "couchdb": PoolStats("couchdb", int(self.couchdb_cfg.get("pool_size", 20))),
+            "pinecone": PoolStats("pinecone", int(self.pinecone_cfg.get("pool_threads", 8))),
+            "openai": PoolStats("openai", int(self.openai_cfg.get("max_connections", 20))),
+        }
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name: str, create):
+        with self._lock:
+            if name not in self._clients:
+                self._clients[name] = create()
+            return self._clients[name]
+
+    def cloudant(self) -> CloudantV1:
+        """
+        Shared Cloudant client (keep-alive session with a bounded connection pool)
+        """
+        return self._get_or_create("couchdb", self._create_cloudant)
+
+    def _create_cloudant(self) -> CloudantV1:
+        couch_cfg: Dict = self.cfg.get("couchdb")
+        auth = BasicAuthenticator(couch_cfg.get("username"), couch_cfg.get("password"))
+        client = CloudantV1(authenticator=auth)
+        client.set_service_url(couch_cfg.get("host"))
+
+        stats = self.stats["couchdb"]
+        session = Session()
+        adapter = TrackedHTTPAdapter(
+            stats,
+            pool_connections=1,
+            pool_maxsize=stats.size,
+            pool_block=bool(self.couchdb_cfg.get("pool_block", True)),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        client.set_http_client(session)
+        client.set_http_config({
+            "timeout": (float(self.couchdb_cfg.get("connect_timeout", 5)), float(self.couchdb_cfg.get("timeout", 30))),
+        })
+        return client
+
+    def pinecone(self) -> PineconeGRPC:
+        """
+        Shared Pinecone gRPC client
+        """
+        return self._get_or_create("pinecone", self._create_pinecone)
+
+    def _create_pinecone(self) -> PineconeGRPC:
+        pinecone_cfg: Dict = self.cfg.get("pinecone")
+        return PineconeGRPC(api_key=pinecone_cfg.get("api_key"), pool_threads=self.stats["pinecone"].size)
+
+    def pinecone_index(self, index_name: str):
+        """
+        Shared gRPC index connection (reused channel, per-call timeout)
+        """
+        def create():
+            grpc_config = GRPCClientConfig(
+                timeout=int(self.pinecone_cfg.get("timeout", 20)),
+                conn_timeout=int(self.pinecone_cfg.get("connect_timeout", 5)),
+                reuse_channel=True,
+                grpc_channel_options={
+                    "grpc.keepalive_time_ms": int(self.pinecone_cfg.get("keepalive_ms", 30000)),
+                    "grpc.keepalive_permit_without_calls": 1,
+                },
+            )
+            return self.pinecone().Index(index_name, grpc_config=grpc_config, pool_threads=self.stats["pinecone"].size)
+        return self._get_or_create(f"pinecone_index:{index_name}", create)
+
+    def openai_async(self) -> AsyncOpenAI:
+        """
+        Shared async OpenAI client (HTTP/2 when available, bounded keep-alive pool)
+        """
+        return self._get_or_create("openai", self._create_openai_async)
+
+    def _create_openai_async(self) -> AsyncOpenAI:
+        timeout = httpx.Timeout(float(self.openai_cfg.get("timeout", 60)), connect=float(self.openai_cfg.get("connect_timeout", 5)))
+        limits = httpx.Limits(
+            max_connections=self.stats["openai"].size,
+            max_keepalive_connections=int(self.openai_cfg.get("max_keepalive", 10)),
+            keepalive_expiry=float(self.openai_cfg.get("keepalive_expiry", 30)),
+        )
+        http2 = bool(self.openai_cfg.get("http2", True)) and _HTTP2_AVAILABLE
+        transport = TrackedAsyncHTTPTransport(self.stats["openai"], http2=http2, limits=limits)
+        http_client = httpx.AsyncClient(transport=transport, timeout=timeout, limits=limits, http2=http2)
+        return AsyncOpenAI(api_key=self.cfg["openai"]["api_key"], http_client=http_client, timeout=timeout)
+
+    def track(self, name: str):
+        """
+        Context manager counting an in-flight call on the named pool (for clients without transport hooks)
+        """
+        return self.stats[name].track()
+
+    def pool_stats(self) -> Dict:
+        """
+        Pool usage of all clients
+        """
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
+
+_client_factory: ClientFactory = None
+_client_factory_lock = threading.Lock()
+
+def get_client_factory(cfg: Dict) -> ClientFactory:
+    """
+    Get the client factory of this process (rebuilt after a fork, connections are not shared across processes)
+    """
+    global _client_factory
+    with _client_factory_lock:
+        if _client_factory is None or _client_factory.pid != os.getpid():
+            _client_factory = ClientFactory(cfg)
+        return _client_factory
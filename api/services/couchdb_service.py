@@ -1,9 +1,10 @@
-from ibmcloudant.cloudant_v1 import CloudantV1, BulkGetQueryDocument
-from ibm_cloud_sdk_core.authenticators import BasicAuthenticator
+from ibmcloudant.cloudant_v1 import CloudantV1, BulkGetQueryDocument, DesignDocument, DesignDocumentViewsMapReduce
 from ibm_cloud_sdk_core.api_exception import ApiException
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 import binascii
 from ..models.errors import NotFoundError, UnauthorizedError, InvalidUsageError
+from ..models.embedding import EmailSummary
+from .client_factory import get_client_factory
 from logging_handler import use_logginghandler
 from tools.optimal_embeddings_model.data_types.email import Email, MessageType
 from tools.optimal_embeddings_model.mailio_ai_libs.collect_emails import extract_message_type, extract_html, extract_text, extract_subject, extract_sender, extract_folder, extract_message_id, extract_created, message_to_sentences
@@ -11,9 +12,46 @@ import threading
 import traceback
 import urllib.parse
 import time
+import base64
+import json
+import html
+import re
 
 logger = use_logginghandler()
 
+# precomputed summary written next to the `search` flag at index time (search result rendering)
+SEARCH_SUMMARY_FIELD = "searchSummary"
+SNIPPET_LENGTH = 200
+# view of the search result fields by message id (the message body is never transferred)
+SEARCH_SUMMARY_DDOC = "ddoc_search_summary"
+SEARCH_SUMMARY_VIEW = "summary_by_id"
+SEARCH_SUMMARY_MAP = "function (doc) { emit(doc._id, {created: doc.created, folder: doc.folder, summary: doc.%s || null}); }" % SEARCH_SUMMARY_FIELD
+
+_HTML_SKIP_BLOCKS = re.compile(r"<(script|style|head)[^>]*>.*?</\1>", re.IGNORECASE | re.DOTALL)
+_HTML_LINKS = re.compile(r"<a\b[^>]*>.*?</a>", re.IGNORECASE | re.DOTALL)
+_HTML_TAGS = re.compile(r"<[^>]+>")
+_WHITESPACE = re.compile(r"\s+")
+SUBJECT_LENGTH = 256
+# folders that are indexed for search (and the message type of indexed messages)
+FIXED_FOLDERS = ["inbox", "sent", "archive", "goodreads"]
+SMTP_MESSAGE_TYPE = "application/mailio-smtp+json"
+
+def normalize_subject(subject) -> str:
+    """
+    Normalize the subject for display (joined if a list, whitespace collapsed, clipped)
+    """
+    if subject is None:
+        return None
+    if isinstance(subject, list):
+        subject = ".".join(filter(lambda s: s.strip(), subject))
+    return _WHITESPACE.sub(" ", subject).strip()[:SUBJECT_LENGTH]
+
+def create_snippet(sentences: List[str]) -> str:
+    """
+    Create the search result snippet from the already parsed sentences
+    """
+    return ".".join(sentences or [])[:SNIPPET_LENGTH]
+
 class CouchDBService:
     """
     A service for interacting with CouchDB
@@ -37,10 +75,8 @@ class CouchDBService:
         if couch_cfg.get("password") is None:
             raise ValueError("CouchDB password is missing")
 
-        auth = BasicAuthenticator(couch_cfg.get("username"), couch_cfg.get("password"))
-        client = CloudantV1(authenticator=auth)
-        client.set_service_url(couch_cfg.get("host"))
-        self.client = client
+        # shared keep-alive client with a bounded connection pool (see ClientFactory)
+        self.client: CloudantV1 = get_client_factory(cfg).cloudant()
 
     def get_db(self, db_name:str):
         """
@@ -65,7 +101,7 @@ class CouchDBService:
         msg_type = extract_message_type(doc)
 
         # list only SMTP emails
-        if msg_type is None or msg_type != "application/mailio-smtp+json":
+        if msg_type is None or msg_type != SMTP_MESSAGE_TYPE:
             if skip_non_smtp:
                 return None
             folder = extract_folder(doc)
@@ -94,6 +130,63 @@ class CouchDBService:
         return email
         
 
+    def create_search_summary(self, email: Email) -> Dict:
+        """
+        Create the search summary (subject and snippet) stored with the message at index time
+        Args:
+            email: Email: The parsed email
+        Returns:
+            dict: The search summary
+        """
+        return {
+            "subject": normalize_subject(email.subject),
+            "snippet": create_snippet(email.sentences),
+        }
+
+    def message_to_summary(self, doc: dict) -> Optional[EmailSummary]:
+        """
+        Convert a message to an EmailSummary. Uses the precomputed search summary if present,
+        otherwise decodes the message once and strips the body just enough for the snippet
+        (no sentence splitting of the whole body)
+        Args:
+            doc: dict: The message to convert
+        Returns:
+            Optional[EmailSummary]: The summary of the message (None if the message can't be decoded)
+        """
+        message_id = extract_message_id(doc)
+        created = extract_created(doc)
+        folder = extract_folder(doc)
+
+        summary = doc.get(SEARCH_SUMMARY_FIELD)
+        if summary is not None:
+            return EmailSummary(message_id=message_id, subject=summary.get("subject"), snippet=summary.get("snippet"), created=created, folder=folder)
+
+        msg_type = extract_message_type(doc)
+        if msg_type is None or msg_type != SMTP_MESSAGE_TYPE:
+            return EmailSummary(message_id=message_id, created=created, folder=folder)
+
+        try:
+            plain_body = base64.b64decode(doc.get("didCommMessage", {}).get("plainBodyBase64", "")).decode("utf-8")
+            if not plain_body:
+                return EmailSummary(message_id=message_id, created=created, folder=folder)
+            email_data = json.loads(plain_body)
+        except Exception as e:
+            logger.warning(f"Skipping malformed message {message_id}: {e}")
+            return None
+
+        subject = normalize_subject(email_data.get("subject"))
+
+        text = email_data.get("bodyHtml")
+        if text is not None:
+            text = _HTML_SKIP_BLOCKS.sub(" ", text)
+            text = _HTML_LINKS.sub(" ", text)
+            text = html.unescape(_HTML_TAGS.sub(" ", text))
+        else:
+            text = email_data.get("bodyText") or ""
+        snippet = _WHITESPACE.sub(" ", text).strip()[:SNIPPET_LENGTH]
+
+        return EmailSummary(message_id=message_id, subject=subject, snippet=snippet, created=created, folder=folder)
+
     def address_to_db_name(self, address:str) -> str:
         """
         Convert an address to a database name
@@ -234,21 +327,140 @@ class CouchDBService:
 
         return messages, missing
 
-    def get_all_subscribed_users(self) -> List[str]:
+    def get_bulk_summaries_by_id(self, address:str, ids:List[str], sort:str = "NO_SORT") -> Tuple[List[EmailSummary], List[str]]:
+        """
+        Get a list of message summaries (subject, snippet, created) by their IDs.
+        The summaries are read by id from a view (see SEARCH_SUMMARY_MAP); message bodies are fetched only
+        for messages indexed before the search summary existed.
+        Args:
+            address: str: The address of the user
+            ids: List[str]: The IDs of the messages to get
+            sort: str: NO_SORT, asc or desc by created
+        Returns:
+            Tuple[List[EmailSummary], List[str]]: The summaries and the IDs missing in the database
+        """
+        if len(ids) == 0:
+            return [], []
+
+        # escaped id => original (Pinecone) id
+        escaped_ids = {}
+        for _id in ids:
+            escaped_ids[_id.replace("+", " ")] = _id # i don't know what exactly couchdb does but i know it doesn't like + in there
+
+        summaries: List[EmailSummary] = []
+        without_summary: List[str] = []
+        found = set()
+        try:
+            db_name = self.address_to_db_name(address)
+            try:
+                response = self.client.post_view(db=db_name, ddoc=SEARCH_SUMMARY_DDOC, view=SEARCH_SUMMARY_VIEW, keys=list(escaped_ids.keys())).get_result()
+            except ApiException as e:
+                # databases created before the view existed get it on first use
+                if e.status_code != 404 or not self.ensure_summary_view(address):
+                    raise e
+                response = self.client.post_view(db=db_name, ddoc=SEARCH_SUMMARY_DDOC, view=SEARCH_SUMMARY_VIEW, keys=list(escaped_ids.keys())).get_result()
+            # deleted messages are not in the view
+            for row in response.get("rows", []):
+                _id = row.get("id")
+                value = row.get("value") or {}
+                found.add(_id)
+                if value.get("summary") is None:
+                    without_summary.append(_id)
+                    continue
+                summaries.append(EmailSummary(
+                    message_id=_id,
+                    subject=value["summary"].get("subject"),
+                    snippet=value["summary"].get("snippet"),
+                    created=value.get("created"),
+                    folder=value.get("folder"),
+                ))
+
+            # messages indexed before the summary field existed
+            if without_summary:
+                doc_ids = [BulkGetQueryDocument(id=_id) for _id in without_summary]
+                bulk_get_results = self.client.post_bulk_get(db=db_name, docs=doc_ids, attachments=False, latest=True, revs=False).get_result()
+                for result in bulk_get_results.get("results", []):
+                    for entry in result.get("docs", []):
+                        ok_doc = entry.get("ok")
+                        if ok_doc and not ok_doc.get("_deleted", False):
+                            summary = self.message_to_summary(ok_doc)
+                            if summary is not None:
+                                summaries.append(summary)
+                            break
+                    else:
+                        found.discard(result.get("id"))
+        except ApiException as e:
+            if e.status_code == 404:
+                raise NotFoundError(address)
+            if e.status_code == 401 or e.status_code == 403:
+                raise UnauthorizedError()
+            raise e
+
+        missing = [original for escaped, original in escaped_ids.items() if escaped not in found]
+
+        if sort != "NO_SORT":
+            if sort == "asc":
+                summaries.sort(key=lambda x: x.created or 0, reverse=False)
+            else:
+                summaries.sort(key=lambda x: x.created or 0, reverse=True)
+
+        return summaries, missing
+
+    def get_missing_ids(self, address:str, ids:List[str]) -> List[str]:
         """
-        Get all subscribed users
+        Check which message IDs no longer exist in the database (no documents are transferred)
+        Args:
+            address: str: The address of the user
+            ids: List[str]: The IDs of the messages to check
+        Returns:
+            List[str]: The IDs missing (or deleted) in the database
         """
-        response = self.client.post_all_docs(
-            db='subscription',
-            include_docs=True,
-            limit=100
-        ).get_result()
+        if len(ids) == 0:
+            return []
+
+        escaped_ids = {}
+        for _id in ids:
+            escaped_ids[_id.replace("+", " ")] = _id # i don't know what exactly couchdb does but i know it doesn't like + in there
+
+        missing: List[str] = []
+        try:
+            db_name = self.address_to_db_name(address)
+            response = self.client.post_all_docs(db=db_name, keys=list(escaped_ids.keys())).get_result()
+            for row in response.get("rows", []):
+                if row.get("error") is not None or (row.get("value") or {}).get("deleted", False):
+                    missing.append(escaped_ids.get(row.get("key"), row.get("key")))
+        except ApiException as e:
+            if e.status_code == 404:
+                raise NotFoundError(address)
+            if e.status_code == 401 or e.status_code == 403:
+                raise UnauthorizedError()
+            raise e
+        return missing
 
+    def get_all_subscribed_users(self, page_size: int = 200) -> List[str]:
+        """
+        Get all subscribed users (pages through the whole subscription database)
+        """
         users = []
-        for row in response.get("rows", []):
-            doc = row.get("doc")
-            if doc.get("stripeSubscriptionPlan") is not None:
-                users.append(doc.get("address"))
+        start_key = None
+        while True:
+            response = self.client.post_all_docs(
+                db='subscription',
+                include_docs=True,
+                limit=page_size,
+                start_key=start_key,
+                # the first row of a following page is the last row of the previous one
+                skip=1 if start_key is not None else None,
+            ).get_result()
+
+            rows = response.get("rows", [])
+            for row in rows:
+                doc = row.get("doc")
+                if doc.get("stripeSubscriptionPlan") is not None:
+                    users.append(doc.get("address"))
+            if len(rows) < page_size:
+                break
+            start_key = rows[-1].get("key")
         return users
 
     def get_latest_emails(self, address: str, from_epoch_ms: int) -> Tuple[List[dict], List[Email]]:
@@ -260,7 +472,24 @@ class CouchDBService:
         Returns:
             Tuple[List[dict], List[Email]]: messages = raw docs for update later, Email specific objects for embedding
         """
-        FIXED_FOLDERS = ["inbox", "sent", "archive", "goodreads"]
+        latest_emails = []
+        messages = []
+        for page_messages, page_emails, _ in self.iter_latest_emails(address, from_epoch_ms):
+            messages.extend(page_messages)
+            latest_emails.extend(page_emails)
+        return messages, latest_emails
+
+    def iter_latest_emails(self, address: str, from_epoch_ms: int, bookmark: str = None, limit: int = 100) -> Iterator[Tuple[List[dict], List[Email], str]]:
+        """
+        Page through the latest not yet indexed emails of a user
+        Args:
+            address: str: The address of the user
+            from_epoch_ms: int: The epoch time to get emails from
+            bookmark: str: Bookmark to resume from (returned with every page)
+            limit: int: The page size
+        Returns:
+            Iterator[Tuple[List[dict], List[Email], str]]: per page the raw docs, the Email objects and the bookmark after the page
+        """
         selector = {
         "$and": [
             {"folder": {"$in": FIXED_FOLDERS}},
@@ -275,15 +504,11 @@ class CouchDBService:
             ]
         }
         db_name = self.address_to_db_name(address)
-        latest_emails = []
-        messages = []
-        bookmark = None
-        page = 0
         while True:
             response = self.client.post_find(
                 db=db_name,
                 selector=selector,
-                limit=100,
+                limit=limit,
                 bookmark=bookmark,
                 use_index=["ddoc_search_emb_indices", "idx_folder_created_pfs"]
             ).get_result()
@@ -299,15 +524,72 @@ class CouchDBService:
                 if email is not None:
                     filtered_messages.append(doc)
                     filtered_emails.append(email)
-            
-            messages.extend(filtered_messages)
-            latest_emails.extend(filtered_emails)
+
             bookmark = response.get("bookmark")
+            yield filtered_messages, filtered_emails, bookmark
             if not bookmark:
                 break
-            page += 1
 
-        return messages, latest_emails
+    def get_changes(self, address: str, since: str = "now", limit: int = 500) -> Tuple[List[str], str, int]:
+        """
+        Read the changes feed of the user database, filtered on the server to SMTP messages in the indexed
+        folders that are not indexed yet (our own `search: true` updates do not show up)
+        Args:
+            address: str: The address of the user
+            since: str: The sequence to start from ("now" to skip the history)
+            limit: int: The maximum number of changes to read
+        Returns:
+            Tuple[List[str], str, int]: changed message ids, last sequence (checkpoint) and the number of pending changes
+        """
+        selector = {
+            "folder": {"$in": FIXED_FOLDERS},
+            "didCommMessage.type": {"$eq": SMTP_MESSAGE_TYPE},
+            # $ne does not match documents without the field (new mail has no `search` field)
+            "$or": [
+                {"search": {"$exists": False}},
+                {"search": {"$eq": False}},
+                {"search": {"$eq": ""}},
+                {"search": {"$eq": None}},
+            ],
+        }
+        db_name = self.address_to_db_name(address)
+        try:
+            response = self.client.post_changes(
+                db=db_name,
+                filter="_selector",
+                selector=selector,
+                since=since,
+                limit=limit,
+            ).get_result()
+        except ApiException as e:
+            if e.status_code == 404:
+                raise NotFoundError(address)
+            if e.status_code == 401 or e.status_code == 403:
+                raise UnauthorizedError()
+            raise e
+        ids = [row.get("id") for row in response.get("results", []) if not row.get("deleted")]
+        return ids, response.get("last_seq"), response.get("pending", 0)
+
+    def ensure_summary_view(self, address: str) -> bool:
+        """
+        Ensure the search summary view exists in the user database
+        Returns:
+            bool: True if the view exists
+        """
+        db_name = self.address_to_db_name(address)
+        try:
+            self.client.put_design_document(
+                db=db_name,
+                ddoc=SEARCH_SUMMARY_DDOC,
+                design_document=DesignDocument(views={SEARCH_SUMMARY_VIEW: DesignDocumentViewsMapReduce(map=SEARCH_SUMMARY_MAP)}),
+            )
+            return True
+        except ApiException as e:
+            # created concurrently
+            if e.status_code == 409:
+                return True
+            logger.error(f"Error creating search summary view: {e}")
+            return False
 
     def ensure_indexes(self, address: str = None) -> bool:
         """
@@ -333,7 +615,6 @@ class CouchDBService:
         
         # create index
         try:
-            FIXED_FOLDERS = ["inbox", "sent", "archive", "goodreads"]
             pfs_selector = {"folder": {"$in": FIXED_FOLDERS}}
             self.client.post_index(
                 db=db_name,
@@ -381,4 +662,29 @@ class CouchDBService:
         docs = response.get("docs", [])
         if not docs:
             return None
-        return docs[0]
\ No newline at end of file
+        return docs[0]
+
+    def get_mailio_mappings(self, addresses: List[str], batch_size: int = 200) -> Dict[str, dict]:
+        """
+        Get the mailio mappings of many addresses (one `$in` query per batch instead of one query per address)
+        Args:
+            addresses: List[str]: The new addresses to get the mappings for
+        Returns:
+            Dict[str, dict]: address => mailio mapping document (addresses without a mapping are left out)
+        """
+        mappings = {}
+        for start in range(0, len(addresses), batch_size):
+            batch = addresses[start:start + batch_size]
+            response = self.client.post_find(
+                db="mailio_mapping",
+                selector={
+                    "address": {
+                        "$in": batch
+                    }
+                },
+                limit=len(batch),
+                use_index=["mapping-address-index"]
+            ).get_result()
+            for doc in response.get("docs", []):
+                mappings[doc.get("address")] = doc
+        return mappings
\ No newline at end of file
@@ -0,0 +1,150 @@
+from typing import Dict, List, Set
+from concurrent.futures import ThreadPoolExecutor
+from .pinecone_service import PineconeService
+from .missing_ids_cache import MissingIdsCache
+from loguru import logger
+import asyncio
+
+# Pinecone accepts at most 1000 ids per delete request
+MAX_DELETE_BATCH = 1000
+
+class DeletionService:
+    """
+    Background deletion of vectors from Pinecone.
+    Pending deletes are coalesced per namespace into batched id lists and executed by a single worker task
+    on one small bounded executor, so cleanup does not compete with search for threads and CPU.
+    """
+
+    def __init__(self, cfg: Dict, pinecone_service: PineconeService, missing_ids_cache: MissingIdsCache = None):
+        """
+        Initialize the deletion service
+        Args:
+            cfg: dict: The configuration (optional `deletion` section)
+            pinecone_service: PineconeService: The Pinecone service
+            missing_ids_cache: MissingIdsCache: Negative cache of the ids search found missing in the database (optional)
+        """
+        deletion_cfg: Dict = cfg.get("deletion") or {}
+        self.pinecone_service = pinecone_service
+        self.missing_ids_cache = missing_ids_cache
+        self.max_pending = int(deletion_cfg.get("max_pending", 10000))
+        self.batch_size = min(int(deletion_cfg.get("batch_size", 500)), MAX_DELETE_BATCH)
+        # wait a little so that deletes arriving close together end up in one request
+        self.coalesce_delay = float(deletion_cfg.get("coalesce_delay", 0.5))
+        self.executor = ThreadPoolExecutor(max_workers=int(deletion_cfg.get("max_workers", 1)), thread_name_prefix="pinecone-delete")
+
+        self.pending: Dict[str, Set[str]] = {}
+        self.pending_count = 0
+        self.deleted_count = 0
+        self.dropped_count = 0
+        self.failed_count = 0
+        self._worker: asyncio.Task = None
+        self._wakeup: asyncio.Event = None
+        self._capacity: asyncio.Condition = None
+        self._closed = False
+
+    def _ensure_worker(self):
+        """
+        Start the worker task on the running event loop (the service is created before the loop exists)
+        """
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._capacity = asyncio.Condition()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def _add(self, address: str, message_ids: List[str]) -> int:
+        ids = self.pending.setdefault(address, set())
+        before = len(ids)
+        ids.update(message_ids)
+        added = len(ids) - before
+        self.pending_count += added
+        self._wakeup.set()
+        return added
+
+    def submit(self, address: str, message_ids: List[str]) -> bool:
+        """
+        Best effort delete (e.g. cleanup of ids missing in the database found during search).
+        Never waits: when the queue is full the ids are dropped, they are found again by a later search.
+        Returns:
+            bool: True if the ids were queued
+        """
+        if self.missing_ids_cache is not None:
+            # already queued or deleted recently
+            known = set(self.missing_ids_cache.known_missing(address, message_ids))
+            message_ids = [_id for _id in message_ids if _id not in known]
+        if not message_ids or self._closed:
+            return False
+        self._ensure_worker()
+        if self.pending_count + len(message_ids) > self.max_pending:
+            self.dropped_count += len(message_ids)
+            logger.warning(f"Deletion queue full ({self.pending_count} pending), dropping {len(message_ids)} ids for {address}")
+            return False
+        self._add(address, message_ids)
+        # only ids missing in the database are hidden from search (an explicitly deleted message may be indexed again)
+        if self.missing_ids_cache is not None:
+            self.missing_ids_cache.add(address, message_ids)
+        return True
+
+    async def delete(self, address: str, message_ids: List[str]):
+        """
+        Queue ids for deletion, waiting for room in the queue when it is full (backpressure)
+        """
+        if not message_ids:
+            return
+        if self._closed:
+            raise RuntimeError("Deletion service is shut down")
+        self._ensure_worker()
+        async with self._capacity:
+            await self._capacity.wait_for(lambda: self.pending_count == 0 or self.pending_count + len(message_ids) <= self.max_pending)
+            self._add(address, message_ids)
+
+    def _take_batches(self) -> List[tuple]:
+        """
+        Take all pending ids split into (address, ids) batches
+        """
+        batches = []
+        for address, ids in self.pending.items():
+            ids = list(ids)
+            for start in range(0, len(ids), self.batch_size):
+                batches.append((address, ids[start:start + self.batch_size]))
+        self.pending = {}
+        return batches
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            if not self._closed:
+                await asyncio.sleep(self.coalesce_delay)
+            self._wakeup.clear()
+            for address, ids in self._take_batches():
+                try:
+                    await loop.run_in_executor(self.executor, self.pinecone_service.delete_by_ids, ids, address)
+                    self.deleted_count += len(ids)
+                    logger.debug(f"Deleted {len(ids)} vectors from namespace {address}")
+                except Exception as e:
+                    self.failed_count += len(ids)
+                    logger.error(f"Failed to delete {len(ids)} vectors from namespace {address}: {e}")
+                finally:
+                    self.pending_count -= len(ids)
+                    async with self._capacity:
+                        self._capacity.notify_all()
+            if self._closed and self.pending_count == 0:
+                return
+
+    async def flush(self):
+        """
+        Execute all pending deletes and stop the worker (on shutdown)
+        """
+        self._closed = True
+        if self._worker is not None and not self._worker.done():
+            self._wakeup.set()
+            await self._worker
+        self.executor.shutdown(wait=True)
+
+    def stats(self) -> Dict:
+        return {
+            "pending": self.pending_count,
+            "deleted": self.deleted_count,
+            "dropped": self.dropped_count,
+            "failed": self.failed_count,
+        }
@@ -0,0 +1,109 @@
+from typing import Dict, Optional
+from redis import Redis
+from logging_handler import use_logginghandler
+import numpy as np
+import hashlib
+import threading
+
+logger = use_logginghandler()
+
+# redis string: float32 vector bytes of a passage (keyed by model and passage text hash)
+EMBEDDING_CACHE_KEY = "embedding_cache:{model}:{digest}"
+# redis hash: hits / misses of all processes using the cache
+EMBEDDING_CACHE_STATS_KEY = "embedding_cache:stats"
+
+class EmbeddingCache:
+    """
+    Content addressed cache of passage embeddings in Redis.
+    Newsletters, notifications and receipts arrive as identical copies for many subscribers,
+    the vector of an identical passage text (for the same model) is computed once.
+    """
+
+    def __init__(self, cfg: Dict, redis_conn: Redis):
+        """
+        Initialize the embedding cache
+        Args:
+            cfg: dict: The configuration (optional `embedding_cache` section)
+            redis_conn: Redis: The redis connection (decode_responses=False, vectors are stored as raw bytes)
+        """
+        cache_cfg: Dict = cfg.get("embedding_cache") or {}
+        self.enabled = bool(cache_cfg.get("enabled", True))
+        self.ttl = int(cache_cfg.get("ttl", 30 * 24 * 60 * 60))
+        self.report_every = int(cache_cfg.get("report_every", 1000))
+        self.model = cfg.get("embedding_model")
+        self.redis_conn = redis_conn
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, text: str) -> str:
+        """
+        Cache key of a passage text
+        """
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return EMBEDDING_CACHE_KEY.format(model=self.model, digest=digest)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """
+        Get the cached vector of a passage text (None on a miss or when the cache is unavailable)
+        """
+        if not self.enabled:
+            return None
+        try:
+            raw = self.redis_conn.get(self.key(text))
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            return None
+        self._count(raw is not None)
+        if raw is None:
+            return None
+        return np.frombuffer(raw, dtype=np.float32).copy()
+
+    def put(self, text: str, vector: np.ndarray):
+        """
+        Cache the vector of a passage text
+        """
+        if not self.enabled:
+            return
+        try:
+            self.redis_conn.set(self.key(text), np.asarray(vector, dtype=np.float32).tobytes(), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Embedding cache store failed: {e}")
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            lookups = self.hits + self.misses
+        try:
+            self.redis_conn.hincrby(EMBEDDING_CACHE_STATS_KEY, "hits" if hit else "misses", 1)
+        except Exception:
+            pass
+        if self.report_every > 0 and lookups % self.report_every == 0:
+            logger.info(f"Embedding cache hit rate: {self.hit_rate():.2%} ({self.hits} hits, {self.misses} misses)")
+
+    def hit_rate(self) -> float:
+        """
+        Hit rate of this process
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict:
+        """
+        Hit and miss counts of this process and of all processes (shared in Redis)
+        """
+        shared = {}
+        try:
+            shared = {key.decode() if isinstance(key, bytes) else key: int(value) for key, value in self.redis_conn.hgetall(EMBEDDING_CACHE_STATS_KEY).items()}
+        except Exception as e:
+            logger.warning(f"Embedding cache stats failed: {e}")
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+            "total_hits": shared.get("hits", 0),
+            "total_misses": shared.get("misses", 0),
+        }
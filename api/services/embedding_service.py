@@ -1,6 +1,8 @@
 from transformers import AutoTokenizer, AutoModel
 from tools.optimal_embeddings_model.data_types.email import Email, MessageType
 from tools.optimal_embeddings_model.mailio_ai_libs.create_embeddings import Embedder
+from .embedding_cache import EmbeddingCache
+from .inference_profiler import InferenceProfiler, configure_torch_threads
 import torch
 import numpy as np
 from typing import List
@@ -10,15 +12,20 @@ class EmbeddingService:
     Embedding service to get embeddings for the email
     """
     
-    def __init__(self, cfg: dict):
+    def __init__(self, cfg: dict, cache: EmbeddingCache = None, role: str = "api"):
         """
         Initialize the Embedding service
         Args:
             cfg: dict: The configuration for the Embedding service
+            cache: EmbeddingCache: Content addressed cache of passage embeddings (optional)
+            role: str: The process role (api, worker, sweeper) selecting the torch thread settings
         """
         if cfg.get("embedding_model") is None:
             raise ValueError("Embedding model is missing")
         
+        # thread settings are per process, the API, queue worker and sweeper are tuned separately
+        self.threads = configure_torch_threads(cfg, role)
+        self.profiler = InferenceProfiler(cfg, role)
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         print(f"EmbeddingService using device: {self.device}")
         self.embedding_model = cfg.get("embedding_model")
@@ -26,7 +33,8 @@ class EmbeddingService:
         self.model = AutoModel.from_pretrained(self.embedding_model)
         self.model.to(self.device)
         self.model.eval() # set to evaluation mode
-        self.embedder = Embedder(self.model, self.tokenizer)    
+        self.embedder = Embedder(self.model, self.tokenizer, profiler=self.profiler if self.profiler.enabled else None)
+        self.cache = cache
     
 
     def create_passage_text(self, email: Email) -> str:
@@ -81,5 +89,11 @@ class EmbeddingService:
             torch.Tensor: The embeddings for the email
         """
         text = self.create_passage_text(email)
+        if self.cache is not None:
+            cached = self.cache.get(text)
+            if cached is not None:
+                return cached
         embeddings = self.embedder.embed(text)
+        if self.cache is not None:
+            self.cache.put(text, embeddings)
         return embeddings
\ No newline at end of file
@@ -2,8 +2,10 @@ from typing import Dict, List
 from rq import Queue, Worker, Retry
 from redis import Redis, ConnectionError
 from api.services.pinecone_service import PineconeService
-from api.services.couchdb_service import CouchDBService
+from api.services.couchdb_service import CouchDBService, SEARCH_SUMMARY_FIELD, normalize_subject, create_snippet
 from api.services.embedding_service import EmbeddingService
+from api.services.embedding_cache import EmbeddingCache
+from api.services.pipeline_metrics import PipelineMetrics
 import logging
 from logging_handler import use_logginghandler
 import signal
@@ -37,10 +39,13 @@ def create_metadata(email: Email):
         "folder": email.folder,
         "from_name": email.sender_name,
         "from_email": email.sender_email,
+        # computed once at index time, search results are rendered without touching message bodies
+        "subject": normalize_subject(email.subject),
+        "snippet": create_snippet(email.sentences),
     }
     return metadata
 
-def init_redis(cfg: Dict):
+def init_redis(cfg: Dict, decode_responses: bool = True):
     redis_cfg = cfg.get("redis")
     if redis_cfg is None:
         raise ValueError("Redis configuration is missing")
@@ -61,7 +66,7 @@ def init_redis(cfg: Dict):
     # check if the host is localhost or 127.0.0.1
     use_ssl = not (redis_host == "localhost" or redis_host == "127.0.0.1")
 
-    redisConnection = Redis(host=redis_host, port=redis_port, db=redis_db, username=username, password=password, retry_on_timeout=True, socket_keepalive=True, socket_connect_timeout=15, decode_responses=True, ssl=use_ssl)
+    redisConnection = Redis(host=redis_host, port=redis_port, db=redis_db, username=username, password=password, retry_on_timeout=True, socket_keepalive=True, socket_connect_timeout=15, decode_responses=decode_responses, ssl=use_ssl)
     if redisConnection.ping():
         logging.info(f"Connected to Redis at {redis_host}:{redis_port}/{redis_db}")
     else:
@@ -72,16 +77,22 @@ def init_redis(cfg: Dict):
 def create_embedding(cfg:Dict):
     # create an embedding from a message id
     db_service = CouchDBService(cfg)
-    embedding_service = EmbeddingService(cfg)
+    # identical passages (newsletters, receipts) are embedded once across subscribers
+    embedding_cache = EmbeddingCache(cfg, init_redis(cfg, decode_responses=False))
+    embedding_service = EmbeddingService(cfg, cache=embedding_cache, role="worker")
     pc_service = PineconeService(cfg, dimension=embedding_service.model.config.hidden_size)
 
     r = init_redis(cfg)
+    # counters and per stage timings, exported by the API /metrics endpoint
+    metrics = PipelineMetrics(cfg, init_redis(cfg), "worker")
 
     while True:
         try:
             # move from queue to processing queue
             task = r.brpop(REDIS_QUEUE, timeout=15)
             if task:
+                metrics.incr("dequeued")
+                started = time.perf_counter()
                 try:
                     task_data = json.loads(task[1])
                     message_id = task_data.get("message_id")
@@ -91,31 +102,46 @@ def create_embedding(cfg:Dict):
                     if message_id is None or address is None:
                         raise ValueError("Message ID or address is missing")
 
-                    message, email = db_service.get_message_by_id(message_id, address)
+                    with metrics.stage("fetch"):
+                        message = db_service.get_raw_message_by_id(message_id, address)
+                    with metrics.stage("parse"):
+                        email = db_service.message_to_email(message)
                     if email is None:
                         raise ValueError(f"Email not found for message_id: {message_id}, address: {address}")
 
                     metadata = create_metadata(email)
-                    vector = embedding_service.create_embedding(email)
+                    with metrics.stage("inference"):
+                        vector = embedding_service.create_embedding(email)
 
                     # remove from metadata all fields with None 
                     metadata = {k: v for k, v in metadata.items() if v is not None}
-                    pc_service.upsert(address, message_id, vector.tolist(), metadata)
+                    with metrics.stage("upsert"):
+                        pc_service.upsert(address, message_id, vector, metadata)
 
                     # after successfull upsert, update the message with flag: search: true
-                    message["search"] = True
-                    db_service.put_message(message, address)
+                    with metrics.stage("flag"):
+                        message["search"] = True
+                        message[SEARCH_SUMMARY_FIELD] = db_service.create_search_summary(email)
+                        db_service.put_message(message, address)
+                    metrics.observe("total", time.perf_counter() - started)
+                    metrics.incr("processed")
                     logging.info(f"Successfully upserted embedding for message_id: {message_id}, address: {address}")
                 except Exception as e:
+                    metrics.incr("failed")
                     logging.error(f"Error processing message_id: {message_id}, address: {address}, error: {e}")
                     # if error, requeue the message
                     if retry_count >= MAX_RETRIES:
+                        metrics.incr("dropped")
                         logging.error(f"Max retries reached for message_id: {message_id}, address: {address}")
                     else:
                         task_data["retry_count"] = retry_count + 1
                         time.sleep(RETRY_DELAY)
                         r.rpush(REDIS_QUEUE, json.dumps(task_data))
+                        metrics.incr("retried")
                         logging.info(f"Requeued message_id: {message_id}, address: {address}")
+            else:
+                # idle, publish the buffered metrics
+                metrics.flush()
         except ConnectionError as e:
             logging.error(f"Redis connection error: {e}... retrying in 3 seconds")
             # Print full error details
@@ -143,4 +169,13 @@ class EmbeddingTaskQueue:
             "retry_count": 0   
         }
         p = json.dumps(payload)
-        self.redis_conn.rpush(REDIS_QUEUE, p)
\ No newline at end of file
+        self.redis_conn.rpush(REDIS_QUEUE, p)
+
+    def upsert_embeddings(self, address, message_ids: List[str]):
+        """
+        Upsert many embeddings of one address to the queue (single round trip)
+        """
+        if not message_ids:
+            return
+        payloads = [json.dumps({"address": address, "message_id": message_id, "retry_count": 0}) for message_id in message_ids]
+        self.redis_conn.rpush(REDIS_QUEUE, *payloads)
\ No newline at end of file
@@ -0,0 +1,115 @@
+from typing import Dict, Iterator
+from contextlib import contextmanager, nullcontext
+from logging_handler import use_logginghandler
+import torch
+import json
+import os
+import random
+import threading
+import time
+
+logger = use_logginghandler()
+
+# process roles with their own thread settings (inference.threads.<role>)
+INFERENCE_ROLES = ["api", "worker", "sweeper"]
+
+def configure_torch_threads(cfg: Dict, role: str) -> Dict:
+    """
+    Apply the torch thread settings of the process role (optional `inference.threads.<role>` config).
+    Unset values keep the torch defaults (intra-op threads = physical cores).
+    Returns:
+        Dict: the thread settings in effect
+    """
+    if role not in INFERENCE_ROLES:
+        raise ValueError(f"Unsupported inference role: {role}, expected one of {INFERENCE_ROLES}")
+    inference_cfg: Dict = cfg.get("inference") or {}
+    threads_cfg: Dict = (inference_cfg.get("threads") or {}).get(role) or {}
+
+    num_threads = threads_cfg.get("num_threads")
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    interop_threads = threads_cfg.get("interop_threads")
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(int(interop_threads))
+        except RuntimeError as e:
+            # only possible before the first parallel work of the process
+            logger.warning(f"Could not set torch interop threads to {interop_threads}: {e}")
+
+    threads = {"num_threads": torch.get_num_threads(), "interop_threads": torch.get_num_interop_threads()}
+    logger.info(f"torch threads for role {role}: {threads}")
+    return threads
+
+class InferenceProfiler:
+    """
+    Opt-in telemetry of model forward passes (optional `inference.profiling` config).
+    Sampled calls are appended as JSON lines (batch size, token count, padded length, wall time, threads)
+    to `<output_dir>/inference-<role>-<pid>.jsonl`, and a share of them is traced with torch.profiler
+    (chrome traces in the same directory) to see how batch size and sequence length drive the latency.
+    """
+
+    def __init__(self, cfg: Dict, role: str):
+        """
+        Initialize the profiler
+        Args:
+            cfg: dict: The configuration (optional `inference.profiling` section)
+            role: str: The process role (api, worker, sweeper)
+        """
+        profiling_cfg: Dict = (cfg.get("inference") or {}).get("profiling") or {}
+        self.enabled = bool(profiling_cfg.get("enabled", False))
+        self.sample_rate = float(profiling_cfg.get("sample_rate", 1.0))
+        self.trace_sample_rate = float(profiling_cfg.get("trace_sample_rate", 0.0))
+        self.output_dir = profiling_cfg.get("output_dir", "/tmp/mailio-inference-profiles")
+        self.role = role
+        self.calls = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self.records_path = os.path.join(self.output_dir, f"inference-{role}-{os.getpid()}.jsonl")
+            logger.info(f"Inference profiling enabled for role {role}, writing to {self.records_path}")
+
+    @contextmanager
+    def profile(self, attention_mask: torch.Tensor) -> Iterator[None]:
+        """
+        Profile a model forward pass (no-op unless profiling is enabled and the call is sampled)
+        Args:
+            attention_mask: torch.Tensor: The attention mask of the batch (batch size x padded length)
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield
+            return
+
+        trace = random.random() < self.trace_sample_rate
+        profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True) if trace else nullcontext()
+        start = time.perf_counter()
+        with profiler:
+            yield
+        wall_time = time.perf_counter() - start
+
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        record = {
+            "timestamp": time.time(),
+            "role": self.role,
+            "call": call,
+            "batch_size": int(attention_mask.shape[0]),
+            "padded_length": int(attention_mask.shape[1]),
+            "tokens": int(attention_mask.sum()),
+            "wall_time_ms": round(wall_time * 1000, 3),
+            "num_threads": torch.get_num_threads(),
+            "interop_threads": torch.get_num_interop_threads(),
+        }
+        if trace:
+            trace_path = os.path.join(self.output_dir, f"trace-{self.role}-{os.getpid()}-{call}.json")
+            profiler.export_chrome_trace(trace_path)
+            record["trace"] = trace_path
+        self._write(record)
+
+    def _write(self, record: Dict):
+        try:
+            with self._lock:
+                with open(self.records_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+        except Exception as e:
+            logger.warning(f"Could not write inference profile record: {e}")
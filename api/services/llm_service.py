@@ -1,11 +1,14 @@
 from typing import Dict
 from ..models.llm import LLMQueryWithDocuments, EmailDocument
 from openai import AsyncOpenAI
-from typing import List
+from api.services.client_factory import get_client_factory
+from typing import List, AsyncIterator
 import json
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
 from api.services.llm_service_prompt import selfquery_prompt, insights_prompt
-import torch
+from api.utils.json_stream import InsightsStreamParser
+from api.utils.document_packing import DocumentPacker
+from api.utils.metrics import CLIENT_REQUEST_SECONDS
+from loguru import logger
 import time
 import os
 from datetime import datetime
@@ -13,69 +16,88 @@ class LLMService:
     def __init__(self, cfg: Dict):
         self.cfg = cfg
         # self.openai = OpenAI(api_key=cfg["openai"]["api_key"])
-        self.openai_async = AsyncOpenAI(api_key=cfg["openai"]["api_key"])
+        # shared client with a bounded keep-alive pool and timeouts (see ClientFactory)
+        self.openai_async: AsyncOpenAI = get_client_factory(cfg).openai_async()
         self.model_name = cfg["openai"]["model"]
+        self.document_packer = DocumentPacker(cfg)
         os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-    def rerank_selfhosted(self, query: LLMQueryWithDocuments, documents: List[EmailDocument]):
+    def insights_messages(self, queryWithDocuments: LLMQueryWithDocuments) -> List[Dict]:
         """
-        Rerank the documents based on the query using a self-hosted model (BGE Reranker)
-        Uncomment the code to use the self-hosted model
+        Build the chat messages for the insights extraction (documents packed into the prompt token budget)
         """
-        document_content = []  
-        query_content = []
-        for document in documents:
-            document_content.append(document.text)
-            query_content.append(query)
-
-        # measure time taken to execute the following code
-        start_time = time.time()
-
-        features = self.tokenizer(
-            query_content,
-            document_content,
-            padding=True,
-            truncation=True,
-            return_tensors="pt"
-        )
-
-        with torch.no_grad():
-            scores = self.model(**features).logits
-            scores = scores.tolist()
-        
-        end_time = time.time()
-        print(f"Time taken to execute the reranking: {end_time - start_time} seconds")
-
-        scores = [{"score": score[0], "id": document.id} for score, document in zip(scores, documents)]
-        return {"results": scores}
-
-            
-    async def extract_insights(self, queryWithDocuments: LLMQueryWithDocuments):
+        prompt = insights_prompt.format(query=queryWithDocuments.query)
+        documents = self.document_packer.pack(prompt, queryWithDocuments.documents)
         email_content_json = [
             {
                 "id": document.id,
                 "text": document.text
             }
-            for document in queryWithDocuments.documents
+            for document in documents
+        ]
+        return [
+            {"role": "system", "content": prompt},
+            # unescaped, so the prompt has the tokens the packer counted (\uXXXX escapes multiply non-ASCII text)
+            {"role": "user", "content": json.dumps(email_content_json, ensure_ascii=False)}
         ]
-        prompt = insights_prompt.format(query=queryWithDocuments.query)
 
-        start_time = time.time()
+    async def extract_insights(self, queryWithDocuments: LLMQueryWithDocuments):
+        start_time = time.perf_counter()
 
         response = await self.openai_async.chat.completions.create(
             model=self.model_name,
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": json.dumps(email_content_json)}
-            ],
+            messages=self.insights_messages(queryWithDocuments),
             response_format={"type": "json_object"}
         )
 
-        end_time = time.time()
-        print(f"Time taken to execute the insights extraction: {end_time - start_time} seconds")
+        CLIENT_REQUEST_SECONDS.observe(time.perf_counter() - start_time, client="openai", operation="insights")
 
         return response.choices[0].message.content
 
+    async def stream_insights(self, queryWithDocuments: LLMQueryWithDocuments) -> AsyncIterator[Dict]:
+        """
+        Stream the insights extraction. Yields events as soon as they are complete in the model output:
+        {"event": "start", "data": {"query": str}} on the first token, {"event": "answer", "data": str}, {"event": "result", "data": dict} for each result object
+        and finally {"event": "insights", "data": dict} with the complete insights object.
+        The response status is already sent while streaming, so a failed request or invalid model output
+        ends the stream with {"event": "error", "data": {"detail": str}} instead
+        """
+        start_time = time.perf_counter()
+
+        parser = InsightsStreamParser()
+        first_token_time = None
+        try:
+            stream = await self.openai_async.chat.completions.create(
+                model=self.model_name,
+                messages=self.insights_messages(queryWithDocuments),
+                response_format={"type": "json_object"},
+                stream=True
+            )
+
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                    yield {"event": "start", "data": {"query": queryWithDocuments.query}}
+                for event, data in parser.feed(delta):
+                    yield {"event": event, "data": data}
+
+            insights = parser.result()
+        except Exception as e:
+            logger.error(f"Insights stream failed: {e}")
+            yield {"event": "error", "data": {"detail": str(e)}}
+            return
+
+        yield {"event": "insights", "data": insights}
+
+        end_time = time.perf_counter()
+        CLIENT_REQUEST_SECONDS.observe((first_token_time or end_time) - start_time, client="openai", operation="insights_first_token")
+        CLIENT_REQUEST_SECONDS.observe(end_time - start_time, client="openai", operation="insights_stream")
+
     async def selfquery(self, query: str):
         today = datetime.now().strftime("%Y-%m-%d")
         formatted_prompt = selfquery_prompt.substitute(today=today)
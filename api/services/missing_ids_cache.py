@@ -0,0 +1,68 @@
+from typing import Dict, List, Iterable
+from collections import OrderedDict
+import threading
+import time
+
+class MissingIdsCache:
+    """
+    Short-lived per address negative cache of vector ids known to be missing in the couch database.
+    Filled by the deletion service when ids are queued for deletion, so that searches stop hydrating and
+    deleting the same ghost vectors again until the Pinecone delete has landed.
+    """
+
+    def __init__(self, cfg: Dict):
+        """
+        Initialize the missing ids cache
+        Args:
+            cfg: dict: The configuration (optional `search.missing_ids_cache` section)
+        """
+        search_cfg: Dict = cfg.get("search") or {}
+        cache_cfg: Dict = search_cfg.get("missing_ids_cache") or {}
+        self.ttl = float(cache_cfg.get("ttl", 600))
+        self.max_addresses = int(cache_cfg.get("max_addresses", 10000))
+        self.max_ids_per_address = int(cache_cfg.get("max_ids_per_address", 5000))
+
+        # address => (id => expiry)
+        self._entries: "OrderedDict[str, OrderedDict[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, address: str, ids: Iterable[str]):
+        """
+        Remember the ids as missing for `ttl` seconds
+        """
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            entries = self._entries.get(address)
+            if entries is None:
+                entries = self._entries[address] = OrderedDict()
+            self._entries.move_to_end(address)
+            for _id in ids:
+                entries[_id] = expires
+                entries.move_to_end(_id)
+            while len(entries) > self.max_ids_per_address:
+                entries.popitem(last=False)
+            while len(self._entries) > self.max_addresses:
+                self._entries.popitem(last=False)
+
+    def known_missing(self, address: str, ids: Iterable[str]) -> List[str]:
+        """
+        Get the ids among `ids` that are known to be missing (and not expired)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries.get(address)
+            if not entries:
+                return []
+            # ids are added in order with the same ttl, expired ones are at the front
+            while entries and next(iter(entries.values())) <= now:
+                entries.popitem(last=False)
+            return [_id for _id in ids if _id in entries]
+
+    def filter_matches(self, address: str, matches: list) -> list:
+        """
+        Drop Pinecone matches whose ids are known to be missing in the couch database
+        """
+        missing = set(self.known_missing(address, [match.id for match in matches]))
+        if not missing:
+            return matches
+        return [match for match in matches if match.id not in missing]
@@ -0,0 +1,134 @@
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+import threading
+import math
+
+class OverfetchService:
+    """
+    Adaptive over-fetch factor for unsorted semantic search.
+    Tracks per address and filter shape how many Pinecone candidates survive the CouchDB lookup
+    and the knee detection, and derives how many candidates to request from Pinecone next time.
+    """
+
+    def __init__(self, cfg: Dict):
+        """
+        Initialize the over-fetch service
+        Args:
+            cfg: dict: The configuration (optional `search.overfetch` section)
+        """
+        search_cfg: Dict = cfg.get("search") or {}
+        overfetch_cfg: Dict = search_cfg.get("overfetch") or {}
+
+        self.default_factor = float(overfetch_cfg.get("default_factor", 5))
+        self.min_factor = float(overfetch_cfg.get("min_factor", 1))
+        self.max_factor = float(overfetch_cfg.get("max_factor", 10))
+        self.headroom = float(overfetch_cfg.get("headroom", 1.2))
+        self.smoothing = float(overfetch_cfg.get("smoothing", 0.3))
+        self.max_top_k = int(overfetch_cfg.get("max_top_k", 1000))
+        self.max_entries = int(overfetch_cfg.get("max_entries", 10000))
+
+        if self.min_factor < 1 or self.max_factor < self.min_factor:
+            raise ValueError("Invalid over-fetch bounds (expected 1 <= min_factor <= max_factor)")
+        if not 0 < self.smoothing <= 1:
+            raise ValueError("Over-fetch smoothing must be in (0, 1]")
+
+        # (address, filter shape) => smoothed over-fetch factor needed by past queries
+        self._factors: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter_shape(self, folder: str = None, beforeTimestamp: int = None, afterTimestamp: int = None, from_email: str = None) -> str:
+        """
+        Describe which filters are present (not their values), e.g. "folder+after"
+        Args:
+            folder: str: The folder filter
+            beforeTimestamp: int: The before timestamp filter
+            afterTimestamp: int: The after timestamp filter
+            from_email: str: The from email filter
+        Returns:
+            str: The filter shape
+        """
+        parts = []
+        if folder:
+            parts.append("folder")
+        if beforeTimestamp:
+            parts.append("before")
+        if afterTimestamp:
+            parts.append("after")
+        if from_email:
+            parts.append("from")
+        return "+".join(parts) if parts else "none"
+
+    def factor(self, address: str, shape: str) -> float:
+        """
+        Get the current over-fetch factor for the address and filter shape
+        """
+        with self._lock:
+            observed = self._factors.get((address, shape))
+        if observed is None:
+            return self.default_factor
+        return self._clamp(observed * self.headroom)
+
+    def top_k_for(self, address: str, shape: str, top_k: int) -> int:
+        """
+        Number of candidates to request from Pinecone for the requested top_k
+        Args:
+            address: str: The address (namespace)
+            shape: str: The filter shape (see filter_shape)
+            top_k: int: The number of results requested by the client
+        Returns:
+            int: The number of candidates to fetch
+        """
+        return min(self.max_top_k, max(top_k, math.ceil(top_k * self.factor(address, shape))))
+
+    def requery_top_k(self, top_k: int, requested: int, returned: int, survived: int) -> Optional[int]:
+        """
+        Decide whether too few candidates survived and a larger re-query is worth it
+        Args:
+            top_k: int: The number of results requested by the client
+            requested: int: The number of candidates requested from Pinecone
+            returned: int: The number of candidates Pinecone returned
+            survived: int: The number of candidates found in CouchDB
+        Returns:
+            Optional[int]: The number of candidates to re-query with or None
+        """
+        if survived >= top_k:
+            return None
+        # Pinecone returned less than asked for, there is nothing more to fetch
+        if returned < requested:
+            return None
+        fallback = min(self.max_top_k, math.ceil(top_k * self.max_factor))
+        if fallback <= requested:
+            return None
+        return fallback
+
+    def record(self, address: str, shape: str, top_k: int, fetched: int, survived: int, knee: Optional[int] = None):
+        """
+        Record the outcome of a query
+        Args:
+            address: str: The address (namespace)
+            shape: str: The filter shape (see filter_shape)
+            top_k: int: The number of results requested by the client
+            fetched: int: The number of candidates Pinecone returned
+            survived: int: The number of candidates found in CouchDB
+            knee: Optional[int]: The suggested knee point over the fetched candidates
+        """
+        if top_k <= 0 or fetched <= 0:
+            return
+        # candidates beyond the knee are noise, there is no point fetching enough of them to fill top_k
+        needed = min(top_k, knee) if knee else top_k
+        survival_ratio = max(survived, 1) / fetched
+        needed_factor = (needed / survival_ratio) / top_k
+
+        key = (address, shape)
+        with self._lock:
+            previous = self._factors.pop(key, None)
+            if previous is None:
+                self._factors[key] = needed_factor
+            else:
+                self._factors[key] = previous + self.smoothing * (needed_factor - previous)
+            # bounded LRU
+            while len(self._factors) > self.max_entries:
+                self._factors.popitem(last=False)
+
+    def _clamp(self, factor: float) -> float:
+        return min(self.max_factor, max(self.min_factor, factor))
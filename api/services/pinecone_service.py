@@ -1,14 +1,37 @@
 from pinecone.grpc import PineconeGRPC as Pinecone
 from pinecone import ServerlessSpec
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 from pinecone.db_data.models import QueryResponse
 from urllib.parse import urlparse
+from dataclasses import dataclass
+from collections import defaultdict
 import time
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import json
 from ..models.llm import EmailDocument
+from ..utils.vectors import to_values
+from ..utils.metrics import CLIENT_REQUEST_SECONDS
+import numpy as np
+from .client_factory import get_client_factory
 from loguru import logger
 
+# Pinecone request limits (max vectors per upsert request and max request size)
+MAX_UPSERT_BATCH_VECTORS = 1000
+MAX_UPSERT_BATCH_BYTES = 2 * 1024 * 1024
+
+@dataclass
+class UpsertBatchResult:
+    """
+    Result of one upsert request of a bulk upsert
+    """
+    namespace: str
+    ids: List[str]
+    upserted_count: int = 0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
 class PineconeService:
 
     def __init__(self, cfg: Dict, dimension: int = 1024, metric: str = 'cosine'):
@@ -30,6 +53,11 @@ class PineconeService:
             raise ValueError("Pinecone cloud is missing")
         
         self.dimension = dimension
+        self.upsert_batch_size = min(int(pinecone_cfg.get("upsert_batch_size", 100)), MAX_UPSERT_BATCH_VECTORS)
+        # leave room for the request framing
+        self.upsert_batch_bytes = min(int(pinecone_cfg.get("upsert_batch_bytes", 1536 * 1024)), MAX_UPSERT_BATCH_BYTES)
+        self.upsert_concurrency = int(pinecone_cfg.get("upsert_concurrency", 8))
+        self.upsert_timeout = float(pinecone_cfg.get("upsert_timeout", 30))
         self.region = pinecone_cfg.get("region")
         self.cloud = pinecone_cfg.get("cloud")
 
@@ -42,7 +70,8 @@ class PineconeService:
         name = parts[0]
         self.index_name = name
 
-        self.pc = Pinecone(api_key=pinecone_cfg.get("api_key"))
+        self.clients = get_client_factory(cfg)
+        self.pc: Pinecone = self.clients.pinecone()
         spec = ServerlessSpec(cloud=self.cloud, region=self.region)
 
         existing_indexes = [
@@ -61,7 +90,7 @@ class PineconeService:
                 time.sleep(1)
             
             # connect to index
-        self.index = self.pc.Index(self.index_name)
+        self.index = self.clients.pinecone_index(self.index_name)
 
     
     def index_stats(self):
@@ -69,24 +98,90 @@ class PineconeService:
         return stats
         
 
-    def upsert(self, address:str, embedding_id: str, vector: List[float], metadata: Dict):
+    def upsert(self, address:str, embedding_id: str, vector: Union[List[float], np.ndarray], metadata: Dict):
         """
         Upsert the embeddings to the Pinecone index
         """
         vectors = []
         vectors.append({
             "id": embedding_id,
-            "values": vector,
+            "values": to_values(vector),
             "metadata": metadata
         })
-        self.index.upsert(vectors, namespace=address)
+        with self.clients.track("pinecone"):
+            self.index.upsert(vectors, namespace=address)
+
+    def upsert_bulk(self, rows: Sequence[Tuple[str, str, Union[List[float], np.ndarray], Dict]]) -> List[UpsertBatchResult]:
+        """
+        Upsert many vectors across addresses. Rows are grouped by namespace, split into requests limited by
+        `upsert_batch_size` vectors and `upsert_batch_bytes` bytes and sent concurrently (gRPC async requests,
+        at most `upsert_concurrency` in flight).
+        Args:
+            rows: Sequence[Tuple[str, str, Union[List[float], np.ndarray], Dict]]: (address, embedding_id, vector, metadata)
+        Returns:
+            List[UpsertBatchResult]: one result per request, callers mark only the ids of successful batches as indexed
+        """
+        by_namespace: Dict[str, List[Dict]] = defaultdict(list)
+        for address, embedding_id, vector, metadata in rows:
+            by_namespace[address].append({
+                "id": embedding_id,
+                "values": vector,
+                "metadata": metadata
+            })
+
+        batches: List[Tuple[str, List[Dict]]] = []
+        for namespace, vectors in by_namespace.items():
+            batch, batch_bytes = [], 0
+            for vector in vectors:
+                vector_bytes = self._vector_size(vector)
+                if batch and (len(batch) >= self.upsert_batch_size or batch_bytes + vector_bytes > self.upsert_batch_bytes):
+                    batches.append((namespace, batch))
+                    batch, batch_bytes = [], 0
+                batch.append(vector)
+                batch_bytes += vector_bytes
+            if batch:
+                batches.append((namespace, batch))
+
+        results: List[UpsertBatchResult] = []
+        stats = self.clients.stats["pinecone"]
+        for window_start in range(0, len(batches), self.upsert_concurrency):
+            pending = []
+            for namespace, batch in batches[window_start:window_start + self.upsert_concurrency]:
+                result = UpsertBatchResult(namespace=namespace, ids=[vector["id"] for vector in batch])
+                stats.acquire()
+                try:
+                    # vectors become float lists only here, batch by batch
+                    request = [{**vector, "values": to_values(vector["values"])} for vector in batch]
+                    pending.append((result, self.index.upsert(request, namespace=namespace, async_req=True)))
+                except Exception as e:
+                    stats.release(error=True)
+                    result.error = str(e)
+                    results.append(result)
+            for result, future in pending:
+                try:
+                    response = future.result(timeout=self.upsert_timeout)
+                    result.upserted_count = response.upserted_count
+                    stats.release()
+                except Exception as e:
+                    stats.release(error=True)
+                    result.error = str(e)
+                    logger.error(f"Upsert of {len(result.ids)} vectors into namespace {result.namespace} failed: {e}")
+                results.append(result)
+        return results
+
+    def _vector_size(self, vector: Dict) -> int:
+        """
+        Approximate serialized size of a vector (float32 values, metadata, id)
+        """
+        metadata_bytes = len(json.dumps(vector["metadata"])) if vector["metadata"] else 0
+        return len(vector["values"]) * 4 + metadata_bytes + len(vector["id"]) + 64
 
-    def query(self, address:str, query_embedding: List[float], top_k: int = 50, folder:str = None, beforeTimestamp: int = None, afterTimestamp: int = None, from_email: str = None) -> QueryResponse:
+    def query(self, address:str, query_embedding: Union[List[float], np.ndarray], top_k: int = 50, folder:str = None, beforeTimestamp: int = None, afterTimestamp: int = None, from_email: str = None) -> QueryResponse:
         """
         Query the Pinecone index
         Args:
             address: str: The address to query (namespace)
-            query_embedding: List[float]: The query vector
+            query_embedding: Union[List[float], np.ndarray]: The query vector
             top_k: int: The number of results to return
             folder: str: The folder to search
             beforeTimestamp: int: The timestamp to search before
@@ -121,7 +216,8 @@ class PineconeService:
         logger.debug(f"namespace: {address}")
         logger.debug(f"include_metadata: True")
 
-        results = self.index.query(vector=query_embedding, filter=query_filter, top_k=top_k, namespace=address, include_metadata=True)
+        with self.clients.track("pinecone"):
+            results = self.index.query(vector=to_values(query_embedding), filter=query_filter, top_k=top_k, namespace=address, include_metadata=True)
 
         return results
 
@@ -131,58 +227,38 @@ class PineconeService:
         Args:
             message_id: str: The message ID to delete
         """
-        self.index.delete(message_id, namespace=address)
+        with self.clients.track("pinecone"):
+            self.index.delete(message_id, namespace=address)
 
     def delete_by_ids(self, message_ids: List[str], address: str):
         """
         Delete the embeddings from the Pinecone index by message IDs
         """
-        self.index.delete(ids=message_ids, namespace=address)
-
-    async def delete_by_ids_async(self, message_ids: List[str], address: str):
-        """
-        Delete the embeddings from the Pinecone index by message IDs asynchronously
-        """
-        if not message_ids:
-            logger.debug("No message IDs to delete")
-            return
-            
-        logger.debug(f"Starting async deletion of {len(message_ids)} messages for address: {address}")
-        
-        def _delete_sync():
-            try:
-                self.index.delete(ids=message_ids, namespace=address)
-                logger.debug(f"Successfully deleted {len(message_ids)} messages from Pinecone")
-            except Exception as e:
-                logger.error(f"Failed to delete messages from Pinecone: {e}")
-                raise
-        
-        # Run the synchronous delete operation in a thread pool
-        loop = asyncio.get_event_loop()
-        with ThreadPoolExecutor() as executor:
-            await loop.run_in_executor(executor, _delete_sync)
+        with self.clients.track("pinecone"):
+            self.index.delete(ids=message_ids, namespace=address)
 
     def rerank(self, query: str, documents: List[EmailDocument]):
         """
         Rerank the documents based on the query
         """
-        start_time = time.time()
+        start_time = time.perf_counter()
         pinecone_docs = []
         for document in documents:
             pinecone_docs.append({
                 "id": document.id,
                 "text": document.text
             })
-        result = self.pc.inference.rerank(
-            model="bge-reranker-v2-m3",
-            query=query,
-            documents=pinecone_docs,
-            top_n=len(documents),
-            parameters={
-                "truncate": "END"
-            },
-            return_documents=False
-        )
+        with self.clients.track("pinecone"):
+            result = self.pc.inference.rerank(
+                model="bge-reranker-v2-m3",
+                query=query,
+                documents=pinecone_docs,
+                top_n=len(documents),
+                parameters={
+                    "truncate": "END"
+                },
+                return_documents=False
+            )
         reranked_results = []
         reranked = result.rerank_result
         data = reranked.data
@@ -192,6 +268,5 @@ class PineconeService:
                 "id": _id,
                 "score": item.score
             })
-        end_time = time.time()
-        print(f"Reranking took {end_time - start_time} seconds")
+        CLIENT_REQUEST_SECONDS.observe(time.perf_counter() - start_time, client="pinecone", operation="rerank")
         return {"results": reranked_results}
\ No newline at end of file
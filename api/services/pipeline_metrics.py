@@ -0,0 +1,158 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from collections import defaultdict
+from redis import Redis
+from logging_handler import use_logginghandler
+from api.utils.metrics import DEFAULT_BUCKETS, render_histogram, render_samples
+import bisect
+import threading
+import time
+
+logger = use_logginghandler()
+
+# redis set: names of the components reporting pipeline metrics (worker, sweeper, changes_feed)
+PIPELINE_COMPONENTS_KEY = "pipeline_metrics:components"
+# redis hash of a component: event:{name} => count, stage:{stage}:{bucket index|sum|count} => value
+PIPELINE_METRICS_KEY = "pipeline_metrics:{component}"
+# stage durations up to a minute (a bulk upsert or a slow CouchDB page)
+PIPELINE_BUCKETS = DEFAULT_BUCKETS + (30.0, 60.0)
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+class PipelineMetrics:
+    """
+    Counters and stage histograms of the embedding pipeline processes (queue worker, sweeper, changes feed).
+    The processes are short lived or run as separate pods, so the series are accumulated in Redis hashes
+    (buffered locally and flushed in a single pipeline) and exported by the API /metrics endpoint.
+    """
+
+    def __init__(self, cfg: Dict, redis_conn: Redis, component: str):
+        """
+        Initialize the pipeline metrics
+        Args:
+            cfg: dict: The configuration (optional `pipeline_metrics` section)
+            redis_conn: Redis: The redis connection
+            component: str: The reporting component (worker, sweeper, changes_feed)
+        """
+        metrics_cfg: Dict = cfg.get("pipeline_metrics") or {}
+        self.enabled = bool(metrics_cfg.get("enabled", True))
+        self.flush_interval = float(metrics_cfg.get("flush_interval", 5.0))
+        self.redis_conn = redis_conn
+        self.component = component
+        self.key = PIPELINE_METRICS_KEY.format(component=component)
+        self._pending: Dict[str, float] = defaultdict(float)
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def incr(self, event: str, amount: int = 1):
+        """
+        Count an event (processed, failed, retried, dropped, ...)
+        """
+        if not self.enabled or amount == 0:
+            return
+        with self._lock:
+            self._pending[f"event:{event}"] += amount
+        self._maybe_flush()
+
+    def observe(self, stage: str, seconds: float):
+        """
+        Record the duration of a stage
+        """
+        if not self.enabled:
+            return
+        index = bisect.bisect_left(PIPELINE_BUCKETS, seconds)
+        with self._lock:
+            if index < len(PIPELINE_BUCKETS):
+                self._pending[f"stage:{stage}:{index}"] += 1
+            self._pending[f"stage:{stage}:sum"] += seconds
+            self._pending[f"stage:{stage}:count"] += 1
+        self._maybe_flush()
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """
+        Time a stage (recorded even when the stage raises)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered increments to Redis (kept for the next flush if Redis is unavailable)
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            pipeline = self.redis_conn.pipeline(transaction=False)
+            pipeline.sadd(PIPELINE_COMPONENTS_KEY, self.component)
+            for field, amount in pending.items():
+                if field.endswith(":sum"):
+                    pipeline.hincrbyfloat(self.key, field, amount)
+                else:
+                    pipeline.hincrby(self.key, field, int(amount))
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Pipeline metrics flush failed: {e}")
+            with self._lock:
+                for field, amount in pending.items():
+                    self._pending[field] += amount
+
+def render_pipeline_metrics(redis_conn: Redis, queues: List[str], cache_stats_key: Optional[str] = None) -> List[str]:
+    """
+    Text exposition lines of the pipeline metrics of all components, the depth of the queues and the
+    shared embedding cache hit/miss counts (read from Redis at scrape time)
+    Args:
+        redis_conn: Redis: The redis connection
+        queues: List[str]: The queue names to sample with LLEN
+        cache_stats_key: str: The embedding cache stats hash (optional)
+    """
+    components = sorted(_decode(component) for component in redis_conn.smembers(PIPELINE_COMPONENTS_KEY))
+    pipeline = redis_conn.pipeline(transaction=False)
+    for component in components:
+        pipeline.hgetall(PIPELINE_METRICS_KEY.format(component=component))
+    for queue in queues:
+        pipeline.llen(queue)
+    if cache_stats_key:
+        pipeline.hgetall(cache_stats_key)
+    results = pipeline.execute()
+
+    events: Dict[Tuple, float] = {}
+    stages: Dict[Tuple, List[float]] = {}
+    for component, raw in zip(components, results[:len(components)]):
+        for field, value in raw.items():
+            field = _decode(field)
+            parts = field.split(":")
+            if parts[0] == "event" and len(parts) == 2:
+                events[(("component", component), ("event", parts[1]))] = float(value)
+            elif parts[0] == "stage" and len(parts) == 3:
+                labels = (("component", component), ("stage", parts[1]))
+                series = stages.setdefault(labels, [0.0] * (len(PIPELINE_BUCKETS) + 2))
+                if parts[2] == "sum":
+                    series[-2] = float(value)
+                elif parts[2] == "count":
+                    series[-1] = float(value)
+                else:
+                    series[int(parts[2])] = float(value)
+
+    depths = {(("queue", queue),): float(depth) for queue, depth in zip(queues, results[len(components):len(components) + len(queues)])}
+
+    lines = []
+    lines.extend(render_samples("mailio_pipeline_events_total", "Events of the embedding pipeline (processed, failed, retried, dropped)", "counter", events))
+    lines.extend(render_histogram("mailio_pipeline_stage_seconds", "Latency of the embedding pipeline stages in seconds", PIPELINE_BUCKETS, stages))
+    lines.extend(render_samples("mailio_embedding_queue_depth", "Tasks waiting in the embedding queue", "gauge", depths))
+    if cache_stats_key:
+        cache_stats = {_decode(field): float(value) for field, value in results[-1].items()}
+        lookups = {(("result", "hit"),): cache_stats.get("hits", 0.0), (("result", "miss"),): cache_stats.get("misses", 0.0)}
+        lines.extend(render_samples("mailio_embedding_cache_lookups_total", "Embedding cache lookups of all processes", "counter", lookups))
+    return lines
@@ -0,0 +1,118 @@
+from typing import Dict, List, Tuple
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from ..models.llm import EmailDocument
+from .pinecone_service import PineconeService
+from tools.optimal_embeddings_model.mailio_ai_libs.rerank_cascade import cascade_rerank_range, RERANK_FULL
+from loguru import logger
+import torch
+import time
+
+RERANK_BACKENDS = ["pinecone", "local"]
+
+class RerankService:
+    """
+    Rerank documents for a query, either with the hosted Pinecone reranker (bge-reranker-v2-m3)
+    or with a local cross-encoder loaded once per process
+    """
+
+    def __init__(self, cfg: Dict, pinecone_service: PineconeService = None):
+        """
+        Initialize the Rerank service
+        Args:
+            cfg: dict: The configuration (optional `rerank` section)
+            pinecone_service: PineconeService: Required for the pinecone backend
+        """
+        rerank_cfg: Dict = cfg.get("rerank") or {}
+        self.backend = rerank_cfg.get("backend", "pinecone")
+        if self.backend not in RERANK_BACKENDS:
+            raise ValueError(f"Unsupported rerank backend: {self.backend}, expected one of {RERANK_BACKENDS}")
+
+        self.max_candidates = int(rerank_cfg.get("max_candidates", 50))
+        self.batch_size = int(rerank_cfg.get("batch_size", 16))
+        self.max_length = int(rerank_cfg.get("max_length", 512))
+        self.pinecone_service = pinecone_service
+
+        cascade_cfg: Dict = rerank_cfg.get("cascade") or {}
+        self.cascade_enabled = bool(cascade_cfg.get("enabled", True))
+        self.cascade_gap_threshold = float(cascade_cfg.get("gap_threshold", 0.03))
+        self.cascade_band = int(cascade_cfg.get("band", 3))
+
+        if self.backend == "pinecone":
+            if self.pinecone_service is None:
+                raise ValueError("Pinecone service is required for the pinecone rerank backend")
+            return
+
+        self.model_name = rerank_cfg.get("model", "BAAI/bge-reranker-base")
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f"RerankService using local model {self.model_name} on device: {self.device}")
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+        self.model.to(self.device)
+        self.model.eval() # set to evaluation mode
+
+    def cascade(self, scores: List[float], knee: int = None) -> Tuple[str, int, int]:
+        """
+        Decide which results need reranking (see cascade_rerank_range)
+        Args:
+            scores: List[float]: dense scores in descending order
+            knee: int: knee point over the dense scores
+        Returns:
+            Tuple[str, int, int]: rerank path and the [start, end) range of results to rerank
+        """
+        if not self.cascade_enabled:
+            return RERANK_FULL, 0, len(scores)
+        return cascade_rerank_range(scores, knee, self.cascade_gap_threshold, self.cascade_band)
+
+    def rerank(self, query: str, documents: List[EmailDocument]) -> Dict:
+        """
+        Rerank the documents based on the query. Only the first `max_candidates` documents are scored.
+        Args:
+            query: str: The query
+            documents: List[EmailDocument]: The documents to rerank (in dense retrieval order)
+        Returns:
+            dict: {"results": [{"id": str, "score": float}]} sorted by score (descending)
+        """
+        candidates = documents[:self.max_candidates]
+        if len(candidates) == 0:
+            return {"results": []}
+        if self.backend == "pinecone":
+            return self.pinecone_service.rerank(query, candidates)
+        return self.rerank_local(query, candidates)
+
+    def rerank_local(self, query: str, documents: List[EmailDocument]) -> Dict:
+        """
+        Score (query, text) pairs with the local cross-encoder.
+        Pairs are tokenized once (truncating the document), sorted by token length and scored
+        in batches so that padding stays small.
+        """
+        start_time = time.time()
+
+        features = self.tokenizer(
+            [query] * len(documents),
+            [document.text for document in documents],
+            truncation="only_second",
+            max_length=self.max_length,
+        )
+        lengths = [len(input_ids) for input_ids in features["input_ids"]]
+        order = sorted(range(len(documents)), key=lambda i: lengths[i])
+
+        scores = [0.0] * len(documents)
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch_indices = order[start:start + self.batch_size]
+                batch = self.tokenizer.pad(
+                    [{key: features[key][i] for key in features.keys()} for i in batch_indices],
+                    padding=True,
+                    return_tensors="pt",
+                ).to(self.device)
+                logits = self.model(**batch).logits
+                # single relevance logit, normalized to 0..1 like the hosted reranker
+                batch_scores = torch.sigmoid(logits[:, -1]).cpu().tolist()
+                for i, score in zip(batch_indices, batch_scores):
+                    scores[i] = score
+
+        results = [{"id": document.id, "score": score} for document, score in zip(documents, scores)]
+        results.sort(key=lambda r: r["score"], reverse=True)
+
+        logger.debug(f"Local reranking of {len(documents)} documents took {time.time() - start_time} seconds")
+        return {"results": results}
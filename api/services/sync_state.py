@@ -0,0 +1,142 @@
+from typing import Dict, List, Optional
+from dataclasses import dataclass, asdict
+from redis import Redis
+import json
+import time
+
+# redis hash: database name => last processed _changes sequence
+CHANGES_SINCE_KEY = "embedding_sync:changes_since"
+# redis hash of the sweeper run in progress (run_id, since_ms, started)
+SYNC_RUN_KEY = "embedding_sync:run:{name}"
+# redis hash: address => json encoded AddressProgress of the run in progress
+SYNC_PROGRESS_KEY = "embedding_sync:progress:{name}"
+# cached address to sync of a subscriber (the subscriber without a legacyAddress, "" when the legacy address is null)
+MAPPING_CACHE_KEY = "embedding_sync:mapping:v3:{address}"
+# marker that the search indexes of a user database were verified
+INDEX_VERIFIED_KEY = "embedding_sync:index_verified:{db_name}"
+
+@dataclass
+class SyncRun:
+    run_id: str
+    since_ms: int
+    started: float
+    resumed: bool = False
+
+@dataclass
+class AddressProgress:
+    run_id: str
+    bookmark: Optional[str] = None
+    last_created: Optional[int] = None
+    processed: int = 0
+    failed: int = 0
+    indexes_ensured: bool = False
+    done: bool = False
+    timestamp: float = 0.0
+
+class SyncStateStore:
+    """
+    Checkpoints of the index synchronization kept in Redis (shared by all sync jobs)
+    """
+
+    def __init__(self, redis_conn: Redis):
+        """
+        Initialize the sync state store
+        Args:
+            redis_conn: Redis: The redis connection (decode_responses=True)
+        """
+        self.redis_conn = redis_conn
+
+    def get_since(self, db_name: str) -> Optional[str]:
+        """
+        Get the _changes checkpoint of a database (None if it was never consumed)
+        """
+        return self.redis_conn.hget(CHANGES_SINCE_KEY, db_name)
+
+    def set_since(self, db_name: str, since: str):
+        """
+        Store the _changes checkpoint of a database
+        """
+        self.redis_conn.hset(CHANGES_SINCE_KEY, db_name, since)
+
+    def start_run(self, since_ms: int, name: str = "sweeper") -> SyncRun:
+        """
+        Resume the unfinished sweeper run or start a new one
+        Args:
+            since_ms: int: The start of the sync window of a new run (a resumed run keeps its own window)
+            name: str: The run name (one run per sweeper)
+        Returns:
+            SyncRun: The run in progress
+        """
+        run_key = SYNC_RUN_KEY.format(name=name)
+        existing = self.redis_conn.hgetall(run_key)
+        if existing:
+            return SyncRun(run_id=existing["run_id"], since_ms=int(existing["since_ms"]), started=float(existing["started"]), resumed=True)
+
+        started = time.time()
+        run = SyncRun(run_id=str(int(started * 1000)), since_ms=since_ms, started=started)
+        self.redis_conn.delete(SYNC_PROGRESS_KEY.format(name=name))
+        self.redis_conn.hset(run_key, mapping={"run_id": run.run_id, "since_ms": run.since_ms, "started": run.started})
+        return run
+
+    def finish_run(self, name: str = "sweeper"):
+        """
+        Mark the run as finished (the next run starts from the first subscriber)
+        """
+        self.redis_conn.delete(SYNC_RUN_KEY.format(name=name), SYNC_PROGRESS_KEY.format(name=name))
+
+    def get_progress(self, run: SyncRun, address: str, name: str = "sweeper") -> AddressProgress:
+        """
+        Get the progress of an address in the run (fresh progress if the address was not started in this run)
+        """
+        raw = self.redis_conn.hget(SYNC_PROGRESS_KEY.format(name=name), address)
+        if raw:
+            progress = AddressProgress(**json.loads(raw))
+            if progress.run_id == run.run_id:
+                return progress
+        return AddressProgress(run_id=run.run_id)
+
+    def save_progress(self, address: str, progress: AddressProgress, name: str = "sweeper"):
+        """
+        Persist the progress of an address
+        """
+        progress.timestamp = time.time()
+        self.redis_conn.hset(SYNC_PROGRESS_KEY.format(name=name), address, json.dumps(asdict(progress)))
+
+    def all_progress(self, name: str = "sweeper") -> Dict[str, AddressProgress]:
+        """
+        Progress of all addresses of the run in progress
+        """
+        raw = self.redis_conn.hgetall(SYNC_PROGRESS_KEY.format(name=name))
+        return {address: AddressProgress(**json.loads(value)) for address, value in raw.items()}
+
+    def get_cached_mappings(self, addresses: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Get the cached addresses to sync of the subscribers (single round trip)
+        Returns:
+            Dict[str, Optional[str]]: address => address to sync (None if the legacy address is null), only cached addresses
+        """
+        if not addresses:
+            return {}
+        values = self.redis_conn.mget([MAPPING_CACHE_KEY.format(address=address) for address in addresses])
+        return {address: (value or None) for address, value in zip(addresses, values) if value is not None}
+
+    def cache_mappings(self, mappings: Dict[str, Optional[str]], ttl: int):
+        """
+        Cache the addresses to sync of the subscribers (None is cached too)
+        """
+        pipeline = self.redis_conn.pipeline(transaction=False)
+        for address, legacy_address in mappings.items():
+            pipeline.set(MAPPING_CACHE_KEY.format(address=address), legacy_address or "", ex=ttl)
+        pipeline.execute()
+
+    def is_index_verified(self, db_name: str) -> bool:
+        """
+        Check if the search indexes of the database were verified recently
+        """
+        return self.redis_conn.exists(INDEX_VERIFIED_KEY.format(db_name=db_name)) > 0
+
+    def mark_index_verified(self, db_name: str, ttl: int):
+        """
+        Remember that the search indexes of the database exist (for ttl seconds)
+        """
+        self.redis_conn.set(INDEX_VERIFIED_KEY.format(db_name=db_name), "1", ex=ttl)
@@ -0,0 +1,149 @@
+from typing import Dict, List
+from api.models.llm import EmailDocument
+from loguru import logger
+import re
+try:
+    import tiktoken
+    _TIKTOKEN_AVAILABLE = True
+except Exception:
+    _TIKTOKEN_AVAILABLE = False
+
+# reply/forward markers, everything after them is quoted history
+_QUOTED_HISTORY = re.compile(
+    r"(\bOn\s[^\n]{0,200}?\bwrote:|-{2,}\s*Original Message\s*-{2,}|-{2,}\s*Forwarded message\s*-{2,}|\bFrom:\s[^\n]{0,200}?\bSent:\s)",
+    re.IGNORECASE,
+)
+_QUOTED_LINE = re.compile(r"^\s*>.*$", re.MULTILINE)
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])")
+_WHITESPACE = re.compile(r"\s+")
+# sentences shorter than this are too generic to count as duplicates ("Thanks.", "Hi John.")
+MIN_DUPLICATE_SENTENCE_LENGTH = 24
+# json framing per document ({"id": ..., "text": ...})
+DOCUMENT_OVERHEAD_TOKENS = 12
+
+class DocumentPacker:
+    """
+    Fits the insights documents into a prompt token budget.
+    Counts tokens locally (tiktoken, or an approximation when it is not installed), strips quoted reply
+    history and sentences already present in a higher ranked document, and trims every document to a share
+    of the budget weighted by its (rerank) score.
+    """
+
+    def __init__(self, cfg: Dict):
+        """
+        Initialize the document packer
+        Args:
+            cfg: dict: The configuration (`openai` section: model, insights_prompt_budget, insights_min_document_tokens)
+        """
+        openai_cfg: Dict = cfg.get("openai") or {}
+        self.prompt_budget = int(openai_cfg.get("insights_prompt_budget", 8000))
+        self.min_document_tokens = int(openai_cfg.get("insights_min_document_tokens", 64))
+        self.encoding = None
+        if _TIKTOKEN_AVAILABLE:
+            try:
+                try:
+                    self.encoding = tiktoken.encoding_for_model(openai_cfg.get("model", ""))
+                except KeyError:
+                    self.encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # the BPE file is downloaded on first use, offline the approximation is used
+                logger.warning(f"tiktoken encoding unavailable, approximating token counts: {e}")
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens of a text
+        """
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        # rough approximation for english text
+        return (len(text) + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Truncate the text to at most max_tokens tokens
+        """
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            return self.encoding.decode(tokens[:max_tokens])
+        return text[:max_tokens * 4]
+
+    def strip_quoted(self, text: str) -> str:
+        """
+        Remove quoted reply history ("> ..." lines and everything after "On ... wrote:" and similar markers)
+        """
+        text = _QUOTED_LINE.sub("", text)
+        match = _QUOTED_HISTORY.search(text)
+        if match is not None and match.start() > 0:
+            text = text[:match.start()]
+        return text.strip()
+
+    def pack(self, system_prompt: str, documents: List[EmailDocument]) -> List[EmailDocument]:
+        """
+        Pack the documents into the prompt budget
+        Args:
+            system_prompt: str: The system prompt sent with the documents
+            documents: List[EmailDocument]: The documents (ordered by relevance)
+        Returns:
+            List[EmailDocument]: The documents that fit, trimmed, in the original order
+        """
+        available = self.prompt_budget - self.count_tokens(system_prompt)
+        if available <= 0 or len(documents) == 0:
+            return []
+
+        # remove quoted history and sentences already seen in a higher ranked document
+        ranked = sorted(range(len(documents)), key=lambda i: documents[i].score if documents[i].score is not None else 0.0, reverse=True)
+        seen = set()
+        texts = {}
+        for i in ranked:
+            kept = []
+            for sentence in _SENTENCE_SPLIT.split(self.strip_quoted(documents[i].text)):
+                normalized = _WHITESPACE.sub(" ", sentence).strip().lower()
+                if len(normalized) >= MIN_DUPLICATE_SENTENCE_LENGTH:
+                    if normalized in seen:
+                        continue
+                    seen.add(normalized)
+                kept.append(sentence)
+            texts[i] = "".join(kept).strip()
+
+        # drop the lowest ranked documents until every document gets at least the minimal share
+        per_document = self.min_document_tokens + DOCUMENT_OVERHEAD_TOKENS
+        selected = [i for i in ranked if texts[i]][:max(1, available // per_document)]
+
+        needs = {i: self.count_tokens(texts[i]) for i in selected}
+        weights = {i: max(documents[i].score or 0.0, 0.0) + 1e-3 for i in selected}
+        budget = available - DOCUMENT_OVERHEAD_TOKENS * len(selected)
+
+        # the minimal share first (only the single document kept for a tiny budget can get less)
+        floor_tokens = min(self.min_document_tokens, max(budget, 0) // len(selected))
+        allocation = {i: min(needs[i], floor_tokens) for i in selected}
+        budget -= sum(allocation.values())
+
+        # weighted water-filling of the rest: documents needing less than their share give the rest back
+        extra = {i: needs[i] - allocation[i] for i in selected}
+        remaining = sorted([i for i in selected if extra[i] > 0], key=lambda i: extra[i] / weights[i])
+        while remaining:
+            total_weight = sum(weights[i] for i in remaining)
+            i = remaining[0]
+            share = int(budget * weights[i] / total_weight)
+            if extra[i] <= share:
+                allocation[i] += extra[i]
+                budget -= extra[i]
+                remaining.pop(0)
+                continue
+            # nobody left fits entirely, split what is left by weight
+            for j in remaining:
+                allocation[j] += max(0, int(budget * weights[j] / total_weight))
+            break
+
+        packed = []
+        for i in sorted(selected):
+            text = texts[i] if allocation[i] >= needs[i] else self.truncate(texts[i], allocation[i])
+            if text:
+                packed.append(EmailDocument(id=documents[i].id, text=text, score=documents[i].score))
+        return packed
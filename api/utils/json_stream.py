@@ -0,0 +1,79 @@
+import json
+from typing import Any, List, Tuple
+
+class InsightsStreamParser:
+    """
+    Incremental parser for the insights JSON object produced by the LLM token by token.
+    Emits top-level string fields (e.g. `answer`) and every completed object of the `results`
+    array as soon as its closing brace arrives, without waiting for the whole completion.
+    """
+
+    def __init__(self, array_key: str = "results", value_keys: Tuple[str, ...] = ("answer",)):
+        self.array_key = array_key
+        self.value_keys = value_keys
+        self.text = ""
+        self.pos = 0
+        self.stack: List[str] = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.key = None
+        self.expect_value = False
+        self.array_open = False
+        self.item_start = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Feed the next piece of the completion
+        Args:
+            chunk: str: The next content delta
+        Returns:
+            List[Tuple[str, Any]]: completed events, ("answer", str) or ("result", dict)
+        """
+        events = []
+        self.text += chunk
+        while self.pos < len(self.text):
+            c = self.text[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    if self.stack == ["{"]:
+                        value = json.loads(self.text[self.string_start:self.pos + 1])
+                        if self.expect_value:
+                            if self.key in self.value_keys:
+                                events.append((self.key, value))
+                        else:
+                            self.key = value
+            elif c == '"':
+                self.in_string = True
+                self.string_start = self.pos
+            elif c == ":" and self.stack == ["{"]:
+                self.expect_value = True
+            elif c == "," and self.stack == ["{"]:
+                self.expect_value = False
+            elif c in "{[":
+                if c == "[" and self.stack == ["{"] and self.expect_value and self.key == self.array_key:
+                    self.array_open = True
+                self.stack.append(c)
+                if c == "{" and self.array_open and len(self.stack) == 3:
+                    self.item_start = self.pos
+            elif c in "}]":
+                if self.stack:
+                    self.stack.pop()
+                if c == "}" and self.item_start is not None and len(self.stack) == 2:
+                    events.append(("result", json.loads(self.text[self.item_start:self.pos + 1])))
+                    self.item_start = None
+                if c == "]" and self.array_open and len(self.stack) == 1:
+                    self.array_open = False
+            self.pos += 1
+        return events
+
+    def result(self) -> Any:
+        """
+        The complete parsed object (once the completion is finished)
+        """
+        return json.loads(self.text)
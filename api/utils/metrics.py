@@ -0,0 +1,149 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import bisect
+import threading
+
+# latency buckets in seconds (from a cache hit to a slow LLM call)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+def format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in labels]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+def render_histogram(name: str, documentation: str, buckets: Sequence[float], series: Dict[Tuple[Tuple[str, str], ...], List[float]]) -> List[str]:
+    """
+    Text exposition lines of a histogram
+    Args:
+        name: str: The metric name
+        documentation: str: The help text
+        buckets: Sequence[float]: The bucket upper bounds (without +Inf)
+        series: labels => [per bucket counts (not cumulative)..., sum, count]
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} histogram"]
+    for labels in sorted(series.keys()):
+        values = series[labels]
+        labels = list(labels)
+        cumulative = 0.0
+        for bound, count in zip(buckets, values):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels(labels + [('le', format_value(bound))])} {int(cumulative)}")
+        lines.append(f"{name}_bucket{format_labels(labels + [('le', '+Inf')])} {int(values[-1])}")
+        lines.append(f"{name}_sum{format_labels(labels)} {format_value(values[-2])}")
+        lines.append(f"{name}_count{format_labels(labels)} {int(values[-1])}")
+    return lines
+
+def render_samples(name: str, documentation: str, metric_type: str, samples: Dict[Tuple[Tuple[str, str], ...], float]) -> List[str]:
+    """
+    Text exposition lines of a counter or gauge
+    Args:
+        samples: labels => value
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels in sorted(samples.keys()):
+        lines.append(f"{name}{format_labels(list(labels))} {format_value(samples[labels])}")
+    return lines
+
+class Histogram:
+    """
+    Prometheus style histogram (cumulative buckets, sum and count per label set) kept in process memory
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values => [bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        """
+        Record an observation
+        Args:
+            value: float: The observed value (seconds for latencies)
+            labels: the label values (all labelnames are required)
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0.0] * (len(self.buckets) + 2)
+                self._series[key] = series
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        """
+        Text exposition lines of the histogram
+        """
+        with self._lock:
+            snapshot = {tuple(zip(self.labelnames, key)): list(series) for key, series in self._series.items()}
+        return render_histogram(self.name, self.documentation, self.buckets, snapshot)
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[float, int]]:
+        """
+        Sum and count per label values
+        """
+        with self._lock:
+            return {key: (series[-2], int(series[-1])) for key, series in self._series.items()}
+
+class MetricsRegistry:
+    """
+    Registry of the in-process metrics exported on the /metrics endpoint.
+    Every API worker process keeps its own series (Prometheus sums them across scraped targets).
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """
+        Get or create a histogram
+        """
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = Histogram(name, documentation, labelnames, buckets)
+                self._metrics[name] = metric
+            return metric
+
+    def get(self, name: str) -> Optional[Histogram]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """
+        Text exposition of all registered metrics
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+# latency of the search pipeline stages (selfquery, compose, embedding, pinecone_query, knee, hydration, rerank, total)
+SEARCH_STAGE_SECONDS = REGISTRY.histogram(
+    "mailio_search_stage_seconds",
+    "Latency of the semantic search pipeline stages in seconds",
+    labelnames=("stage",),
+)
+
+# latency of calls to external services outside of the search stages (LLM insights, Pinecone hosted rerank)
+CLIENT_REQUEST_SECONDS = REGISTRY.histogram(
+    "mailio_client_request_seconds",
+    "Latency of requests to external services in seconds",
+    labelnames=("client", "operation"),
+)
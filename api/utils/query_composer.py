@@ -11,6 +11,8 @@ from pydantic import BaseModel
 from abc import ABC, abstractmethod
 import traceback
 from email_validator import validate_email, EmailNotValidError
+from collections import OrderedDict
+import threading
 import re
 
 class Expr(BaseModel):
@@ -305,21 +307,65 @@ class QueryParams(BaseModel):
     fromEmail: Optional[str] = None
     sort: Optional[Literal["desc", "asc", "NO_SORT"]] = None 
 
+# attribute names the LLM sometimes leaves unquoted, e.g. eq(from_email, "a@b.c")
+_UNQUOTED_ATTRIBUTE = re.compile(r'(?<!")\b(created|from_email)\b(?!")')
+# composed filters of repeated (sort, filter) strings
+COMPOSE_CACHE_SIZE = 1024
+
+_parser: Lark = None
+_parser_lock = threading.Lock()
+
+def get_parser() -> Lark:
+    """
+    The filter parser, built once per process (the LALR tables are also cached on disk by Lark)
+    """
+    global _parser
+    if _parser is None:
+        with _parser_lock:
+            if _parser is None:
+                _parser = Lark(GRAMMAR, parser='lalr', start='program', transformer=QueryTransformer(), cache=True)
+    return _parser
+
 class QueryComposer:
     
     def __init__(self):
-        self.parser = Lark(GRAMMAR, parser='lalr', start='program', transformer=QueryTransformer())
+        self.parser = get_parser()
+        # (sort, filter) => composed query params
+        self._cache: "OrderedDict[Tuple[Any, Any], QueryParams]" = OrderedDict()
+        self._lock = threading.Lock()
 
     def parse_date_to_milliseconds(self, date: str) -> int:
         return int(datetime.datetime.strptime(date, "%Y-%m-%d").timestamp() * 1000)
     
-    def fix_filter_expressions(self, filter_expression: str) -> list[str]:
-        pattern = r'(?<!")\b(created|from_email)\b(?!")'
-        def quote_param(match):
-            # Wrap the matched word with quotes
-            return f'"{match.group(1)}"'
+    def fix_filter_expressions(self, filter_expression: str) -> str:
+        # Wrap the matched word with quotes
+        return _UNQUOTED_ATTRIBUTE.sub(r'"\1"', filter_expression)
 
-        return re.sub(pattern, quote_param, filter_expression)
+    def compose_cached(self, query_json: dict) -> QueryParams:
+        """
+        Compose the query params, reusing the result of a previously composed identical sort and filter
+        Returns:
+            QueryParams: a copy of the composed params (None if the query is invalid)
+        """
+        key = (query_json.get("sort"), query_json.get("filter"))
+        try:
+            hash(key)
+        except TypeError:
+            return self.compose(query_json)
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached.model_copy()
+
+        query_params = self.compose(query_json)
+        if query_params is not None:
+            with self._lock:
+                self._cache[key] = query_params.model_copy()
+                while len(self._cache) > COMPOSE_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return query_params
 
     def compose(self, query_json: dict) -> QueryParams:
         try:
@@ -388,6 +434,20 @@ class QueryComposer:
             logger.error(f"Error parsing query: {e}")
             return None
 
+_query_composer: QueryComposer = None
+_query_composer_lock = threading.Lock()
+
+def get_query_composer() -> QueryComposer:
+    """
+    The query composer shared by all requests of the process
+    """
+    global _query_composer
+    if _query_composer is None:
+        with _query_composer_lock:
+            if _query_composer is None:
+                _query_composer = QueryComposer()
+    return _query_composer
+
 if __name__ == "__main__":
     query_json = {"query":"electricity bill","filter":"and(gte(\"created\", \"2024-04-01\"), lt(\"created\", \"2024-05-01\"))","sort":"NO_SORT"}
     query_json = { "query": "invitation", "filter": "gt(\"created\", \"2025-02-01\")", "sort": "desc(\"created\")" }
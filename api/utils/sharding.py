@@ -0,0 +1,34 @@
+from typing import List, Tuple
+import hashlib
+import os
+
+def shard_of(key: str, shard_count: int) -> int:
+    """
+    Stable shard of a key (same across processes and Python versions, unlike hash())
+    """
+    digest = hashlib.sha1(key.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+def shard_from_env() -> Tuple[int, int]:
+    """
+    Shard of this worker from the environment: SHARD_INDEX (or JOB_COMPLETION_INDEX of an Indexed
+    kubernetes Job) and SHARD_COUNT. Without them there is a single shard.
+    Returns:
+        Tuple[int, int]: shard index and shard count
+    """
+    shard_count = int(os.getenv("SHARD_COUNT", "1"))
+    shard_index = int(os.getenv("SHARD_INDEX", os.getenv("JOB_COMPLETION_INDEX", "0")))
+    if shard_count < 1:
+        raise ValueError(f"Invalid SHARD_COUNT: {shard_count}")
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard index {shard_index} for {shard_count} shards")
+    return shard_index, shard_count
+
+def select_shard(keys: List[str], shard_index: int, shard_count: int) -> List[str]:
+    """
+    Keys that belong to the shard (empty keys, e.g. subscriptions without an address, are skipped)
+    """
+    keys = [key for key in keys if key]
+    if shard_count == 1:
+        return keys
+    return [key for key in keys if shard_of(key, shard_count) == shard_index]
@@ -0,0 +1,50 @@
+from typing import Dict, Iterator, Optional
+from contextlib import contextmanager
+from .metrics import Histogram, SEARCH_STAGE_SECONDS
+import time
+
+class RequestTrace:
+    """
+    Spans of a single request. Each span is recorded in the stage histogram when it ends,
+    and the per request durations can be returned in a Server-Timing header.
+    """
+
+    def __init__(self, histogram: Histogram = SEARCH_STAGE_SECONDS):
+        self.histogram = histogram
+        self.started = time.perf_counter()
+        # stage => accumulated seconds (a stage may run more than once, e.g. a re-query)
+        self.durations: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """
+        Time a stage of the request (recorded even when the stage raises)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage: str, seconds: float):
+        """
+        Record the duration of a stage
+        """
+        self.histogram.observe(seconds, stage=stage)
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def finish(self, stage: str = "total") -> float:
+        """
+        Record the total duration of the request
+        """
+        total = time.perf_counter() - self.started
+        self.record(stage, total)
+        return total
+
+    def server_timing(self) -> Optional[str]:
+        """
+        Server-Timing header value of the recorded stages (durations in milliseconds)
+        """
+        if not self.durations:
+            return None
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.durations.items())
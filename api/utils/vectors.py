@@ -0,0 +1,59 @@
+from typing import List, Union
+import numpy as np
+import base64
+import binascii
+
+# dtypes accepted for base64 encoded vectors (little endian)
+VECTOR_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+
+def decode_vector(vector_b64: str, dtype: str, dimension: int) -> np.ndarray:
+    """
+    Decode a base64 encoded little endian float16/float32 vector
+    Args:
+        vector_b64: str: The base64 encoded vector bytes
+        dtype: str: float32 or float16
+        dimension: int: The expected number of values
+    Returns:
+        np.ndarray: float32 vector
+    Raises:
+        ValueError: if the encoding, size or values are invalid
+    """
+    np_dtype = VECTOR_DTYPES.get(dtype or "float32")
+    if np_dtype is None:
+        raise ValueError(f"Invalid vector dtype: {dtype}, expected one of {list(VECTOR_DTYPES.keys())}")
+    try:
+        raw = base64.b64decode(vector_b64, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("Invalid base64 vector")
+    if len(raw) != dimension * np_dtype.itemsize:
+        raise ValueError("Invalid vector size")
+    return validate_vector(np.frombuffer(raw, dtype=np_dtype), dimension)
+
+def validate_vector(vector: Union[List[float], np.ndarray], dimension: int) -> np.ndarray:
+    """
+    Validate the dimension and values of a vector (all at once instead of element by element)
+    Returns:
+        np.ndarray: float32 vector
+    Raises:
+        ValueError: if the size or values are invalid
+    """
+    try:
+        array = np.asarray(vector, dtype=np.float32)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid vector type")
+    if array.ndim != 1 or array.shape[0] != dimension:
+        raise ValueError("Invalid vector size")
+    if not np.isfinite(array).all():
+        raise ValueError("Invalid vector values")
+    return array
+
+def to_values(vector: Union[List[float], np.ndarray]) -> List[float]:
+    """
+    Convert a vector to the list of floats expected by the Pinecone client (once, at the client boundary)
+    """
+    if isinstance(vector, np.ndarray):
+        return vector.astype(np.float32, copy=False).tolist()
+    return vector
@@ -0,0 +1,318 @@
+"""
+In-process stand-ins for CouchDB (Cloudant client), Pinecone (gRPC client and index) and Redis.
+They implement the subset of the client APIs used by the services, so the benchmarks run the real
+service code without network access. An optional per call latency simulates the round trip.
+"""
+from typing import Dict, List, Optional
+from types import SimpleNamespace
+from concurrent.futures import Future
+from api.services import client_factory
+from api.services.client_factory import ClientFactory
+from api.services.couchdb_service import SEARCH_SUMMARY_FIELD
+import numpy as np
+import copy
+import json
+import threading
+import time
+
+class FakeResult:
+    """
+    DetailedResponse stand-in
+    """
+
+    def __init__(self, result):
+        self.result = result
+
+    def get_result(self):
+        return self.result
+
+def _matches(doc: Dict, selector: Dict) -> bool:
+    """
+    Evaluate the Mango selector operators used by the services ($and, $or, $in, $eq, $ne, $exists, $gte, $lte)
+    """
+    for field, condition in selector.items():
+        if field == "$and":
+            if not all(_matches(doc, part) for part in condition):
+                return False
+            continue
+        if field == "$or":
+            if not any(_matches(doc, part) for part in condition):
+                return False
+            continue
+        # dotted fields address nested objects (didCommMessage.type)
+        value, present = doc, True
+        for part in field.split("."):
+            if isinstance(value, dict) and part in value:
+                value = value[part]
+            else:
+                value, present = None, False
+                break
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            # like Mango, a missing field matches only $exists: false
+            if operator != "$exists" and not present:
+                return False
+            if operator == "$eq" and value != operand:
+                return False
+            if operator == "$ne" and value == operand:
+                return False
+            if operator == "$in" and value not in operand:
+                return False
+            if operator == "$exists" and present != operand:
+                return False
+            if operator == "$gte" and (value is None or value < operand):
+                return False
+            if operator == "$lte" and (value is None or value > operand):
+                return False
+    return True
+
+class FakeCloudant:
+    """
+    Cloudant client stand-in over in-memory databases
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.dbs: Dict[str, Dict[str, Dict]] = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def load(self, db_name: str, docs: List[Dict]):
+        db = self.dbs.setdefault(db_name, {})
+        for doc in docs:
+            db[doc["_id"]] = copy.deepcopy(doc)
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def get_document(self, db: str, doc_id: str, **kwargs) -> FakeResult:
+        self._call()
+        return FakeResult(copy.deepcopy(self.dbs[db][doc_id]))
+
+    def put_document(self, db: str, doc_id: str, document: Dict, **kwargs) -> FakeResult:
+        self._call()
+        with self._lock:
+            self.dbs[db][doc_id] = copy.deepcopy(document)
+        return FakeResult({"ok": True, "id": doc_id})
+
+    def post_bulk_get(self, db: str, docs: List, **kwargs) -> FakeResult:
+        self._call()
+        results = []
+        for doc in docs:
+            stored = self.dbs[db].get(doc.id)
+            entry = {"ok": copy.deepcopy(stored)} if stored is not None else {"error": {"id": doc.id, "error": "not_found"}}
+            results.append({"id": doc.id, "docs": [entry]})
+        return FakeResult({"results": results})
+
+    def post_all_docs(self, db: str, keys: List[str] = None, include_docs: bool = False, **kwargs) -> FakeResult:
+        self._call()
+        rows = []
+        for key in keys or []:
+            if key in self.dbs[db]:
+                row = {"id": key, "key": key, "value": {"rev": "1-0"}}
+                if include_docs:
+                    row["doc"] = copy.deepcopy(self.dbs[db][key])
+                rows.append(row)
+            else:
+                rows.append({"key": key, "error": "not_found"})
+        return FakeResult({"rows": rows})
+
+    def put_design_document(self, db: str, ddoc: str, design_document, **kwargs) -> FakeResult:
+        self._call()
+        return FakeResult({"ok": True, "id": f"_design/{ddoc}"})
+
+    def post_view(self, db: str, ddoc: str, view: str, keys: List[str] = None, **kwargs) -> FakeResult:
+        """
+        The search summary view (SEARCH_SUMMARY_MAP), the only view the services query
+        """
+        self._call()
+        rows = []
+        for key in keys or []:
+            doc = self.dbs[db].get(key)
+            if doc is not None:
+                value = {"created": doc.get("created"), "folder": doc.get("folder"), "summary": copy.deepcopy(doc.get(SEARCH_SUMMARY_FIELD))}
+                rows.append({"id": key, "key": key, "value": value})
+        return FakeResult({"rows": rows})
+
+    def post_find(self, db: str, selector: Dict, fields: List[str] = None, limit: int = 25, bookmark: Optional[str] = None, **kwargs) -> FakeResult:
+        """
+        Results are ordered by (created, _id), the bookmark is the key of the last returned document
+        """
+        self._call()
+        with self._lock:
+            docs = [doc for doc in self.dbs.get(db, {}).values() if _matches(doc, selector)]
+        docs.sort(key=lambda doc: (doc.get("created") or 0, doc["_id"]))
+        if bookmark:
+            after = tuple(json.loads(bookmark))
+            docs = [doc for doc in docs if (doc.get("created") or 0, doc["_id"]) > after]
+        page = docs[:limit]
+        if fields:
+            page = [{field: doc[field] for field in fields if field in doc} for doc in page]
+        else:
+            page = copy.deepcopy(page)
+        next_bookmark = json.dumps([page[-1].get("created") or 0, page[-1]["_id"]]) if page else None
+        return FakeResult({"docs": page, "bookmark": next_bookmark})
+
+class FakePineconeIndex:
+    """
+    Pinecone index stand-in: exact (brute force) cosine search with metadata filters per namespace
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.namespaces: Dict[str, Dict[str, tuple]] = {}
+        self._matrices: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors: List[Dict], namespace: str, async_req: bool = False, **kwargs):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._lock:
+            store = self.namespaces.setdefault(namespace, {})
+            for vector in vectors:
+                store[vector["id"]] = (np.asarray(vector["values"], dtype=np.float32), vector.get("metadata") or {})
+            self._matrices.pop(namespace, None)
+        response = SimpleNamespace(upserted_count=len(vectors))
+        if not async_req:
+            return response
+        future = Future()
+        future.set_result(response)
+        return future
+
+    def delete(self, ids: List[str] = None, namespace: str = None, **kwargs):
+        with self._lock:
+            store = self.namespaces.get(namespace, {})
+            for _id in ids or []:
+                store.pop(_id, None)
+            self._matrices.pop(namespace, None)
+
+    def _matrix(self, namespace: str):
+        with self._lock:
+            cached = self._matrices.get(namespace)
+            if cached is None:
+                store = self.namespaces.get(namespace, {})
+                ids = list(store.keys())
+                matrix = np.zeros((0, 0), dtype=np.float32)
+                if ids:
+                    matrix = np.stack([store[_id][0] for _id in ids])
+                    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+                cached = (ids, matrix, [store[_id][1] for _id in ids])
+                self._matrices[namespace] = cached
+            return cached
+
+    def query(self, vector: List[float], top_k: int, namespace: str, filter: Dict = None, include_metadata: bool = True, **kwargs):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        ids, matrix, metadatas = self._matrix(namespace)
+        if not ids:
+            return SimpleNamespace(matches=[])
+        query = np.asarray(vector, dtype=np.float32)
+        scores = matrix @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        if filter:
+            allowed = np.array([_matches(metadata, filter) for metadata in metadatas])
+            scores = np.where(allowed, scores, -np.inf)
+        top = np.argsort(-scores)[:top_k]
+        matches = [
+            SimpleNamespace(id=ids[i], score=float(scores[i]), metadata=metadatas[i] if include_metadata else None)
+            for i in top if np.isfinite(scores[i])
+        ]
+        return SimpleNamespace(matches=matches)
+
+class FakeInference:
+    """
+    Hosted rerank stand-in (token overlap between the query and the document)
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def rerank(self, model: str, query: str, documents: List[Dict], top_n: int, **kwargs):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        query_tokens = set(query.lower().split())
+        scored = []
+        for index, document in enumerate(documents):
+            tokens = set(document["text"].lower().split())
+            scored.append(SimpleNamespace(index=index, score=len(query_tokens & tokens) / (len(query_tokens) or 1)))
+        scored.sort(key=lambda item: item.score, reverse=True)
+        return SimpleNamespace(rerank_result=SimpleNamespace(data=scored[:top_n]))
+
+class FakePinecone:
+    """
+    Pinecone gRPC client stand-in
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.index = FakePineconeIndex(latency)
+        self.inference = FakeInference(latency)
+        self.index_names: List[str] = []
+
+    def list_indexes(self):
+        return [{"name": name} for name in self.index_names]
+
+    def create_index(self, name: str, **kwargs):
+        self.index_names.append(name)
+
+    def describe_index(self, name: str):
+        return SimpleNamespace(status={"ready": True})
+
+    def Index(self, name: str, **kwargs) -> FakePineconeIndex:
+        return self.index
+
+class FakeRedis:
+    """
+    Redis stand-in for the string and hash commands used by the embedding cache
+    """
+
+    def __init__(self):
+        self.values: Dict[str, bytes] = {}
+        self.hashes: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        return self.values.get(key)
+
+    def set(self, key: str, value, ex: int = None):
+        self.values[key] = value
+        return True
+
+    def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        with self._lock:
+            fields = self.hashes.setdefault(key, {})
+            fields[field] = fields.get(field, 0) + amount
+            return fields[field]
+
+    def hgetall(self, key: str) -> Dict:
+        return dict(self.hashes.get(key, {}))
+
+class FakeClientFactory(ClientFactory):
+    """
+    Client factory returning the stand-ins (connection pool tracking stays active)
+    """
+
+    def __init__(self, cfg: Dict, couchdb: FakeCloudant, pinecone: FakePinecone):
+        super().__init__(cfg)
+        self.fake_couchdb = couchdb
+        self.fake_pinecone = pinecone
+
+    def cloudant(self):
+        return self.fake_couchdb
+
+    def pinecone(self):
+        return self.fake_pinecone
+
+    def pinecone_index(self, index_name: str):
+        return self.fake_pinecone.Index(index_name)
+
+def install_fakes(cfg: Dict, couchdb_latency: float = 0.0, pinecone_latency: float = 0.0) -> FakeClientFactory:
+    """
+    Make the stand-ins the clients of this process (services created afterwards use them)
+    """
+    factory = FakeClientFactory(cfg, FakeCloudant(couchdb_latency), FakePinecone(pinecone_latency))
+    with client_factory._client_factory_lock:
+        client_factory._client_factory = factory
+    return factory
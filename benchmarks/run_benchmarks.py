@@ -0,0 +1,262 @@
+"""
+Offline benchmarks of the indexing and search hot paths.
+
+Runs the real services against synthetic CouchDB documents and in-process stand-ins for CouchDB,
+Pinecone and Redis (see benchmarks/fakes.py), and writes the results as JSON to compare across commits:
+
+    CONFIG_PATH=conf-prod.yaml python -m benchmarks.run_benchmarks --docs 1000 --queries 200 --output bench.json
+    CONFIG_PATH=conf-prod.yaml python -m benchmarks.run_benchmarks --baseline bench.json
+"""
+from typing import Dict, List
+from starlette.responses import Response
+from config import get_config
+from api.services.couchdb_service import CouchDBService, SEARCH_SUMMARY_FIELD
+from api.services.embedding_service import EmbeddingService
+from api.services.embedding_cache import EmbeddingCache
+from api.services.embedding_task_queue import create_metadata
+from api.services.pinecone_service import PineconeService
+from api.services.overfetch_service import OverfetchService
+from api.services.rerank_service import RerankService
+from api.services.deletion_service import DeletionService
+from api.services.missing_ids_cache import MissingIdsCache
+from api.routes.embeddings_api import query_embedding
+from api.utils.metrics import SEARCH_STAGE_SECONDS
+from benchmarks.fakes import FakeRedis, install_fakes
+from benchmarks.synthetic import make_corpus, make_queries
+import numpy as np
+import argparse
+import asyncio
+import copy
+import json
+import platform
+import subprocess
+import sys
+import time
+
+# messages per sweeper page (same as index_sync_embeddings.SYNC_CHUNK_SIZE)
+SYNC_CHUNK_SIZE = 200
+
+class FakeLLMService:
+    """
+    Returns the precomputed self-query result of each synthetic query (no OpenAI call)
+    """
+
+    def __init__(self, selfqueries: Dict[str, Dict]):
+        self.selfqueries = selfqueries
+
+    async def selfquery(self, query: str) -> str:
+        return json.dumps(self.selfqueries.get(query, {"query": query, "filter": "NO_FILTER", "sort": "NO_SORT"}))
+
+def benchmark_config(cfg: Dict, model: str = None) -> Dict:
+    """
+    Copy of the configuration with placeholder credentials (the stand-ins do not connect anywhere)
+    """
+    cfg = copy.deepcopy(cfg)
+    cfg["couchdb"] = {
+        **(cfg.get("couchdb") or {}),
+        "host": "http://localhost:5984",
+        "username": "benchmark",
+        "password": "benchmark",
+    }
+    cfg["pinecone"] = {
+        "index_name": "https://benchmark-index.svc.pinecone.io",
+        "cloud": "aws",
+        "region": "us-east-1",
+        **(cfg.get("pinecone") or {}),
+        "api_key": "benchmark",
+    }
+    cfg["rerank"] = {**(cfg.get("rerank") or {}), "backend": "pinecone"}
+    if model:
+        cfg["embedding_model"] = model
+    return cfg
+
+def throughput(docs: int, seconds: float) -> Dict:
+    return {"docs": docs, "seconds": round(seconds, 4), "docs_per_sec": round(docs / seconds, 2) if seconds > 0 else None}
+
+def bench_parse(couchdb_service: CouchDBService, corpus: Dict[str, List[Dict]]) -> Dict:
+    """
+    didCommMessage decoding, HTML cleanup and sentence splitting (CouchDBService.message_to_email)
+    """
+    docs = [doc for mailbox in corpus.values() for doc in mailbox]
+    start = time.perf_counter()
+    for doc in docs:
+        couchdb_service.message_to_email(doc)
+    return throughput(len(docs), time.perf_counter() - start)
+
+def bench_embed(embedding_service: EmbeddingService, couchdb_service: CouchDBService, corpus: Dict[str, List[Dict]]) -> Dict:
+    """
+    Passage embedding of parsed emails (without the embedding cache)
+    """
+    emails = [couchdb_service.message_to_email(doc) for mailbox in corpus.values() for doc in mailbox]
+    cache, embedding_service.cache = embedding_service.cache, None
+    try:
+        # warm up (model weights, kernels) outside of the measurement
+        for email in emails[:5]:
+            embedding_service.create_embedding(email)
+        start = time.perf_counter()
+        for email in emails:
+            embedding_service.create_embedding(email)
+        return throughput(len(emails), time.perf_counter() - start)
+    finally:
+        embedding_service.cache = cache
+
+def bench_index(couchdb_service: CouchDBService, embedding_service: EmbeddingService, pinecone_service: PineconeService, corpus: Dict[str, List[Dict]]) -> Dict:
+    """
+    Sweeper path (mirrors index_sync_embeddings.sync_chunk): page through not yet indexed messages,
+    embed (with the embedding cache), bulk upsert and flag the messages as indexed
+    """
+    indexed = 0
+    start = time.perf_counter()
+    for address in corpus.keys():
+        for messages, emails, _ in couchdb_service.iter_latest_emails(address, 0, limit=SYNC_CHUNK_SIZE):
+            rows = []
+            pending = {}
+            for message, email in zip(messages, emails):
+                metadata = {k: v for k, v in create_metadata(email).items() if v is not None}
+                rows.append((address, email.message_id, embedding_service.create_embedding(email), metadata))
+                pending[email.message_id] = (message, email)
+            for result in pinecone_service.upsert_bulk(rows):
+                if not result.ok:
+                    continue
+                for message_id in result.ids:
+                    message, email = pending[message_id]
+                    message["search"] = True
+                    message[SEARCH_SUMMARY_FIELD] = couchdb_service.create_search_summary(email)
+                    couchdb_service.put_message(message, address)
+                    indexed += 1
+    result = throughput(indexed, time.perf_counter() - start)
+    if embedding_service.cache is not None:
+        result["embedding_cache_hit_rate"] = round(embedding_service.cache.hit_rate(), 4)
+    return result
+
+async def bench_query(cfg: Dict, services: Dict, addresses: List[str], queries: List[tuple], top_k: int) -> Dict:
+    """
+    GET /api/v1/embedding handler end to end (self-query result precomputed, everything else real)
+    """
+    before = SEARCH_STAGE_SECONDS.totals()
+    latencies = []
+    for index, (query, _) in enumerate(queries):
+        start = time.perf_counter()
+        await query_embedding(
+            response=Response(),
+            address=addresses[index % len(addresses)],
+            query=query,
+            top_k=top_k,
+            folder=None,
+            beforeTimestamp=None,
+            afterTimestamp=None,
+            from_email=None,
+            user=None,
+            config=cfg,
+            **services,
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+    await services["deletion_service"].flush()
+
+    stages_ms = {}
+    for key, (total, count) in SEARCH_STAGE_SECONDS.totals().items():
+        previous_total, previous_count = before.get(key, (0.0, 0))
+        if count > previous_count:
+            stages_ms[key[0]] = round((total - previous_total) / (count - previous_count) * 1000, 3)
+
+    latencies = np.asarray(latencies)
+    return {
+        "queries": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "stage_mean_ms": stages_ms,
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def compare(results: Dict, baseline: Dict) -> List[str]:
+    """
+    Relative change of every numeric result against a baseline run
+    """
+    lines = []
+    for name, values in results["results"].items():
+        for key, value in values.items():
+            base = (baseline.get("results", {}).get(name) or {}).get(key)
+            if isinstance(value, (int, float)) and isinstance(base, (int, float)) and base:
+                lines.append(f"{name}.{key}: {base} -> {value} ({(value - base) / base:+.1%})")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the indexing and search hot paths")
+    parser.add_argument("--docs", type=int, default=500, help="number of synthetic messages")
+    parser.add_argument("--addresses", type=int, default=4, help="number of mailboxes")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2, help="share of messages copied across mailboxes")
+    parser.add_argument("--queries", type=int, default=200, help="number of search queries")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--model", default=None, help="embedding model (default: embedding_model of the config)")
+    parser.add_argument("--couchdb-latency-ms", type=float, default=0.0, help="simulated CouchDB round trip")
+    parser.add_argument("--pinecone-latency-ms", type=float, default=0.0, help="simulated Pinecone round trip")
+    parser.add_argument("--skip", nargs="*", default=[], choices=["parse", "embed", "index", "query"])
+    parser.add_argument("--output", default=None, help="write the JSON results to a file (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    cfg = benchmark_config(get_config(), args.model)
+    install_fakes(cfg, args.couchdb_latency_ms / 1000, args.pinecone_latency_ms / 1000)
+
+    couchdb_service = CouchDBService(cfg)
+    embedding_service = EmbeddingService(cfg, cache=EmbeddingCache(cfg, FakeRedis()))
+    pinecone_service = PineconeService(cfg, dimension=embedding_service.model.config.hidden_size)
+
+    corpus = make_corpus(args.docs, args.addresses, args.duplicate_ratio, args.seed)
+    for address, docs in corpus.items():
+        couchdb_service.client.load(couchdb_service.address_to_db_name(address), docs)
+    queries = make_queries(args.queries, args.seed)
+
+    results = {}
+    if "parse" not in args.skip:
+        results["parse"] = bench_parse(couchdb_service, corpus)
+    if "embed" not in args.skip:
+        results["embed"] = bench_embed(embedding_service, couchdb_service, corpus)
+    if "index" not in args.skip or "query" not in args.skip:
+        # the query benchmark searches the indexed corpus
+        results["index"] = bench_index(couchdb_service, embedding_service, pinecone_service, corpus)
+    if "query" not in args.skip:
+        missing_ids_cache = MissingIdsCache(cfg)
+        services = {
+            "pinecone_service": pinecone_service,
+            "embedding_service": embedding_service,
+            "couchdb_service": couchdb_service,
+            "llm_service": FakeLLMService(dict(queries)),
+            "overfetch_service": OverfetchService(cfg),
+            "rerank_service": RerankService(cfg, pinecone_service=pinecone_service),
+            "deletion_service": DeletionService(cfg, pinecone_service=pinecone_service, missing_ids_cache=missing_ids_cache),
+            "missing_ids_cache": missing_ids_cache,
+        }
+        results["query"] = asyncio.run(bench_query(cfg, services, list(corpus.keys()), queries, args.top_k))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "model": embedding_service.embedding_model,
+        "device": embedding_service.device,
+        "params": vars(args),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        print("\n".join(compare(report, baseline)), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
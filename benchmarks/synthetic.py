@@ -0,0 +1,131 @@
+from typing import Dict, List, Tuple
+from api.services.couchdb_service import FIXED_FOLDERS, SMTP_MESSAGE_TYPE
+import base64
+import json
+import random
+import time
+
+# topics of the synthetic mailbox (subject templates and body vocabulary)
+TOPICS = {
+    "receipt": (
+        ["Your order #{n} has shipped", "Receipt for your payment of ${n}", "Invoice {n} is available"],
+        ["order", "shipped", "tracking", "invoice", "payment", "total", "delivery", "refund", "warehouse", "carrier"],
+    ),
+    "newsletter": (
+        ["Weekly digest: {n} stories you missed", "This week in engineering #{n}", "Product update {n}"],
+        ["release", "feature", "community", "webinar", "roadmap", "article", "podcast", "event", "update", "subscribe"],
+    ),
+    "travel": (
+        ["Flight confirmation {n}", "Your hotel booking {n}", "Itinerary change for trip {n}"],
+        ["flight", "departure", "gate", "hotel", "check-in", "boarding", "reservation", "airport", "seat", "luggage"],
+    ),
+    "work": (
+        ["Meeting notes {n}", "Re: quarterly planning {n}", "Design review for project {n}"],
+        ["meeting", "deadline", "budget", "proposal", "review", "milestone", "agenda", "contract", "feedback", "team"],
+    ),
+    "personal": (
+        ["Dinner on Friday?", "Photos from the weekend {n}", "Happy birthday!"],
+        ["dinner", "weekend", "family", "birthday", "photos", "vacation", "garden", "movie", "recipe", "party"],
+    ),
+}
+
+FILLER = ["the", "a", "we", "your", "please", "about", "with", "for", "this", "that", "will", "be", "is", "on", "and", "of", "to", "in"]
+
+SENDERS = [
+    ("Shop Orders", "orders@shop.example.com"),
+    ("Engineering Weekly", "digest@news.example.com"),
+    ("Air Example", "no-reply@air.example.com"),
+    ("Alice Smith", "alice@example.org"),
+    ("Bob Jones", "bob@example.net"),
+]
+
+def _sentence(rng: random.Random, vocabulary: List[str]) -> str:
+    words = [rng.choice(vocabulary) if rng.random() < 0.4 else rng.choice(FILLER) for _ in range(rng.randint(6, 18))]
+    return " ".join(words).capitalize() + "."
+
+def _html_body(rng: random.Random, vocabulary: List[str], paragraphs: int) -> str:
+    """
+    HTML body with the parts the parser strips (style, links, images)
+    """
+    parts = ["<html><head><style>p { margin: 0 } .footer { color: #999 }</style></head><body>"]
+    for _ in range(paragraphs):
+        sentences = " ".join(_sentence(rng, vocabulary) for _ in range(rng.randint(2, 6)))
+        parts.append(f"<p>{sentences} <a href=\"https://example.com/{rng.randint(0, 10**6)}\">Read more</a></p>")
+        if rng.random() < 0.2:
+            parts.append(f"<img src=\"https://example.com/{rng.randint(0, 10**6)}.png\" alt=\"image\">")
+    parts.append("<div class=\"footer\">You are receiving this email because you subscribed. <a href=\"https://example.com/unsubscribe\">Unsubscribe</a></div>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+def make_message(rng: random.Random, message_id: str, created: int, topic: str) -> Dict:
+    """
+    A CouchDB message document as stored by the mailio server (didCommMessage with a base64 plain body)
+    """
+    subjects, vocabulary = TOPICS[topic]
+    sender_name, sender_email = rng.choice(SENDERS)
+    body = {
+        "subject": rng.choice(subjects).format(n=rng.randint(1, 9999)),
+        "from": {"Name": sender_name, "Address": sender_email},
+        "bodyHtml": _html_body(rng, vocabulary, rng.randint(1, 30)),
+    }
+    return {
+        "_id": message_id,
+        "folder": rng.choice(FIXED_FOLDERS),
+        "created": created,
+        "didCommMessage": {
+            "type": SMTP_MESSAGE_TYPE,
+            "plainBodyBase64": base64.b64encode(json.dumps(body).encode("utf-8")).decode("ascii"),
+        },
+    }
+
+def make_corpus(docs: int, addresses: int, duplicate_ratio: float = 0.2, seed: int = 42) -> Dict[str, List[Dict]]:
+    """
+    A synthetic mailbox per address. A share of the messages are identical copies of earlier
+    messages delivered to other addresses (newsletters, notifications), as in production.
+    Args:
+        docs: int: total number of messages
+        addresses: int: number of addresses (Pinecone namespaces, user databases)
+        duplicate_ratio: float: share of messages copied from another mailbox
+        seed: int: random seed (the corpus is reproducible)
+    Returns:
+        Dict[str, List[Dict]]: address => message documents
+    """
+    rng = random.Random(seed)
+    now_ms = int(time.time() * 1000)
+    mailboxes: Dict[str, List[Dict]] = {f"0x{index:040x}": [] for index in range(1, addresses + 1)}
+    address_list = list(mailboxes.keys())
+    originals: List[Dict] = []
+    for index in range(docs):
+        address = address_list[index % addresses]
+        message_id = f"<{index}.{rng.randint(0, 10**9)}@mail.example.com>"
+        created = now_ms - rng.randint(0, 80 * 24 * 60 * 60 * 1000)
+        if originals and rng.random() < duplicate_ratio:
+            message = {**json.loads(json.dumps(rng.choice(originals))), "_id": message_id}
+        else:
+            message = make_message(rng, message_id, created, rng.choice(list(TOPICS.keys())))
+            originals.append(message)
+        mailboxes[address].append(message)
+    return mailboxes
+
+def make_queries(count: int, seed: int = 42) -> List[Tuple[str, Dict]]:
+    """
+    Synthetic search queries with the self-query result the LLM would return for them
+    Returns:
+        List[Tuple[str, Dict]]: (query, self-query JSON)
+    """
+    rng = random.Random(seed + 1)
+    queries = []
+    for _ in range(count):
+        topic = rng.choice(list(TOPICS.keys()))
+        words = rng.sample(TOPICS[topic][1], 3)
+        query = " ".join(words)
+        roll = rng.random()
+        if roll < 0.6:
+            selfquery = {"query": query, "filter": "NO_FILTER", "sort": "NO_SORT"}
+        elif roll < 0.8:
+            sender = rng.choice(SENDERS)[1]
+            selfquery = {"query": query, "filter": f'eq("from_email", "{sender}")', "sort": "NO_SORT"}
+        else:
+            selfquery = {"query": query, "filter": "NO_FILTER", "sort": "desc(\"created\")"}
+        queries.append((query, selfquery))
+    return queries
@@ -0,0 +1,90 @@
+from config import get_config
+from api.services.couchdb_service import CouchDBService
+from api.services.embedding_task_queue import EmbeddingTaskQueue
+from api.services.sync_state import SyncStateStore
+from api.services.address_resolver import AddressResolver
+from api.services.pipeline_metrics import PipelineMetrics
+from api.utils.sharding import shard_from_env, select_shard
+from logging_handler import configure_logging
+from logging_handler import use_logginghandler
+import time
+
+# Initialize config
+cfg = get_config()
+couchdb_service = CouchDBService(cfg)
+embedding_task_queue = EmbeddingTaskQueue(cfg)
+sync_state = SyncStateStore(embedding_task_queue.redis_conn)
+address_resolver = AddressResolver(cfg, couchdb_service, sync_state)
+# counters and per stage timings, exported by the API /metrics endpoint
+metrics = PipelineMetrics(cfg, embedding_task_queue.redis_conn, "changes_feed")
+
+# Initialize logging on import
+configure_logging(cfg)
+
+# Module-scoped logger
+logger = use_logginghandler()
+
+# subscribers are partitioned by a stable hash of the address across the replicas
+SHARD_INDEX, SHARD_COUNT = shard_from_env()
+
+# changes read per _changes request
+CHANGES_BATCH_SIZE = 500
+
+def consume_changes(address: str) -> int:
+    """
+    Enqueue the new or modified messages of a subscriber since the last checkpoint.
+    Without a checkpoint the feed starts at "now", the history is covered by the index sweeper.
+    Returns:
+        int: number of messages enqueued for embedding
+    """
+    db_name = couchdb_service.address_to_db_name(address)
+    since = sync_state.get_since(db_name) or "now"
+    enqueued = 0
+    while True:
+        with metrics.stage("fetch_changes"):
+            message_ids, last_seq, pending = couchdb_service.get_changes(address, since=since, limit=CHANGES_BATCH_SIZE)
+        embedding_task_queue.upsert_embeddings(address, message_ids)
+        enqueued += len(message_ids)
+        metrics.incr("enqueued", len(message_ids))
+        # checkpoint only after the messages are enqueued (at least once delivery)
+        if last_seq is not None:
+            sync_state.set_since(db_name, last_seq)
+            since = last_seq
+        if not pending or last_seq is None:
+            break
+    return enqueued
+
+def sync_changes():
+    """
+    Enqueue new and modified messages of all subscribers from the CouchDB changes feeds
+    """
+    logger.info("Starting changes feed sync run")
+    try:
+        subscribers = select_shard(couchdb_service.get_all_subscribed_users(), SHARD_INDEX, SHARD_COUNT)
+    except Exception as e:
+        logger.exception("Failed to list subscribers: %s", e)
+        return
+
+    # legacy addresses of all subscribers at once (cached across runs)
+    resolved = address_resolver.resolve_all(subscribers)
+
+    enqueued_total = 0
+    for subscriber in subscribers:
+        address = resolved.get(subscriber)
+        if address is None:
+            logger.warning("No valid legacy address for address=%s, skipping", subscriber)
+            continue
+        try:
+            enqueued = consume_changes(address)
+            enqueued_total += enqueued
+            logger.debug("address=%s enqueued=%d", address, enqueued)
+        except Exception as e:
+            logger.exception("address=%s changes feed failed: %s", address, e)
+
+    metrics.flush()
+    logger.info("Changes feed sync finished: enqueued_total=%d", enqueued_total)
+    time.sleep(4) # sleep to flush the logs
+
+if __name__ == "__main__":
+    logger.info("__main__ invoked for changes feed sync")
+    sync_changes()
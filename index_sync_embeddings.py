@@ -1,13 +1,18 @@
 import logging
 from config import get_config
-from api.services.couchdb_service import CouchDBService
+from api.services.couchdb_service import CouchDBService, SEARCH_SUMMARY_FIELD
 from api.services.pinecone_service import PineconeService
 from api.services.embedding_service import EmbeddingService
+from api.services.embedding_cache import EmbeddingCache
 from logging_handler import configure_logging
 from datetime import datetime, timedelta, UTC
-from api.services.embedding_task_queue import create_metadata
+from api.services.embedding_task_queue import create_metadata, init_redis
+from api.services.sync_state import SyncStateStore, SyncRun
+from api.services.address_resolver import AddressResolver
+from api.services.pipeline_metrics import PipelineMetrics
+from api.utils.sharding import shard_from_env, select_shard
 from tools.optimal_embeddings_model.data_types.email import Email
-from typing import Tuple, List
+from typing import List
 from logging_handler import use_logginghandler
 import time
 
@@ -15,7 +20,13 @@ import time
 cfg = get_config()
 couchdb_service = CouchDBService(cfg)
 pinecone_service = PineconeService(cfg)
-embedding_service = EmbeddingService(cfg)
+# identical passages (newsletters, receipts) are embedded once across subscribers
+embedding_cache = EmbeddingCache(cfg, init_redis(cfg, decode_responses=False))
+embedding_service = EmbeddingService(cfg, cache=embedding_cache, role="sweeper")
+sync_state = SyncStateStore(init_redis(cfg))
+address_resolver = AddressResolver(cfg, couchdb_service, sync_state)
+# counters and per stage timings, exported by the API /metrics endpoint
+metrics = PipelineMetrics(cfg, sync_state.redis_conn, "sweeper")
 
 # Initialize logging on import
 configure_logging(cfg)
@@ -23,32 +34,112 @@ configure_logging(cfg)
 # Module-scoped logger
 logger = use_logginghandler()
 
+# subscribers are partitioned by a stable hash of the address across the sweeper replicas
+SHARD_INDEX, SHARD_COUNT = shard_from_env()
+# every shard has its own run and progress checkpoints
+RUN_NAME = "sweeper" if SHARD_COUNT == 1 else f"sweeper-{SHARD_INDEX}-of-{SHARD_COUNT}"
+
+# messages per page: embedded, upserted in bulk and checkpointed together
+SYNC_CHUNK_SIZE = 200
+
 def list_subscribers():
     """
-    List all subscribers
+    List the subscribers of this shard
     """
     subs = couchdb_service.get_all_subscribed_users()
-    logger.info(f"Fetched {len(subs)} subscribed users")
-    return subs
+    shard_subs = select_shard(subs, SHARD_INDEX, SHARD_COUNT)
+    logger.info(f"Fetched {len(subs)} subscribed users, {len(shard_subs)} in shard {SHARD_INDEX}/{SHARD_COUNT}")
+    return shard_subs
 
-def list_latest_emails(address: str) -> Tuple[List[dict], List[Email]]:
+def sync_chunk(address: str, messages: List[dict], emails: List[Email]) -> int:
     """
-    List the latest emails for a subscriber (that have search=False, undefined or empty)
-    Args:
-        address: str: The address of the subscriber
+    Embed a chunk of messages, upsert them in bulk and flag the successfully upserted messages as indexed
     Returns:
-        Tuple[List[dict], List[Email]]: messages = raw docs for update later, Email specific objects for embedding
+        int: number of messages indexed
     """
-    # --- Compute epoch for 3 months ago ---
-    three_months_ago = datetime.now(UTC) - timedelta(days=90)
-    epoch_ms = int(three_months_ago.timestamp() * 1000)
+    rows = []
+    pending = {}
+    for message, email in zip(messages, emails):
+        try:
+            # # Embed into Pinecone rows
+            message_id = email.message_id
+            metadata = create_metadata(email)
+            with metrics.stage("inference"):
+                vector = embedding_service.create_embedding(email)
+
+            # remove from metadata all fields with None
+            metadata = {k: v for k, v in metadata.items() if v is not None}
+            rows.append((address, message_id, vector, metadata))
+            pending[message_id] = (message, email)
+        except Exception as e:
+            metrics.incr("embedding_failed")
+            logger.exception("address=%s message_id=%s embedding failed: %s", address, getattr(email, "message_id", None), e)
+
+    if not rows:
+        return 0
+
+    indexed = 0
+    with metrics.stage("upsert"):
+        results = pinecone_service.upsert_bulk(rows)
+    for result in results:
+        if not result.ok:
+            metrics.incr("upsert_failed", len(result.ids))
+            logger.error("address=%s upsert of %d messages failed: %s", address, len(result.ids), result.error)
+            continue
+        for message_id in result.ids:
+            message, email = pending[message_id]
+            try:
+                # after successfull upsert, update the message with flag: search: true
+                with metrics.stage("flag"):
+                    message["search"] = True
+                    message[SEARCH_SUMMARY_FIELD] = couchdb_service.create_search_summary(email)
+                    couchdb_service.put_message(message, address)
+                indexed += 1
+                logger.debug("upserted message_id=%s rev=%s", message_id, getattr(email, "_rev", None))
+            except Exception as e:
+                metrics.incr("flag_failed")
+                logger.exception("address=%s message_id=%s flagging as indexed failed: %s", address, message_id, e)
+    metrics.incr("processed", indexed)
+    return indexed
 
-    # returns latest emails while skipping emails that have search=True and filters out non smtp emails
-    # there is no limit on the number of emails returned
-    messages, latest_emails = couchdb_service.get_latest_emails(address, epoch_ms)
-    logger.info("address=%s latest_emails=%d since=%s", address, len(latest_emails), three_months_ago.isoformat())
-    return messages, latest_emails
+def sync_address(address: str, run: SyncRun) -> int:
+    """
+    Index the latest emails of a subscriber (that have search=False, undefined or empty), page by page.
+    Progress (bookmark, last created, counts) is saved after every page so a killed run resumes where it stopped.
+    Returns:
+        int: number of messages indexed in this invocation
+    """
+    progress = sync_state.get_progress(run, address, name=RUN_NAME)
+    if progress.done:
+        logger.info("address=%s already synced in run=%s, skipping", address, run.run_id)
+        return 0
+    if progress.bookmark:
+        logger.info("address=%s resuming run=%s processed=%d", address, run.run_id, progress.processed)
 
+    if not progress.indexes_ensured:
+        address_resolver.ensure_indexes(address)
+        progress.indexes_ensured = True
+        sync_state.save_progress(address, progress, name=RUN_NAME)
+
+    indexed_total = 0
+    # a page is fetched from CouchDB and parsed while the iterator advances
+    page_started = time.perf_counter()
+    for messages, emails, bookmark in couchdb_service.iter_latest_emails(address, run.since_ms, bookmark=progress.bookmark, limit=SYNC_CHUNK_SIZE):
+        metrics.observe("fetch_page", time.perf_counter() - page_started)
+        indexed = sync_chunk(address, messages, emails) if messages else 0
+        indexed_total += indexed
+        progress.bookmark = bookmark
+        progress.processed += indexed
+        progress.failed += len(messages) - indexed
+        progress.last_created = max((email.created for email in emails if email.created is not None), default=progress.last_created)
+        sync_state.save_progress(address, progress, name=RUN_NAME)
+        page_started = time.perf_counter()
+
+    progress.done = True
+    sync_state.save_progress(address, progress, name=RUN_NAME)
+    metrics.incr("addresses")
+    logger.info("address=%s latest_emails=%d failed=%d since=%s", address, progress.processed, progress.failed, datetime.fromtimestamp(run.since_ms / 1000, UTC).isoformat())
+    return indexed_total
 
 def sync_embeddings():
     """
@@ -61,50 +152,34 @@ def sync_embeddings():
         logger.exception("Failed to list subscribers: %s", e)
         return
 
+    # --- sync window: 3 months back (a resumed run keeps the window it started with) ---
+    three_months_ago = datetime.now(UTC) - timedelta(days=90)
+    run = sync_state.start_run(int(three_months_ago.timestamp() * 1000), name=RUN_NAME)
+    logger.info("%s sync run=%s", "Resuming" if run.resumed else "Starting", run.run_id)
+
+    # legacy addresses of all subscribers at once (cached across runs)
+    resolved = address_resolver.resolve_all(subscribers)
+
     processed_total = 0
-    for address in subscribers:
-        logger.info("Processing subscriber address=%s", address)
+    for subscriber in subscribers:
+        address = resolved.get(subscriber)
+        logger.info("Processing subscriber address=%s", subscriber)
+        if address is None:
+            logger.warning("No valid legacy address found for address=%s, skipping", subscriber)
+            continue
         try:
-            # check for legacy address
-            try:
-                mapping = couchdb_service.get_mailio_mapping(address)
-                if mapping:
-                    if "legacyAddress" in mapping:
-                        address = mapping.get("legacyAddress")
-                        logger.info("Found legacy address=%s for address=%s", address, mapping.get("legacyAddress", "unknown"))
-            except Exception as e:
-                logger.exception("Failed to get mailio mapping for address=%s: %s", address, e)
-            if address is None:
-                logger.warning("No legacy address found for address=%s, skipping", address)
-                continue
-            if not address.startswith("0x"):
-                logger.warning("Address=%s is not a valid legacy address, skipping", address)
-                continue
-            couchdb_service.ensure_indexes(address)
-            messages, latest_emails = list_latest_emails(address)
-            for message, email in zip(messages, latest_emails):
-                try:
-                    # # Embed + upsert into Pinecone
-                    message_id = email.message_id
-                    metadata = create_metadata(email)
-                    vector = embedding_service.create_embedding(email)
-
-                    # remove from metadata all fields with None 
-                    metadata = {k: v for k, v in metadata.items() if v is not None}
-                    pinecone_service.upsert(address, message_id, vector.tolist(), metadata)
-
-                    # after successfull upsert, update the message with flag: search: true
-                    message["search"] = True
-                    couchdb_service.put_message(message, address)
-                    processed_total += 1
-                    logger.debug("upserted message_id=%s rev=%s", getattr(email, "message_id", None), getattr(email, "_rev", None))
-                except Exception as e:
-                    logger.exception("address=%s message_id=%s embed/upsert failed: %s", address, getattr(email, "message_id", None), e)
+            processed_total += sync_address(address, run)
         except Exception as e:
             import traceback
             logger.error("address=%s failed during ensure_indexes/get_latest_emails: %s", address, traceback.format_exc())
 
-    logger.info("Embeddings sync finished: processed_total=%d", processed_total)
+    progress = sync_state.all_progress(name=RUN_NAME)
+    failed_total = sum(p.failed for p in progress.values())
+    sync_state.finish_run(name=RUN_NAME)
+    metrics.flush()
+    logger.info("Embeddings sync finished: run=%s processed_total=%d failed_total=%d addresses=%d", run.run_id, processed_total, failed_total, len(progress))
+    cache_stats = embedding_cache.stats()
+    logger.info("Embedding cache: hits=%d misses=%d hit_rate=%.2f%%", cache_stats["hits"], cache_stats["misses"], cache_stats["hit_rate"] * 100)
     time.sleep(4) # sleep for 2 seconds to flush the logs
 
 if __name__ == "__main__":
@@ -12,6 +12,10 @@ from api.services.embedding_service import EmbeddingService
 from api.services.pinecone_service import PineconeService
 from api.services.embedding_task_queue import EmbeddingTaskQueue, create_embedding
 from api.services.llm_service import LLMService
+from api.services.overfetch_service import OverfetchService
+from api.services.rerank_service import RerankService
+from api.services.deletion_service import DeletionService
+from api.services.missing_ids_cache import MissingIdsCache
 import os
 import multiprocessing
 
@@ -56,6 +60,16 @@ app.state.embedding_service = EmbeddingService(cfg)
 app.state.pinecone_service = PineconeService(cfg, dimension=app.state.embedding_service.model.config.hidden_size)
 app.state.embedding_task_queue = EmbeddingTaskQueue(cfg)
 app.state.llm_service = LLMService(cfg)
+app.state.overfetch_service = OverfetchService(cfg)
+app.state.rerank_service = RerankService(cfg, pinecone_service=app.state.pinecone_service)
+app.state.missing_ids_cache = MissingIdsCache(cfg)
+app.state.deletion_service = DeletionService(cfg, pinecone_service=app.state.pinecone_service, missing_ids_cache=app.state.missing_ids_cache)
+
+async def flush_deletions():
+    # execute the queued Pinecone deletes before the process exits
+    await app.state.deletion_service.flush()
+
+app.add_event_handler("shutdown", flush_deletions)
 
 
 app.include_router(main_router)
@@ -1,4 +1,4 @@
-from typing import List, Optional, Tuple, Dict, Set
+from typing import Iterator, List, Optional, Tuple, Dict, Set
 import torch
 from transformers import PreTrainedModel, PreTrainedTokenizer, BatchEncoding
 from transformers import AutoTokenizer, AutoModel
@@ -6,6 +6,7 @@ from sentence_transformers.models import Pooling
 import sys
 import os
 import gc
+import hashlib
 import json
 import numpy as np
 import time
@@ -51,114 +52,168 @@ def memory_cleanup(model:PreTrainedModel, tokenizer: PreTrainedTokenizer, embedd
     elif torch.backends.mps.is_available():
         torch.mps.empty_cache()  # MPS equivalent (PyTorch 2.0+)
 
-def create_embeddings(embedder: Embedder, files:List, output_folder:str, force_embedding_creation:bool = False) -> Tuple[np.ndarray, np.ndarray, int]:
+def iter_jsonl(files: List[str]) -> Iterator[Dict]:
+    """
+    Stream the records of jsonl files line by line (files are never read whole)
+    """
+    for file in files:
+        with open(file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+def email_texts(email: Email) -> List[str]:
+    """
+    Texts embedded for an email (one corpus row per text)
+    """
+    text = []
+    if email.sender_name:
+        text.append(f"sent from {email.sender_name}")
+    if email.subject:
+        text = [email.subject]
+    if len(email.sentences) > 0:
+        text.extend(email.sentences)
+    return text
+
+def content_hash(texts: List[str]) -> str:
+    """
+    Hash of the embedded texts of an email (a changed email is embedded again)
+    """
+    return hashlib.sha256(json.dumps(texts).encode("utf-8")).hexdigest()
+
+def embed_bucketed(embedder: Embedder, texts: List[str], batch_size: int = 64) -> np.ndarray:
+    """
+    Embed texts in batches of similar length (sorted by length, so batches carry little padding)
+    Returns:
+        np.ndarray: embeddings in the order of the texts
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    embeddings = None
+    for batch_start in range(0, len(order), batch_size):
+        batch = order[batch_start:batch_start + batch_size]
+        batch_embeddings = embedder.batch_embed([texts[i] for i in batch])
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=batch_embeddings.dtype)
+        embeddings[batch] = batch_embeddings
+    return embeddings
+
+def load_embeddings_cache(output_folder: str, emebddings_filename: str) -> Dict[Tuple[str, str], np.ndarray]:
+    """
+    Load the cached corpus embeddings of a model
+    Returns:
+        Dict[Tuple[str, str], np.ndarray]: (message_id, content hash) => embeddings of the email
+    """
+    paths = [os.path.join(output_folder, f"{emebddings_filename}{suffix}.npy") for suffix in ["", "_index", "_hash"]]
+    if not all(os.path.exists(path) for path in paths):
+        return {}
+    embeddings, embeddings_index, embeddings_hash = [np.load(path) for path in paths]
+    cache = {}
+    row = 0
+    while row < len(embeddings_index):
+        end = row + 1
+        while end < len(embeddings_index) and embeddings_index[end] == embeddings_index[row] and embeddings_hash[end] == embeddings_hash[row]:
+            end += 1
+        cache[(str(embeddings_index[row]), str(embeddings_hash[row]))] = embeddings[row:end]
+        row = end
+    return cache
+
+def create_embeddings(embedder: Embedder, files:List, output_folder:str, force_embedding_creation:bool = False, batch_size: int = 64, window_size: int = 4096) -> Tuple[np.ndarray, np.ndarray, float]:
     """
     Create embeddings for the given sentences
-    It will save the embeddings to a file to a datafolder with the model name
+    It will save the embeddings to a file to a datafolder with the model name.
+    Embeddings are cached per message id and content hash, only new or changed emails are embedded.
     Args:
-        model: PreTrainedModel
-        tokenizer: PreTrainedTokenizer
         embedder: Embedder
-        files: List of jsonl files to read the data from
+        files: List of jsonl files to read the data from (streamed)
+        output_folder: folder of the model embeddings (cache)
+        force_embedding_creation: ignore the cache
+        batch_size: texts per forward pass (length bucketed)
+        window_size: texts collected, sorted by length and embedded together
     Returns:
         np_emebddings: numpy array vstack of embeddings
         embeddings_index: numpy array of message_ids
-        average_time: average time taken to embed a sentence
+        average_time: average time taken to embed an email (0 if every email was cached)
     """
     emebddings_filename = "embeddings"
-    
-    all_embeddings_index = []
-    all_embeddings = []
-    all_embeddings_timing = []
-
-    # check if embeddings already exists
-    if not force_embedding_creation:
-        if os.path.exists(os.path.join(output_folder, f"{emebddings_filename}.npy")) and \
-           os.path.exists(os.path.join(output_folder, f"{emebddings_filename}_index.npy")):
-            with open(os.path.join(output_folder, f"{emebddings_filename}.npy"), 'rb') as f:
-                np_emebddings = np.load(f)
-            
-            with open(os.path.join(output_folder, f"{emebddings_filename}_index.npy"), 'rb') as f:
-                embeddings_index = np.load(f)
-            
-            return np_emebddings, embeddings_index, 0
-
-    # create embeddings
-    for file in files:
-        with open(file, 'r') as f:
-            jsonl = f.read()
-
-        data = jsonl.split('\n')
-        data = [json.loads(d) for d in data if d]
-        for item in tqdm(data, desc="Creating embeddings for {}".format(file)):
-            email = Email.from_dict(item)
-            text = []
-            if email.sender_name:
-                text.append(f"sent from {email.sender_name}")
-            if email.subject:
-                text = [email.subject]
-            if len(email.sentences) > 0:
-                text.extend(email.sentences)
-            
-            if len(text) == 0: # nothing to embed
-                continue
-            
-            start_time = time.time()
-            embeddings = embedder.embed(text)
-            elapsed_time = time.time() - start_time
-            all_embeddings_timing.append(elapsed_time)
-
-            # collect embeddings and associated index
-            all_embeddings.extend(embeddings)
-            all_embeddings_index.extend([email.message_id] * len(embeddings))
-
-            assert len(all_embeddings_index) == len(all_embeddings)
-
-    # stack embeddings
-    np_emebddings = np.vstack(all_embeddings)
-    embeddings_index = np.array(all_embeddings_index)
+    cache = {} if force_embedding_creation else load_embeddings_cache(output_folder, emebddings_filename)
+
+    # per email (message_id, content hash, embeddings); embeddings of new emails are filled in per window
+    emails: List[list] = []
+    pending: List[Tuple[int, List[str]]] = []
+    pending_texts = 0
+    embedded_emails = 0
+    embedding_time = 0.0
+
+    def embed_pending():
+        nonlocal pending, pending_texts, embedded_emails, embedding_time
+        if not pending:
+            return
+        texts = [text for _, email_text in pending for text in email_text]
+        start_time = time.time()
+        embeddings = embed_bucketed(embedder, texts, batch_size)
+        embedding_time += time.time() - start_time
+        row = 0
+        for slot, email_text in pending:
+            emails[slot][2] = embeddings[row:row + len(email_text)]
+            row += len(email_text)
+        embedded_emails += len(pending)
+        pending, pending_texts = [], 0
+
+    for item in tqdm(iter_jsonl(files), desc="Creating embeddings"):
+        email = Email.from_dict(item)
+        texts = email_texts(email)
+        if len(texts) == 0: # nothing to embed
+            continue
+
+        key = (str(email.message_id), content_hash(texts))
+        cached = cache.get(key)
+        # the same email repeated back to back shares one cache entry (the hash fixes the number of texts)
+        emails.append([key[0], key[1], cached[:len(texts)] if cached is not None else None])
+        if emails[-1][2] is None:
+            pending.append((len(emails) - 1, texts))
+            pending_texts += len(texts)
+            if pending_texts >= window_size:
+                embed_pending()
+    embed_pending()
+    logger.info(f"Embedded {embedded_emails} new or changed emails, {len(emails) - embedded_emails} from cache")
+
+    # stack embeddings (one row per text, the index and hash repeat the email of the row)
+    np_emebddings = np.vstack([embeddings for _, _, embeddings in emails])
+    embeddings_index = np.array([message_id for message_id, _, embeddings in emails for _ in range(len(embeddings))])
+    embeddings_hash = np.array([digest for _, digest, embeddings in emails for _ in range(len(embeddings))])
+    assert len(embeddings_index) == len(np_emebddings)
 
     # Save the embeddings to a file
-    with open(os.path.join(output_folder, f"{emebddings_filename}.npy"), 'wb') as f:
-        np.save(f, np_emebddings)
+    if embedded_emails > 0 or len(cache) != len(emails):
+        for suffix, array in [("", np_emebddings), ("_index", embeddings_index), ("_hash", embeddings_hash)]:
+            with open(os.path.join(output_folder, f"{emebddings_filename}{suffix}.npy"), 'wb') as f:
+                np.save(f, array)
 
-    with open(os.path.join(output_folder, f"{emebddings_filename}_index.npy"), 'wb') as f:
-        np.save(f, embeddings_index)
-  
-    average_time = sum(all_embeddings_timing) / len(all_embeddings_timing)
+    average_time = embedding_time / embedded_emails if embedded_emails > 0 else 0
     
     return np_emebddings, embeddings_index, average_time
 
-def load_evaluation_dataset(embedder:Embedder, datasetpath:str, output_folder:str):
+def load_evaluation_dataset(embedder:Embedder, datasetpath:str, output_folder:str, batch_size: int = 64):
     """
     Load the evaluation dataset, create embeddings and save them to a file if they don't exist
     Args:
         datasetpath: Path to the dataset
         embedder: Embedder object
         output_folder: Output folder to save the embeddings
+        batch_size: queries per forward pass (length bucketed)
     Returns:
         embeddings: numpy array vstack of embeddings
     """
-    with open(datasetpath, 'r') as f:
-        jsonl = f.read()
-
-    data = jsonl.split('\n')
-    data = [json.loads(d) for d in data if d]
-
     # check if embeddings for the dataset already exists
     if os.path.exists(f"{output_folder}/query_embeddings.npy"):
         logger.info(f"Query Embeddings already exists in folder {output_folder}")
         embs = np.load(f"{output_folder}/query_embeddings.npy", allow_pickle=True)
         return embs
     else:
-        query_embeddings = []
-        for json_line in tqdm(data, desc="Embedding queries into {}".format(output_folder)):
-            if json_line:
-                query = json_line["query"]
-                query_emb = embedder.embed([query])
-                query_embeddings.extend(query_emb)
-
-        embeddings = np.vstack(query_embeddings)
+        queries = [json_line["query"] for json_line in iter_jsonl([datasetpath])]
+        logger.info(f"Embedding {len(queries)} queries into {output_folder}")
+        embeddings = embed_bucketed(embedder, queries, batch_size)
         
         os.makedirs(output_folder, exist_ok=True)
         np.save(f"{output_folder}/query_embeddings.npy", embeddings)
@@ -190,6 +245,7 @@ def main(config):
     data_dir = config.get("data_folder")
     models = config.get("models")
     force_embedding_creation = config.get("force_embedding_creation", False)  # Default to False if missing
+    embedding_batch_size = int(config.get("embedding_batch_size", 64))
     evaluation_datasetpath = config.get("evaluation_dataset")
     results_output_filepath = config.get("results_output")
 
@@ -229,11 +285,11 @@ def main(config):
         os.makedirs(output_folder, exist_ok=True)
 
         # Create embeddings for model
-        embeddings, curpus_index, avg_embedding_time = create_embeddings(embedder, files, output_folder, force_embedding_creation)
+        embeddings, curpus_index, avg_embedding_time = create_embeddings(embedder, files, output_folder, force_embedding_creation, batch_size=embedding_batch_size)
         logger.info(f"Average embedding time for {model_id}: {avg_embedding_time:.4f} seconds")
 
         # Load the evaluation (query) embeddings for model evaluation
-        ground_truth_embeddings = load_evaluation_dataset(embedder, evaluation_datasetpath, output_folder)
+        ground_truth_embeddings = load_evaluation_dataset(embedder, evaluation_datasetpath, output_folder, batch_size=embedding_batch_size)
 
         # Move embeddings to the selected device
         corpus_embeddings = torch.from_numpy(embeddings).to(device)
@@ -1,4 +1,5 @@
 from typing import List, Optional
+from contextlib import nullcontext
 import torch
 from transformers import PreTrainedModel, PreTrainedTokenizer, BatchEncoding
 from transformers import AutoTokenizer, AutoModel
@@ -19,11 +20,26 @@ from tools.optimal_embeddings_model.data_types.email import Email, MessageType
 
 class Embedder:
 
-    def __init__(self, model: PreTrainedModel, tokenizer: PreTrainedTokenizer):
+    def __init__(self, model: PreTrainedModel, tokenizer: PreTrainedTokenizer, profiler=None):
+        """
+        Args:
+            model: PreTrainedModel: The embedding model
+            tokenizer: PreTrainedTokenizer: The tokenizer of the model
+            profiler: optional object with a `profile(attention_mask)` context manager wrapped around every forward pass
+        """
         self.model = model
         self.model.eval()
         self.tokenizer = tokenizer
         self.max_length = self.model.config.max_position_embeddings  # Model-specific max lengt
+        self.profiler = profiler
+
+    def forward(self, inputs: BatchEncoding):
+        """
+        Model forward pass in inference mode (no autograd tracking or version counters)
+        """
+        profile = self.profiler.profile(inputs["attention_mask"]) if self.profiler is not None else nullcontext()
+        with torch.inference_mode(), profile:
+            return self.model(**inputs)
 
     def batch_embed(self, documents:List[str]) -> np.ndarray:
         """
@@ -34,12 +50,12 @@ class Embedder:
         inputs = self.tokenizer(documents, max_length=self.max_length, padding=True, truncation=True, return_tensors="pt")
         inputs = inputs.to(self.model.device)
         
-        with torch.no_grad():
-            outputs = self.model(**inputs)
+        outputs = self.forward(inputs)
         
         # Get embeddings for each chunk.
-        embeddings = self.mean_pooling(outputs, inputs['attention_mask'])
-        embeddings = F.normalize(embeddings, p=2, dim=1)
+        with torch.inference_mode():
+            embeddings = self.mean_pooling(outputs, inputs['attention_mask'])
+            embeddings = F.normalize(embeddings, p=2, dim=1)
     
         # Return the final document embeddings as a numpy array.
         return embeddings.cpu().numpy()
@@ -60,13 +76,13 @@ class Embedder:
         inputs = self.tokenizer(text, max_length=self.max_length, padding=True, truncation=True, return_tensors="pt")
         inputs = inputs.to(self.model.device)
 
-        with torch.no_grad():
-            # Forward pass
-            outputs = self.model(**inputs)
+        # Forward pass
+        outputs = self.forward(inputs)
         
         # Perform pooling.
-        sentence_embeddings = self.mean_pooling(outputs, inputs['attention_mask'])
-        sentence_embeddings = F.normalize(sentence_embeddings, p=2, dim=1)
+        with torch.inference_mode():
+            sentence_embeddings = self.mean_pooling(outputs, inputs['attention_mask'])
+            sentence_embeddings = F.normalize(sentence_embeddings, p=2, dim=1)
 
         # Convert to numpy array and return
         # Move tensors in the list to CPU and convert them to numpy arrays
@@ -0,0 +1,49 @@
+from typing import Optional, Sequence
+import numpy as np
+
+def find_knee(scores: Sequence[float], sensitivity: float = 1.0) -> Optional[int]:
+    """
+    Knee point of a convex, decreasing curve of scores (e.g. ranked similarity scores).
+    Same result as kneed.KneeLocator(range(len(scores)), scores, curve="convex", direction="decreasing", S=sensitivity).knee
+    (offline mode, first knee), computed in a single vectorized pass without scipy.
+    Args:
+        scores: Sequence[float]: scores in descending order
+        sensitivity: float: kneed sensitivity S (higher waits for a more pronounced knee)
+    Returns:
+        Optional[int]: index of the knee, None if there is no knee
+    """
+    y = np.asarray(scores, dtype=np.float64)
+    n = y.shape[0]
+    if n < 2:
+        return None
+    y_min = y.min()
+    y_range = y.max() - y_min
+    if y_range == 0:
+        return None
+
+    # normalize to the unit square and flip the convex decreasing curve into a concave increasing one
+    x_normalized = np.arange(n) / (n - 1)
+    y_normalized = 1.0 - (y - y_min) / y_range
+    difference = y_normalized - x_normalized
+
+    # local maxima and minima of the difference curve (scipy argrelextrema with order=1, mode="clip")
+    previous = np.concatenate((difference[:1], difference[:-1]))
+    following = np.concatenate((difference[1:], difference[-1:]))
+    is_maximum = (difference >= previous) & (difference >= following)
+    is_minimum = (difference <= previous) & (difference <= following)
+    if not is_maximum.any():
+        return None
+
+    # the threshold is set at every maximum and reset to 0 at every minimum, the knee is the last maximum
+    # before the difference curve first drops below the current threshold
+    indices = np.arange(n)
+    threshold_at_maximum = difference - sensitivity * abs(np.diff(x_normalized).mean())
+    last_event = np.maximum.accumulate(np.where(is_maximum | is_minimum, indices, -1))
+    last_maximum = np.maximum.accumulate(np.where(is_maximum, indices, -1))
+
+    candidates = indices[int(np.argmax(is_maximum)):n - 1]
+    threshold = np.where(is_minimum[last_event[candidates]], 0.0, threshold_at_maximum[last_event[candidates]])
+    below = difference[candidates + 1] < threshold
+    if not below.any():
+        return None
+    return int(last_maximum[candidates[int(np.argmax(below))]])
@@ -0,0 +1,34 @@
+from typing import Optional, Sequence, Tuple
+
+# which path the cascade took (reported in search responses and counted by the evaluator)
+RERANK_NONE = "none"
+RERANK_SKIPPED = "skipped"
+RERANK_BAND = "band"
+RERANK_FULL = "full"
+
+def cascade_rerank_range(scores: Sequence[float], knee: Optional[int], gap_threshold: float, band: int) -> Tuple[str, int, int]:
+    """
+    Decide which part of a dense ranked result list still needs the cross-encoder.
+    If the dense scores drop sharply at the knee the dense order is already decisive and reranking is skipped,
+    otherwise only the ambiguous band around the knee is reranked. Without a usable knee everything is reranked.
+    Args:
+        scores: Sequence[float]: dense scores in descending order
+        knee: Optional[int]: knee point (index into scores)
+        gap_threshold: float: minimal score drop at the knee to skip reranking
+        band: int: number of results on each side of the knee to rerank
+    Returns:
+        Tuple[str, int, int]: rerank path and the [start, end) range of results to rerank
+    """
+    n = len(scores)
+    if knee is None or knee <= 0 or knee >= n:
+        return RERANK_FULL, 0, n
+
+    gap = scores[knee - 1] - scores[knee]
+    if gap >= gap_threshold:
+        return RERANK_SKIPPED, 0, 0
+
+    start = max(0, knee - band)
+    end = min(n, knee + band)
+    if start == 0 and end == n:
+        return RERANK_FULL, 0, n
+    return RERANK_BAND, start, end
@@ -15,7 +15,10 @@ import torch
 import torch.nn.functional as F
 from dotenv import load_dotenv
 from sentence_transformers.cross_encoder.CrossEncoder import CrossEncoder
+from collections import Counter
 import os
+from mailio_ai_libs.rerank_cascade import cascade_rerank_range
+from mailio_ai_libs.knee import find_knee
 
 load_dotenv()
 
@@ -53,6 +56,10 @@ class MailioInformationRetrievalEvaluator:
         corpus_index: np.ndarray = None,
         corpus_database: pd.DataFrame = None,
         query_database: pd.DataFrame = None,
+        rerank_gap_threshold: float = None,
+        rerank_band: int = 3,
+        query_block_size: int = 256,
+        corpus_chunk_size: int = 50000,
         ) -> None:
         """
         Initializes the InformationRetrievalEvaluator.
@@ -65,6 +72,10 @@ class MailioInformationRetrievalEvaluator:
             accuracy_at_k (List[int]): A list of integers representing the values of k for accuracy calculation. Defaults to [1, 3, 5, 10].
             precision_recall_at_k (List[int]): A list of integers representing the values of k for precision and recall calculation. Defaults to [1, 3, 5, 10].
             map_at_k (List[int]): A list of integers representing the values of k for MAP calculation. Defaults to [100].
+            rerank_gap_threshold (float): If set, also evaluates the cascade rerank policy of the search API (skip reranking when the dense score gap at the knee is at least this). Defaults to None.
+            rerank_band (int): Number of results on each side of the knee reranked by the cascade policy. Defaults to 3.
+            query_block_size (int): Number of queries scored together in one matrix multiply. Defaults to 256.
+            corpus_chunk_size (int): Number of documents scored at once, top-k is merged across chunks (bounds memory to query_block_size x corpus_chunk_size). Defaults to 50000.
         """
         self.corpus_embeddings = corpus_embeddings
         self.query_embeddings = query_embeddings
@@ -81,7 +92,14 @@ class MailioInformationRetrievalEvaluator:
         self.corpus_index = corpus_index
         self.corpus_database = corpus_database
         self.query_database = query_database
+        self.rerank_gap_threshold = rerank_gap_threshold
+        self.rerank_band = rerank_band
+        self.rerank_paths = Counter()
+        self.query_block_size = query_block_size
+        self.corpus_chunk_size = corpus_chunk_size
         self.ce_model = None
+        self.corpus_rows: Dict[str, int] = {}
+        self._corpus_texts: Dict[str, str] = {}
         if self.reranking_model:
             if self.corpus_index is None:
                 raise ValueError("corpus_index must be provided for reranking")
@@ -89,6 +107,9 @@ class MailioInformationRetrievalEvaluator:
                 raise ValueError("query_database must be provided for reranking")
             if self.corpus_database is None:
                 raise ValueError("corpus_database must be provided for reranking")
+            # message_id => row of the corpus database (first row of duplicated ids)
+            for row, message_id in enumerate(self.corpus_database.message_id):
+                self.corpus_rows.setdefault(message_id, row)
             # if everything defined well load cross encoder model    
             self.ce_model = CrossEncoder(reranking_model, max_length=self.reranking_model_max_length)
 
@@ -119,15 +140,18 @@ class MailioInformationRetrievalEvaluator:
         metrics = {}
         for sim_fn in self.similarity_functions:
             similarity_name = str(sim_fn.value)
-            queries_results, query_results_reranked = self.compute_similarity_function_product(sim_fn, top_k=max_k)
+            queries_results, query_results_reranked, query_results_cascade = self.compute_similarity_function_product(sim_fn, top_k=max_k)
             similarity_metrics = self.compute_metrics(queries_results)
             if len(query_results_reranked) > 0:
                 similarity_metrics_reranked = self.compute_metrics(query_results_reranked)
                 metrics[f"{similarity_name}_reranked"] = similarity_metrics_reranked
+            if len(query_results_cascade) > 0:
+                metrics[f"{similarity_name}_cascade"] = self.compute_metrics(query_results_cascade)
+                logger.info(f"Cascade rerank paths ({similarity_name}): {dict(self.rerank_paths)}")
             metrics[similarity_name] = similarity_metrics
         return metrics
     
-    def compute_similarity_function_product(self, similarity_function: SimilarityFunction, top_k: int = 100) -> Tuple[Dict[int, List[Tuple[float, int]]], Dict[int, List[Tuple[float, int]]]]:
+    def compute_similarity_function_product(self, similarity_function: SimilarityFunction, top_k: int = 100) -> Tuple[Dict[int, List[Tuple[float, int]]], Dict[int, List[Tuple[float, int]]], Dict[int, List[Tuple[float, int]]]]:
         """
         Computes the evaluation metrics for a given similarity function.
         Args:
@@ -135,38 +159,18 @@ class MailioInformationRetrievalEvaluator:
             top_k (int): The number of retrieved documents for which to compute the evaluation metrics. Defaults to 10.
         Returns:
             Dict[int, List[Tuple[float, int]]] : A dictionary mapping query indexes to a list of tuples containing the similarity score and the document index.
+            (dense results, fully reranked results and cascade reranked results; the last two are empty without a reranking model)
         """
 
         query_results = {}
         query_results_reranked = {}
+        query_results_cascade = {}
+        self.rerank_paths = Counter()
         
-        # compute the similarity between each query and each document
-        if similarity_function == SimilarityFunction.COSINE:
-            for query_index in range(len(self.query_embeddings)):
-                query_embedding = self.query_embeddings[query_index]
-                similarity = F.cosine_similarity(query_embedding, self.corpus_embeddings, dim=1)
-                scores, indices = similarity.topk(top_k, dim=0)
-                s = scores.cpu().numpy().ravel()
-                i = indices.cpu().numpy().ravel()
-                query_results[query_index] = [(s, i) for s, i in zip(s, i)]
-        
-        if similarity_function == SimilarityFunction.DOT_PRODUCT:
-            for query_index in range(len(self.query_embeddings)):
-                query_embedding = self.query_embeddings[query_index]
-                similarity = torch.matmul(self.corpus_embeddings, query_embedding)
-                scores, indices = similarity.topk(top_k, dim=0)
-                s = scores.cpu().numpy().ravel()
-                i = indices.cpu().numpy().ravel()
-                query_results[query_index] = [(s, i) for s, i in zip(s, i)]
-
-        if similarity_function == SimilarityFunction.EUCLIDEAN:
-            for query_index in range(len(self.query_embeddings)):
-                query_embedding = self.query_embeddings[query_index]
-                similarity = torch.cdist(query_embedding.unsqueeze(0), self.corpus_embeddings, p=2).squeeze()
-                scores, indices = similarity.topk(top_k, dim=0, largest=False)
-                s = scores.cpu().numpy().ravel()
-                i = indices.cpu().numpy().ravel()
-                query_results[query_index] = [(s, i) for s, i in zip(s, i)]
+        # compute the similarity between each query and each document (query blocks x corpus chunks)
+        all_scores, all_indices = self.top_k_similarities(similarity_function, top_k)
+        for query_index in range(len(all_scores)):
+            query_results[query_index] = [(s, i) for s, i in zip(all_scores[query_index], all_indices[query_index])]
 
         # rerank the results using the cross encoder model
         if self.ce_model:
@@ -179,7 +183,7 @@ class MailioInformationRetrievalEvaluator:
                 # collect results and create query, paragraph tuples
                 ids = self.corpus_index[indices]
                 query_paragraph_tuples: list[Tuple[str, str]] = [
-                    (query, " ".join(corpus_database[corpus_database.message_id == _id].sentences.iloc[0]))
+                    (query, self.corpus_text(_id))
                     for _id in ids
                 ]
                 ce_scores = self.ce_model.predict(query_paragraph_tuples, show_progress_bar=False)
@@ -190,8 +194,90 @@ class MailioInformationRetrievalEvaluator:
                 sorted_scores = [score for score, id in sorted_by_score]
                 # replace query_results with the new sorted results
                 query_results_reranked[query_index] = [(s, i) for s, i in zip(sorted_scores, sorted_ids)]
+
+                # cascade policy of the search API: rerank only the ambiguous band around the knee
+                if self.rerank_gap_threshold is not None:
+                    query_results_cascade[query_index] = self.cascade_rerank(score_indices, ce_scores, similarity_function)
             
-        return query_results, query_results_reranked
+        return query_results, query_results_reranked, query_results_cascade
+
+    def top_k_similarities(self, similarity_function: SimilarityFunction, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k documents of every query. Queries are scored in blocks with one matrix multiply (or cdist) per
+        corpus chunk, the per chunk top-k candidates are merged into a running top-k.
+        Args:
+            similarity_function (SimilarityFunction): The similarity function
+            top_k (int): The number of documents per query
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: scores and document indexes of shape (M, top_k), ordered by relevance
+        """
+        corpus = self.corpus_embeddings
+        queries = self.query_embeddings
+        if similarity_function == SimilarityFunction.COSINE:
+            # normalized once, cosine similarity is then a dot product
+            corpus = F.normalize(corpus, p=2, dim=1)
+            queries = F.normalize(queries, p=2, dim=1)
+        largest = similarity_function != SimilarityFunction.EUCLIDEAN
+        top_k = min(top_k, corpus.shape[0])
+
+        all_scores, all_indices = [], []
+        with torch.inference_mode():
+            for block_start in range(0, queries.shape[0], self.query_block_size):
+                block = queries[block_start:block_start + self.query_block_size]
+                best_scores, best_indices = None, None
+                for chunk_start in range(0, corpus.shape[0], self.corpus_chunk_size):
+                    chunk = corpus[chunk_start:chunk_start + self.corpus_chunk_size]
+                    if similarity_function == SimilarityFunction.EUCLIDEAN:
+                        similarity = torch.cdist(block, chunk, p=2)
+                    else:
+                        similarity = torch.matmul(block, chunk.T)
+                    scores, indices = similarity.topk(min(top_k, chunk.shape[0]), dim=1, largest=largest)
+                    indices = indices + chunk_start
+                    if best_scores is not None:
+                        # merge with the candidates of the previous chunks
+                        scores = torch.cat([best_scores, scores], dim=1)
+                        indices = torch.cat([best_indices, indices], dim=1)
+                        scores, order = scores.topk(min(top_k, scores.shape[1]), dim=1, largest=largest)
+                        indices = torch.gather(indices, 1, order)
+                    best_scores, best_indices = scores, indices
+                all_scores.append(best_scores.cpu().numpy())
+                all_indices.append(best_indices.cpu().numpy())
+        return np.concatenate(all_scores), np.concatenate(all_indices)
+
+    def corpus_text(self, message_id: str) -> str:
+        """
+        Text of a corpus document for the cross encoder (looked up through the message_id => row index)
+        """
+        text = self._corpus_texts.get(message_id)
+        if text is None:
+            text = " ".join(self.corpus_database.sentences.iloc[self.corpus_rows[message_id]])
+            self._corpus_texts[message_id] = text
+        return text
+
+    def cascade_rerank(self, score_indices: List[Tuple[float, int]], ce_scores: List[float], similarity_function: SimilarityFunction) -> List[Tuple[float, int]]:
+        """
+        Applies the cascade rerank policy to dense results of a single query.
+        Args:
+            score_indices (List[Tuple[float, int]]): dense results (score, document index) ordered by relevance
+            ce_scores (List[float]): cross encoder scores of the dense results (same order)
+            similarity_function (SimilarityFunction): the similarity function of the dense scores
+        Returns:
+            List[Tuple[float, int]]: the results after the cascade (score, document index)
+        """
+        dense_scores = [float(s) for s, i in score_indices]
+        if similarity_function == SimilarityFunction.EUCLIDEAN:
+            # distances are increasing, the policy expects decreasing relevance
+            dense_scores = [-s for s in dense_scores]
+
+        knee = None
+        if len(dense_scores) > 3:
+            knee = find_knee(dense_scores)
+
+        path, start, end = cascade_rerank_range(dense_scores, knee, self.rerank_gap_threshold, self.rerank_band)
+        self.rerank_paths[path] += 1
+
+        band = sorted(zip(ce_scores[start:end], [i for s, i in score_indices[start:end]]), key=lambda x: x[0], reverse=True)
+        return list(score_indices[:start]) + [(s, i) for s, i in band] + list(score_indices[end:])
 
     def compute_metrics(self, queries_results: Dict[int, List[Tuple[float, int]]]):
         """